@@ -0,0 +1,102 @@
+"""Compares the combobox list models: a QStandardItemModel with one item per
+row (how the comboboxes used to be built) and lazymodel.IdListModel (ids and
+names in two arrays, sorted once and set in one reset).
+
+Each run builds one model of --rows rows in a fresh Python process, sets it
+on a QComboBox (Qt uses the offscreen platform) and records:
+
+    load_seconds  building the model and setting it on the combobox
+    rss_mb        resident memory the model added
+
+Medians are printed and can be saved as JSON and compared with a saved
+baseline like the other benchmarks.
+
+    python benchmarks/listmodel.py --rows 50000 --output listmodel.json
+    python benchmarks/listmodel.py --rows 50000 --baseline listmodel.json"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+import report
+
+# Runs in the child process: argv is the model kind and the row count
+CHILD = r'''
+import json, os, random, sys, time
+from PySide6 import QtCore, QtGui, QtWidgets
+from lazymodel import IdListModel
+
+def rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1048576
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+kind, count = sys.argv[1], int(sys.argv[2])
+app = QtWidgets.QApplication([])
+combobox = QtWidgets.QComboBox()
+rng = random.Random(1)
+rows = [{'id': i, 'name': f'{rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ")}{rng.random():.12f} User {i}'}
+        for i in range(1, count + 1)]
+before = rss_mb()
+started = time.perf_counter()
+if kind == 'standard':
+    model = QtGui.QStandardItemModel()
+    for row in rows:
+        item = QtGui.QStandardItem(row['name'])
+        item.setData(row['id'])
+        model.appendRow(item)
+    model.sort(0, QtCore.Qt.AscendingOrder)
+else:
+    model = IdListModel.from_rows(rows)
+combobox.setModel(model)
+elapsed = time.perf_counter() - started
+print('LISTMODEL ' + json.dumps({'load_seconds': elapsed, 'rss_mb': rss_mb() - before}), flush=True)
+os._exit(0)
+'''
+
+KINDS = ('standard', 'arrays')
+
+
+def run_once(kind, rows):
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD, kind, str(rows)],
+        env=report.benchmark_env(''), capture_output=True, text=True, timeout=600,
+    )
+    for line in output.stdout.splitlines():
+        if line.startswith('LISTMODEL '):
+            return json.loads(line[len('LISTMODEL '):])
+    raise RuntimeError(f'{kind} model did not finish:\n{output.stdout}\n{output.stderr}')
+
+
+def benchmark(runs, rows):
+    return {kind: report.summarise([run_once(kind, rows) for _ in range(runs)]) for kind in KINDS}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the combobox list models.')
+    parser.add_argument('--runs', type=int, default=3, help='Runs of each model (default 3)')
+    parser.add_argument('--rows', type=int, default=50000, help='Rows in the list (default 50000)')
+    parser.add_argument('--output', help='Save the results to this JSON file')
+    parser.add_argument('--baseline', help='Compare with results saved by --output')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Slowdown allowed against the baseline (default 0.2 = 20%%)')
+    args = parser.parse_args()
+
+    results = benchmark(args.runs, args.rows)
+    for kind, metrics in results.items():
+        print(f'{kind:8} {args.rows} rows: load {metrics["load_seconds"]["median"]:.3f}s  '
+              f'memory {metrics["rss_mb"]["median"]:.1f} MB')
+    if args.output:
+        report.save(args.output, results, runs=args.runs, rows=args.rows)
+    if args.baseline:
+        if not report.compare(results, report.load(args.baseline), args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
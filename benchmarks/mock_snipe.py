@@ -0,0 +1,420 @@
+"""A small stand-in for the Snipe-IT API, used by the benchmarks.
+
+Serves the parts of the API Snipe Assist uses:
+
+    GET  <endpoint>                  paginated list (limit, offset, search,
+                                     sort, order)
+    GET  <endpoint>/<id>             one row
+    POST hardware                    create an asset (asset_tag must be unique)
+    POST hardware/<id>/checkout      check an asset out
+
+Every response can be slowed by a fixed latency plus random jitter, and a
+share of requests can be answered with a 500 (error_rate) or a 429 with
+Retry-After (throttle_rate).  checkout_on_create picks what a create with
+check out fields does: 'apply' checks the new asset out (as Snipe-IT
+does), 'ignore' creates it without checking it out, and 'reject' answers
+with a validation error, as older servers do.  Run it on its own with
+
+    python benchmarks/mock_snipe.py --rows 5000 --hardware 100000 --latency 0.05
+
+and point SNIPE_URL at http://127.0.0.1:8000/api/v1/"""
+
+import argparse
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'snipeassist'))
+from project import all_snipe_endpoints  # noqa: E402
+
+API_PREFIX = '/api/v1/'
+MAX_LIMIT = 500
+FIELDSETS = 5
+CREATED = 'Asset created successfully. :)'
+CHECKED_OUT = 'Asset checked out successfully.'
+
+
+def _stamp(i):
+    # Older ids were updated longer ago
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(1700000000 + i * 60))
+
+
+def _date(stamp):
+    return {'datetime': stamp, 'formatted': stamp}
+
+
+# Parts of a Snipe-IT hardware and users row the benchmarks do not read.
+# They are shared between rows: only the size of the JSON matters.
+_ASSET_DETAILS = {
+    'byod': 0,
+    'status_label': {'id': 1, 'name': 'Ready to Deploy', 'status_type': 'deployable', 'status_meta': 'deployable'},
+    'category': {'id': 1, 'name': 'Laptops'},
+    'manufacturer': {'id': 1, 'name': 'Manufacturer 00001'},
+    'supplier': {'id': 1, 'name': 'Suppliers 00001'},
+    'notes': None,
+    'order_number': 'PO-000123',
+    'company': {'id': 1, 'name': 'Companies 00001'},
+    'location': {'id': 1, 'name': 'Locations 00001'},
+    'rtd_location': {'id': 1, 'name': 'Locations 00001'},
+    'image': None,
+    'qr': None,
+    'alt_barcode': None,
+    'warranty_months': '36 months',
+    'warranty_expires': _date('2027-01-01'),
+    'created_at': _date('2023-01-01 09:00:00'),
+    'last_audit_date': None,
+    'next_audit_date': None,
+    'deleted_at': None,
+    'purchase_date': _date('2023-01-01'),
+    'age': '1 year ago',
+    'last_checkout': None,
+    'expected_checkin': None,
+    'purchase_cost': '1,299.00',
+    'checkin_counter': 0,
+    'checkout_counter': 0,
+    'requests_counter': 0,
+    'user_can_checkout': True,
+    'custom_fields': {
+        f'Field 1.{j}': {'field': f'_snipeit_field_1_{j}', 'value': None, 'field_format': 'ANY', 'element': 'text'}
+        for j in range(3)
+    },
+    'available_actions': {'checkout': True, 'checkin': True, 'clone': True, 'restore': False,
+                          'update': True, 'delete': True},
+}
+_USER_DETAILS = {
+    'avatar': 'https://snipe.example/img/default-sm.png',
+    'jobtitle': 'Engineer',
+    'manager': None,
+    'employee_num': '',
+    'phone': None,
+    'website': None,
+    'address': None,
+    'city': None,
+    'state': None,
+    'country': None,
+    'zip': None,
+    'department': {'id': 1, 'name': 'IT'},
+    'location': {'id': 1, 'name': 'Locations 00001'},
+    'notes': '',
+    'permissions': {'superuser': '0', 'admin': '0', 'import': '0', 'reports.view': '0', 'assets.view': '1'},
+    'activated': True,
+    'autoassign_licenses': True,
+    'ldap_import': False,
+    'two_factor_enrolled': False,
+    'two_factor_optin': False,
+    'assets_count': 1,
+    'licenses_count': 0,
+    'accessories_count': 0,
+    'consumables_count': 0,
+    'company': {'id': 1, 'name': 'Companies 00001'},
+    'created_at': _date('2023-01-01 09:00:00'),
+    'updated_at': _date('2023-01-01 09:00:00'),
+    'last_login': None,
+    'deleted_at': None,
+    'groups': None,
+    'available_actions': {'update': True, 'delete': True, 'clone': True, 'restore': False},
+}
+
+
+def make_dataset(rows, hardware):
+    """Returns {endpoint: [rows]}.  The reference lists have rows rows,
+    statuslabels 10, fieldsets FIELDSETS and hardware hardware.  hardware
+    and users rows have the fields a Snipe-IT server returns."""
+    data = {endpoint: [] for endpoint in all_snipe_endpoints if '/' not in endpoint}
+    for endpoint in data:
+        data[endpoint] = [{'id': i, 'name': f'{endpoint.title()} {i:05}'} for i in range(1, rows + 1)]
+    data['statuslabels'] = [{'id': i, 'name': f'Status {i}'} for i in range(1, 11)]
+    data['models'] = [
+        {
+            'id': i,
+            'name': f'Model {i:05}',
+            'fieldset': {'id': i % FIELDSETS + 1, 'name': ''} if i % 3 else None,
+        }
+        for i in range(1, rows + 1)
+    ]
+    data['users'] = [
+        dict(_USER_DETAILS, id=i, name=f'User {i:05}', username=f'user{i:05}',
+             first_name='User', last_name=f'{i:05}', email=f'user{i:05}@example.com')
+        for i in range(1, rows + 1)
+    ]
+    data['fieldsets'] = [
+        {
+            'id': i,
+            'name': f'Fieldset {i}',
+            'fields': {
+                'total': 3,
+                'rows': [
+                    {
+                        'id': i * 10 + j,
+                        'name': f'Field {i}.{j}',
+                        'db_column_name': f'_snipeit_field_{i}_{j}',
+                        'field_values_array': ['Yes', 'No'] if j == 0 else None,
+                    }
+                    for j in range(3)
+                ],
+            },
+        }
+        for i in range(1, FIELDSETS + 1)
+    ]
+    data['hardware'] = [
+        dict(
+            _ASSET_DETAILS,
+            id=i,
+            name=f'Asset {i:07}',
+            asset_tag=f'TAG{i:07}',
+            serial=f'SN{i:09}',
+            model={'id': i % rows + 1, 'name': f'Model {i % rows + 1:05}'},
+            model_number=f'MN-{i % rows + 1:05}',
+            updated_at=_date(_stamp(i)),
+            assigned_to=None,
+        )
+        for i in range(1, hardware + 1)
+    ]
+    return data
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients that time out or give up mid-response are expected
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def _sort_key(field):
+    def key(row):
+        value = row.get(field)
+        if isinstance(value, dict):
+            value = value.get('datetime') or value.get('name')
+        return (value is None, value)
+    return key
+
+
+class MockSnipe:
+    """Serves a generated dataset on 127.0.0.1.  port=0 picks a free port.
+    latency and jitter are in seconds; error_rate and throttle_rate are the
+    share (0 to 1) of requests answered with a 500 or a 429."""
+
+    def __init__(self, rows=1000, hardware=1000, port=0, latency=0.0, jitter=0.0,
+                 error_rate=0.0, throttle_rate=0.0, seed=None, checkout_on_create='apply'):
+        self.data = make_dataset(rows, hardware)
+        self.by_id = {
+            endpoint: {r['id']: r for r in endpoint_rows}
+            for endpoint, endpoint_rows in self.data.items()
+        }
+        self.tags = {r['asset_tag'].lower() for r in self.data['hardware']}
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.checkout_on_create = checkout_on_create
+        self.counts = {'requests': 0, 'errors': 0, 'throttled': 0, 'created': 0, 'checked_out': 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = _Server(('127.0.0.1', port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self._server.server_address[1]}{API_PREFIX}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def _count(self, key):
+        with self._lock:
+            self.counts[key] += 1
+
+    def _fault(self):
+        """Sleeps for the latency and picks an injected failure, if any"""
+        with self._lock:
+            self.counts['requests'] += 1
+            delay = self.latency + self._random.uniform(0, self.jitter) if self.jitter else self.latency
+            roll = self._random.random()
+        if delay:
+            time.sleep(delay)
+        if roll < self.throttle_rate:
+            self._count('throttled')
+            return 429
+        if roll < self.throttle_rate + self.error_rate:
+            self._count('errors')
+            return 500
+        return None
+
+    def list_page(self, endpoint, query):
+        rows = self.data[endpoint]
+        search = query.get('search', [''])[0].lower()
+        if search:
+            rows = [r for r in rows if search in str(r.get('name', '')).lower()
+                    or search in str(r.get('asset_tag', '')).lower()
+                    or search in str(r.get('serial', '')).lower()]
+        sort = query.get('sort', [None])[0]
+        if sort:
+            rows = sorted(rows, key=_sort_key(sort), reverse=query.get('order', ['asc'])[0] == 'desc')
+        limit = min(int(query.get('limit', [50])[0]), MAX_LIMIT)
+        offset = int(query.get('offset', [0])[0])
+        return {'total': len(rows), 'rows': rows[offset:offset + limit]}
+
+    def create_asset(self, asset):
+        tag = str(asset.get('asset_tag', '')).lower()
+        asset = dict(asset)
+        kind = asset.pop('checkout_to_type', None)
+        assigned = asset.pop('assigned_' + str(kind), None)
+        if kind and self.checkout_on_create == 'reject':
+            return {'status': 'error', 'payload': None,
+                    'messages': {'checkout_to_type': ['The checkout to type field is not allowed.'],
+                                 'assigned_' + kind: ['The assigned ' + kind + ' field is not allowed.']}}
+        with self._lock:
+            if tag and tag in self.tags:
+                return {'status': 'error', 'messages': {'asset_tag': ['The asset tag must be unique.']},
+                        'payload': None}
+            if tag:
+                self.tags.add(tag)
+            snipe_id = (self.data['hardware'][-1]['id'] if self.data['hardware'] else 0) + 1
+            row = dict(asset, id=snipe_id, assigned_to=None,
+                       updated_at={'datetime': time.strftime('%Y-%m-%d %H:%M:%S')})
+            self.data['hardware'].append(row)
+            self.by_id['hardware'][snipe_id] = row
+            self.counts['created'] += 1
+            if kind and assigned is not None and self.checkout_on_create == 'apply':
+                row['assigned_to'] = {'id': assigned, 'type': kind}
+                self.counts['checked_out'] += 1
+        return {'status': 'success', 'messages': CREATED, 'payload': row}
+
+    def touch(self, endpoint, ids):
+        """Marks rows as updated now, as an edit in Snipe would"""
+        stamp = time.strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock:
+            for snipe_id in ids:
+                self.by_id[endpoint][snipe_id]['updated_at'] = {'datetime': stamp}
+
+    def checkout_asset(self, snipe_id, payload):
+        with self._lock:
+            row = self.by_id['hardware'].get(snipe_id)
+            kind = payload.get('checkout_to_type')
+            assigned = payload.get('assigned_' + str(kind))
+            if row is None or assigned is None:
+                return {'status': 'error', 'messages': 'Asset not found' if row is None else 'Invalid target',
+                        'payload': None}
+            row['assigned_to'] = {'id': assigned, 'type': kind}
+            row['updated_at'] = {'datetime': time.strftime('%Y-%m-%d %H:%M:%S')}
+            self.counts['checked_out'] += 1
+        return {'status': 'success', 'messages': CHECKED_OUT, 'payload': {'asset': row.get('asset_tag')}}
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                # Answer small requests straight away, as a real server would,
+                # rather than waiting on delayed ACKs
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body, headers=None):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _route(self):
+                """Returns (endpoint, id or None, rest) or None if unknown"""
+                url = urlparse(self.path)
+                if not url.path.startswith(API_PREFIX):
+                    return None
+                parts = url.path[len(API_PREFIX):].strip('/').split('/')
+                if parts[0] not in mock.data:
+                    return None
+                snipe_id = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else None
+                return parts[0], snipe_id, parts[2:], parse_qs(url.query)
+
+            def _faulted(self):
+                fault = mock._fault()
+                if fault == 429:
+                    self._send(429, {'status': 'error', 'messages': 'Too Many Requests'},
+                               {'Retry-After': '1'})
+                elif fault == 500:
+                    self._send(500, {'status': 'error', 'messages': 'Server Error'})
+                return fault is not None
+
+            def do_GET(self):
+                route = self._route()
+                if self._faulted():
+                    return
+                if route is None:
+                    return self._send(404, {'status': 'error', 'messages': 'Not found'})
+                endpoint, snipe_id, _rest, query = route
+                if snipe_id is None:
+                    return self._send(200, mock.list_page(endpoint, query))
+                row = mock.by_id[endpoint].get(snipe_id)
+                if row is None:
+                    return self._send(404, {'status': 'error', 'messages': 'Not found'})
+                self._send(200, row)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)) or 0)
+                route = self._route()
+                if self._faulted():
+                    return
+                if route is None or route[0] != 'hardware':
+                    return self._send(404, {'status': 'error', 'messages': 'Not found'})
+                _endpoint, snipe_id, rest, _query = route
+                payload = json.loads(body or b'{}')
+                if snipe_id is None:
+                    return self._send(200, mock.create_asset(payload))
+                if rest == ['checkout']:
+                    return self._send(200, mock.checkout_asset(snipe_id, payload))
+                self._send(404, {'status': 'error', 'messages': 'Not found'})
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a mock Snipe-IT API.')
+    parser.add_argument('--rows', type=int, default=1000, help='Rows in each reference list (default 1000)')
+    parser.add_argument('--hardware', type=int, default=1000, help='Assets (default 1000)')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Up to this many random seconds more')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered with a 500')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Share of requests answered with a 429')
+    parser.add_argument('--checkout-on-create', choices=('apply', 'ignore', 'reject'), default='apply',
+                        help='What a create with check out fields does (default apply)')
+    args = parser.parse_args()
+    mock = MockSnipe(rows=args.rows, hardware=args.hardware, port=args.port, latency=args.latency,
+                     jitter=args.jitter, error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+                     checkout_on_create=args.checkout_on_create)
+    print(f'Mock Snipe-IT API at {mock.url}  (Ctrl-C to stop)')
+    try:
+        mock.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,316 @@
+"""Measures the Snipe API paths of Snipe Assist against the mock API.
+
+    get_all    rows per second downloading all hardware, for each page size
+    create     latency of creating an asset (p50/p90/p99), one at a time and
+               with --concurrency requests in flight
+    checkout   latency of checking an asset out, the same way
+    projection seconds, memory held and peak memory downloading all
+               hardware in a child process, keeping whole rows ('full') or
+               only their id and name ('projected')
+    sync       seconds and requests to bring a local copy of hardware up to
+               date: downloading every row ('full') and, after --changes
+               assets are edited, only the changed rows ('delta')
+    refresh    seconds for a full refresh_comboboxes(force=True) in the GUI
+               (Qt offscreen, in a child process).  Injected errors are
+               paused for this one, as a failed list download stops the GUI.
+
+The mock API can add latency, jitter and injected 500 errors to model a real
+server.  Results can be saved as JSON and compared with a saved baseline; a
+metric more than --tolerance worse fails the run (exit status 1).
+
+    python benchmarks/network.py --latency 0.02 --output network.json
+    python benchmarks/network.py --latency 0.02 --baseline network.json"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import report
+from mock_snipe import MockSnipe
+
+PAGE_SIZES = (50, 100, 250, 500)
+
+# Runs in the child process: waits for the first load, then times forced
+# refreshes until the Scan button is enabled again.
+CHILD = r'''
+import json, sys, time
+runs = int(sys.argv[1])
+import snipe_assist
+from PySide6 import QtCore
+app, win = snipe_assist.start([])
+times = []
+started = None
+
+def poll():
+    global started
+    if not win.pushButtonScan.isEnabled():
+        return
+    if started is not None:
+        times.append(time.perf_counter() - started)
+    if len(times) == runs:
+        app.exit(0)
+        return
+    started = time.perf_counter()
+    win.refresh_comboboxes(force=True)
+
+timer = QtCore.QTimer()
+timer.timeout.connect(poll)
+timer.start(1)
+QtCore.QTimer.singleShot(300000, app.exit)
+app.exec()
+print('REFRESH ' + json.dumps(times), flush=True)
+win.pipeline.close(wait=False)
+import os
+os._exit(0)
+'''
+
+
+# Runs in the child process: downloads all hardware one way and reports
+# the time, the memory the rows take and the peak memory while downloading
+PROJECTION_CHILD = r'''
+import json, os, sys, time
+import snipeapi
+
+def rss_mb(field='VmRSS'):
+    # VmHWM is the peak.  ru_maxrss would include the parent's memory from
+    # before the exec.
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) / 1024
+
+mode, snipe_url = sys.argv[1], sys.argv[2]
+fields = ('id', 'name') if mode == 'projected' else None
+before = rss_mb()
+started = time.perf_counter()
+rows = snipeapi.SnipeGet(snipe_url, 'benchmark', 'hardware', fields=fields).get_all()
+seconds = time.perf_counter() - started
+print('PROJECTION ' + json.dumps({
+    'seconds': seconds,
+    'rows': len(rows),
+    'held_mb': rss_mb() - before,
+    'peak_mb': rss_mb('VmHWM') - before,
+}), flush=True)
+os._exit(0)
+'''
+PROJECTION_MODES = ('full', 'projected')
+
+
+def _import_snipeapi(snipe_url):
+    # settings reads the environment when it is first imported
+    os.environ.update(report.benchmark_env(snipe_url))
+    sys.path.insert(0, report.SNIPEASSIST)
+    import snipeapi
+    return snipeapi
+
+
+def bench_get_all(snipeapi, snipe_url, runs):
+    """A get_all with any failed page returns None, so throughput is taken
+    from the runs that succeeded and the rest are counted as failures"""
+    results = {}
+    for size in PAGE_SIZES:
+        api = snipeapi.SnipeGet(snipe_url, 'benchmark', 'hardware', limit=size)
+        times, rows, failures = [], 0, 0
+        for _ in range(runs):
+            started = time.perf_counter()
+            got = api.get_all()
+            if got is None:
+                failures += 1
+                continue
+            times.append(time.perf_counter() - started)
+            rows = len(got)
+        results[str(size)] = {'failures': failures}
+        if times:
+            seconds = sorted(times)[len(times) // 2]
+            results[str(size)].update(seconds=seconds, rows_per_s=rows / seconds if seconds else 0.0)
+    return results
+
+
+def _timed(call, *args):
+    started = time.perf_counter()
+    data = call(*args)
+    return time.perf_counter() - started, data
+
+
+def bench_assets(snipeapi, snipe_url, assets, concurrency):
+    """Creates assets and checks each out, first one at a time and then with
+    concurrency requests in flight.  'combined' creates and checks out in
+    one request each, with concurrency requests in flight."""
+    api = snipeapi.SnipeGet(snipe_url, 'benchmark', 'hardware')
+    stamp = int(time.time() * 1000)
+    results = {}
+    for mode, workers in (('sequential', 1), ('concurrent', concurrency)):
+        tags = [f'BENCH-{stamp}-{mode}-{i}' for i in range(assets)]
+        errors = 0
+
+        def create(tag):
+            asset = {'asset_tag': tag, 'model_id': 1, 'status_id': 1, 'name': tag}
+            return _timed(api.create_asset, asset)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            created = list(executor.map(create, tags))
+            ids = [data['payload']['id'] for _t, data in created if data.get('status') == 'success']
+            errors += len(created) - len(ids)
+            checked = list(executor.map(lambda i: _timed(api.checkout_asset, i, 'user', 1), ids))
+        elapsed = time.perf_counter() - started
+        errors += sum(1 for _t, data in checked if data.get('status') != 'success')
+        results[mode] = {
+            'create': report.percentiles([t for t, _data in created]),
+            'checkout': report.percentiles([t for t, _data in checked]),
+            'assets_per_s': len(ids) / elapsed if elapsed else 0.0,
+            'errors': errors,
+        }
+    tags = [f'BENCH-{stamp}-combined-{i}' for i in range(assets)]
+
+    def create_checked_out(tag):
+        asset = {'asset_tag': tag, 'model_id': 1, 'status_id': 1, 'name': tag}
+        return _timed(api.create_asset_checked_out, asset, 'user', 1)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        created = list(executor.map(create_checked_out, tags))
+    elapsed = time.perf_counter() - started
+    checked_out = sum(1 for _t, (_data, done) in created if done)
+    results['combined'] = {
+        'create': report.percentiles([t for t, _data in created]),
+        'assets_per_s': checked_out / elapsed if elapsed else 0.0,
+        'errors': len(created) - checked_out,
+    }
+    return results
+
+
+def bench_projection(snipe_url, runs):
+    results = {}
+    for mode in PROJECTION_MODES:
+        samples = []
+        for _ in range(runs):
+            output = subprocess.run(
+                [sys.executable, '-c', PROJECTION_CHILD, mode, snipe_url],
+                env=report.benchmark_env(snipe_url), capture_output=True, text=True, timeout=600,
+            )
+            for line in output.stdout.splitlines():
+                if line.startswith('PROJECTION '):
+                    samples.append(json.loads(line[len('PROJECTION '):]))
+                    break
+            else:
+                raise RuntimeError(f'{mode} download did not finish:\n{output.stdout}\n{output.stderr}')
+        results[mode] = report.summarise(samples)
+    return results
+
+
+def bench_sync(snipeapi, mock, snipe_url, runs, changes):
+    """Edits changes assets in the mock between the full and the delta sync
+    of each run, as others using Snipe would"""
+    fields = ('id', 'name', 'updated_at', 'asset_tag', 'serial')
+    samples = {'full': [], 'delta': []}
+    for run in range(runs):
+        sync = snipeapi.DeltaSync(snipeapi.SnipeGet(snipe_url, 'benchmark', 'hardware', fields=fields))
+        for mode in ('full', 'delta'):
+            if mode == 'delta':
+                ids = [r['id'] for r in mock.data['hardware']]
+                mock.touch('hardware', ids[run::max(len(ids) // changes, 1)][:changes])
+            requests = mock.counts['requests']
+            seconds, (changed, _removed) = _timed(sync.sync)
+            samples[mode].append({'seconds': seconds, 'requests': mock.counts['requests'] - requests,
+                                  'changed': len(changed)})
+    return {mode: report.summarise(s) for mode, s in samples.items()}
+
+
+def bench_refresh(mock, snipe_url, runs):
+    error_rate, mock.error_rate = mock.error_rate, 0.0
+    try:
+        output = _run_refresh(snipe_url, runs)
+    finally:
+        mock.error_rate = error_rate
+    for line in output.stdout.splitlines():
+        if line.startswith('REFRESH '):
+            times = json.loads(line[len('REFRESH '):])
+            if len(times) == runs:
+                return dict(report.percentiles(times), seconds=sorted(times)[len(times) // 2])
+    raise RuntimeError(f'Refresh did not finish:\n{output.stdout}\n{output.stderr}')
+
+
+def _run_refresh(snipe_url, runs):
+    with tempfile.TemporaryDirectory() as workdir:
+        output = subprocess.run(
+            [sys.executable, '-c', CHILD, str(runs)],
+            cwd=workdir, env=report.benchmark_env(snipe_url), capture_output=True, text=True, timeout=600,
+        )
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Snipe Assist against a mock Snipe-IT API.')
+    parser.add_argument('--runs', type=int, default=3, help='Runs of each get_all and refresh (default 3)')
+    parser.add_argument('--rows', type=int, default=2000, help='Rows in each reference list (default 2000)')
+    parser.add_argument('--hardware', type=int, default=20000, help='Assets served (default 20000)')
+    parser.add_argument('--assets', type=int, default=200, help='Assets to create and check out (default 200)')
+    parser.add_argument('--changes', type=int, default=10,
+                        help='Assets edited between the full and the delta sync (default 10)')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='Requests in flight for the concurrent create/checkout run (default 8)')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds the mock adds to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Up to this many random seconds more')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered with a 500')
+    parser.add_argument('--skip', action='append', default=[], choices=('get_all', 'assets', 'projection', 'sync', 'refresh'),
+                        help='Leave out a benchmark (can be repeated)')
+    parser.add_argument('--output', help='Save the results to this JSON file')
+    parser.add_argument('--baseline', help='Compare with results saved by --output')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Slowdown allowed against the baseline (default 0.2 = 20%%)')
+    args = parser.parse_args()
+
+    mock = MockSnipe(rows=args.rows, hardware=args.hardware, latency=args.latency, jitter=args.jitter,
+                     error_rate=args.error_rate, seed=1)
+    snipe_url = mock.start()
+    snipeapi = _import_snipeapi(snipe_url)
+    results = {}
+    try:
+        if 'get_all' not in args.skip:
+            results['get_all'] = bench_get_all(snipeapi, snipe_url, args.runs)
+            for size, r in results['get_all'].items():
+                timing = f'{r["seconds"]:.3f}s  {r["rows_per_s"]:,.0f} rows/s' if 'seconds' in r else 'no run succeeded'
+                print(f'get_all limit={size:>3}: {timing}  {r["failures"]} failed')
+        if 'assets' not in args.skip:
+            results['assets'] = bench_assets(snipeapi, snipe_url, args.assets, args.concurrency)
+            for mode, r in results['assets'].items():
+                for op in ('create', 'checkout'):
+                    if op not in r:
+                        continue
+                    print(f'{mode:10} {op:8}: p50 {r[op]["p50"] * 1000:.1f}ms  '
+                          f'p90 {r[op]["p90"] * 1000:.1f}ms  p99 {r[op]["p99"] * 1000:.1f}ms')
+                print(f'{mode:10} {r["assets_per_s"]:.1f} assets/s  {r["errors"]} errors')
+        if 'projection' not in args.skip:
+            results['projection'] = bench_projection(snipe_url, args.runs)
+            for mode, r in results['projection'].items():
+                print(f'{mode:10} {r["rows"]["median"]:.0f} rows: {r["seconds"]["median"]:.3f}s  '
+                      f'held {r["held_mb"]["median"]:.1f} MB  peak {r["peak_mb"]["median"]:.1f} MB')
+        if 'sync' not in args.skip:
+            results['sync'] = bench_sync(snipeapi, mock, snipe_url, args.runs, args.changes)
+            for mode, r in results['sync'].items():
+                print(f'sync {mode:5}: {r["seconds"]["median"]:.3f}s  {r["requests"]["median"]:.0f} requests  '
+                      f'{r["changed"]["median"]:.0f} rows changed')
+        if 'refresh' not in args.skip:
+            results['refresh'] = bench_refresh(mock, snipe_url, args.runs)
+            print(f'refresh_comboboxes: {results["refresh"]["seconds"]:.3f}s')
+    finally:
+        mock.stop()
+    print(f'Mock API: {mock.counts}')
+
+    if args.output:
+        report.save(args.output, results, runs=args.runs, rows=args.rows, hardware=args.hardware,
+                    latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    if args.baseline:
+        if not report.compare(results, report.load(args.baseline), args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
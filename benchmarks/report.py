@@ -0,0 +1,107 @@
+"""Helpers shared by the benchmark scripts: summary statistics, the child
+process environment and saving and comparing JSON reports."""
+
+import json
+import os
+import statistics
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SNIPEASSIST = os.path.join(ROOT, 'snipeassist')
+
+# Summary values compared against a baseline.  Metrics ending in _per_s are
+# better when higher, the rest (seconds) when lower.
+COMPARED = ('median', 'p50', 'p90', 'p99', 'seconds', 'rows_per_s', 'assets_per_s')
+
+
+def benchmark_env(snipe_url, **extra):
+    """Environment for running snipeassist against the mock API"""
+    env = dict(os.environ)
+    env.update({
+        'SNIPE_URL': snipe_url,
+        'API_KEY': 'benchmark',
+        'QT_QPA_PLATFORM': 'offscreen',
+        'LOG_LEVEL': 'WARNING',
+        'LOG_FILE_LEVEL': 'WARNING',
+        'ASK_BEFORE_QUIT': 'False',
+        'SAVE_ON_EXIT': 'False',
+        # Measure the app, not the rate limit meant for a real server
+        'API_RATE_LIMIT': '0',
+        'PYTHONPATH': SNIPEASSIST + os.pathsep + env.get('PYTHONPATH', ''),
+    })
+    env.update(extra)
+    return env
+
+
+def summarise(samples):
+    """Median, min and max of each key of a list of dicts"""
+    summary = {}
+    for key in samples[0]:
+        values = [s[key] for s in samples if key in s]
+        summary[key] = {
+            'median': statistics.median(values),
+            'min': min(values),
+            'max': max(values),
+        }
+    return summary
+
+
+def percentiles(values):
+    """p50, p90, p99, mean and max of a list of latencies"""
+    values = sorted(values)
+    if not values:
+        return {'count': 0}
+
+    def point(p):
+        return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+    return {
+        'count': len(values),
+        'p50': point(50),
+        'p90': point(90),
+        'p99': point(99),
+        'mean': statistics.fmean(values),
+        'max': values[-1],
+    }
+
+
+def save(path, results, **meta):
+    report = {'python': sys.version.split()[0], 'platform': sys.platform}
+    report.update(meta)
+    report['results'] = results
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=4)
+
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)['results']
+
+
+def _flatten(results, prefix=''):
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, f'{prefix}{key}.')
+        elif isinstance(value, (int, float)):
+            yield prefix + key, value
+
+
+def compare(results, baseline, tolerance, noise=0.02):
+    """Prints the change of each compared metric against baseline and
+    returns False if any got more than tolerance worse.  Slowdowns of less
+    than noise seconds are ignored, whatever the ratio."""
+    old_values = dict(_flatten(baseline))
+    ok = True
+    for name, new in _flatten(results):
+        metric = name.rsplit('.', 1)[-1]
+        old = old_values.get(name)
+        if metric not in COMPARED or old is None:
+            continue
+        change = (new - old) / old if old else 0.0
+        if metric.endswith('_per_s'):
+            regressed = -change > tolerance
+        else:
+            regressed = change > tolerance and new - old > noise
+        ok = ok and not regressed
+        print(f'{name:40} {old:10.3f} -> {new:10.3f}  {change:+6.1%}'
+              f'{"  REGRESSION" if regressed else ""}')
+    return ok
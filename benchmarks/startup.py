@@ -0,0 +1,122 @@
+"""Measures how long Snipe Assist takes to start.
+
+Each run starts snipe_assist in a fresh Python process against the mock
+Snipe-IT API (Qt uses the offscreen platform, so no display is needed) and
+records, from the moment the process was started:
+
+    import   Qt, the UI and the Snipe modules imported
+    window   main window built and shown
+    ready    every required item list loaded and the Scan button enabled
+
+'cold' runs start with an empty cache, 'warm' runs with the cache left by
+an earlier run.  Medians are printed and can be saved as JSON and compared
+with a saved baseline; a metric more than --tolerance slower than the
+baseline fails the run (exit status 1).
+
+    python benchmarks/startup.py --runs 5 --output startup.json
+    python benchmarks/startup.py --baseline startup.json"""
+
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import time
+
+import report
+from mock_snipe import MockSnipe
+
+# Runs in the child process.  started is the parent's time.time() just
+# before the process was created.
+CHILD = r'''
+import json, sys, time
+started = float(sys.argv[1])
+import snipe_assist
+import ui
+from PySide6 import QtCore
+marks = {'import': time.time() - started}
+app, win = snipe_assist.start([])
+marks['window'] = time.time() - started
+
+def poll():
+    if win.pushButtonScan.isEnabled():
+        marks['ready'] = time.time() - started
+        app.exit(0)
+
+timer = QtCore.QTimer()
+timer.timeout.connect(poll)
+timer.start(2)
+QtCore.QTimer.singleShot(60000, app.exit)
+app.exec()
+try:
+    import resource
+    marks['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+except ImportError:
+    pass
+print('STARTUP ' + json.dumps(marks), flush=True)
+win.pipeline.close(wait=False)
+# Skip interpreter teardown; only the timings matter
+import os
+os._exit(0)
+'''
+
+
+def run_once(snipe_url, workdir):
+    env = report.benchmark_env(snipe_url)
+    started = time.time()
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD, str(started)],
+        cwd=workdir, env=env, capture_output=True, text=True, timeout=120,
+    )
+    for line in output.stdout.splitlines():
+        if line.startswith('STARTUP '):
+            marks = json.loads(line[len('STARTUP '):])
+            if 'ready' in marks:
+                return marks
+    raise RuntimeError(f'Startup did not finish:\n{output.stdout}\n{output.stderr}')
+
+
+def benchmark(runs, rows):
+    mock = MockSnipe(rows=rows)
+    snipe_url = mock.start()
+    results = {}
+    try:
+        cold = []
+        for _ in range(runs):
+            with tempfile.TemporaryDirectory() as workdir:
+                cold.append(run_once(snipe_url, workdir))
+        results['cold'] = report.summarise(cold)
+        with tempfile.TemporaryDirectory() as workdir:
+            run_once(snipe_url, workdir)  # fills the cache
+            results['warm'] = report.summarise([run_once(snipe_url, workdir) for _ in range(runs)])
+    finally:
+        mock.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Snipe Assist startup time.')
+    parser.add_argument('--runs', type=int, default=5, help='Runs of each mode (default 5)')
+    parser.add_argument('--rows', type=int, default=2000,
+                        help='Rows in each large list served by the mock API (default 2000)')
+    parser.add_argument('--output', help='Save the results to this JSON file')
+    parser.add_argument('--baseline', help='Compare with results saved by --output')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Slowdown allowed against the baseline (default 0.2 = 20%%)')
+    args = parser.parse_args()
+
+    results = benchmark(args.runs, args.rows)
+    for mode, metrics in results.items():
+        print(f'{mode}: ' + '  '.join(
+            f'{key} {value["median"]:.3f}{"" if key == "max_rss_mb" else "s"}'
+            for key, value in metrics.items()))
+    if args.output:
+        report.save(args.output, results, runs=args.runs, rows=args.rows)
+    if args.baseline:
+        if not report.compare(results, report.load(args.baseline), args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""An in-memory index of the asset tags and serials already in Snipe, so a
+duplicate scan is caught as soon as it is scanned"""
+import logging
+import threading
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(value):
+    """Snipe compares tags without regard to case or surrounding spaces"""
+    return str(value).strip().casefold()
+
+
+class DuplicateIndex:
+    """Maps each value of fields (asset_tag and serial by default) to the
+    Snipe ID of the asset that has it.  Lookups are dictionary lookups.
+
+    Only the normalized values and, per asset, a tuple of them are kept,
+    not the hardware rows, so 100k assets take a few tens of MB.
+
+    Values scanned this session are added with add_pending() as soon as the
+    asset is queued and are owned by the submission job id until created()
+    gives them their Snipe ID (or discard() drops them if the asset was not
+    created)."""
+
+    def __init__(self, fields=None):
+        if fields is None:
+            fields = settings.DUPLICATE_FIELDS
+        self.fields = tuple(fields)
+        self._lock = threading.Lock()
+        self._values = {field: {} for field in self.fields}
+        # Snipe ID -> tuple of normalized values, one per field
+        self._by_id = {}
+        # job id -> [(field, normalized value)] of assets not created yet
+        self._pending = {}
+        self._loaded = False
+
+    def find(self, field, value):
+        """Returns who already has value: a Snipe ID, or the job id of an
+        asset queued this session.  None if nobody does."""
+        values = self._values.get(field)
+        if values is None or not str(value).strip():
+            return None
+        with self._lock:
+            return values.get(normalize(value))
+
+    def is_loaded(self):
+        with self._lock:
+            return self._loaded
+
+    def __len__(self):
+        with self._lock:
+            return len(self._by_id)
+
+    def add_rows(self, rows):
+        """Adds or updates hardware rows"""
+        with self._lock:
+            for row in rows:
+                self._add(row['id'], row)
+
+    def _add(self, snipe_id, row):
+        keys = tuple(normalize(row.get(f) or '') for f in self.fields)
+        old = self._by_id.get(snipe_id)
+        if old == keys:
+            return
+        if old:
+            self._remove(snipe_id, old)
+        self._by_id[snipe_id] = keys
+        for field, key in zip(self.fields, keys):
+            if key:
+                self._values[field][key] = snipe_id
+
+    def _remove(self, snipe_id, keys):
+        for field, key in zip(self.fields, keys):
+            if key and self._values[field].get(key) == snipe_id:
+                del self._values[field][key]
+
+    def remove_ids(self, ids):
+        """Drops assets that are no longer in Snipe"""
+        with self._lock:
+            for snipe_id in ids:
+                keys = self._by_id.pop(snipe_id, None)
+                if keys:
+                    self._remove(snipe_id, keys)
+
+    def add_pending(self, job, asset):
+        """Adds the values of an asset queued this session"""
+        with self._lock:
+            entries = []
+            for field in self.fields:
+                key = normalize(asset.get(field) or '')
+                if key and key not in self._values[field]:
+                    self._values[field][key] = job
+                    entries.append((field, key))
+            self._pending[job] = entries
+
+    def created(self, job, snipe_id, asset):
+        """The asset queued as job is now in Snipe as snipe_id"""
+        self.discard(job)
+        with self._lock:
+            self._add(snipe_id, asset)
+
+    def discard(self, job):
+        """The asset queued as job was not created, so its values are free"""
+        with self._lock:
+            for field, key in self._pending.pop(job, ()):
+                if self._values[field].get(key) == job:
+                    del self._values[field][key]
+
+    def update(self, changed, removed):
+        """Applies a snipeapi.DeltaSync of hardware: indexes the changed rows
+        and drops the assets that were removed.  Safe to call from a
+        background thread."""
+        self.add_rows(changed)
+        self.remove_ids(removed)
+        with self._lock:
+            self._loaded = True
+        if changed or removed:
+            logger.info('Duplicate index updated: %s changed, %s removed, %s assets',
+                        len(changed), len(removed), len(self))
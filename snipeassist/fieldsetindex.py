@@ -0,0 +1,84 @@
+"""An in-memory index of custom fieldsets so changing the model does not
+need to ask the Snipe server for the model's custom fields"""
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class FieldsetIndex:
+    """Maps model id -> fieldset id -> custom fields.
+
+    The mapping comes from the rows of the models list (each row names its
+    fieldset) and the fields from the rows of the fieldsets list, so both
+    are loaded in bulk with the other required item lists.  Setting new
+    model rows drops the old mapping, and setting new fieldset rows drops
+    the old fields."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._model_fieldsets = None
+        self._fieldsets = None
+
+    def set_models(self, rows):
+        """Rebuilds the model -> fieldset mapping from the models list"""
+        mapping = {r['id']: (r['fieldset'] or {}).get('id') for r in rows}
+        with self._lock:
+            self._model_fieldsets = mapping
+        logger.debug('Fieldset index: %s models', len(mapping))
+
+    def set_fieldsets(self, rows):
+        """Rebuilds the fieldset -> fields mapping from the fieldsets list"""
+        fieldsets = {r['id']: self._trim(r) for r in rows}
+        with self._lock:
+            self._fieldsets = fieldsets
+        logger.debug('Fieldset index: %s fieldsets', len(fieldsets))
+
+    def add_fieldset(self, fieldset):
+        """Adds or replaces a single fieldset, e.g. one fetched by id"""
+        with self._lock:
+            if self._fieldsets is None:
+                self._fieldsets = {}
+            self._fieldsets[fieldset['id']] = self._trim(fieldset)
+
+    def invalidate(self):
+        with self._lock:
+            self._model_fieldsets = None
+            self._fieldsets = None
+
+    def is_ready(self):
+        """True once both the models and the fieldsets have been loaded"""
+        with self._lock:
+            return self._model_fieldsets is not None and self._fieldsets is not None
+
+    def fieldset_id(self, model_id):
+        """Returns the fieldset id of a model, None if it has no custom
+        fields.  Raises KeyError if the model is not in the index."""
+        with self._lock:
+            if self._model_fieldsets is None:
+                raise KeyError(model_id)
+            return self._model_fieldsets[model_id]
+
+    def fieldset(self, fieldset_id):
+        """Returns {'id', 'name', 'fields'} or None if it is not indexed"""
+        with self._lock:
+            if self._fieldsets is None:
+                return None
+            return self._fieldsets.get(fieldset_id)
+
+    @staticmethod
+    def _trim(fieldset):
+        # Only the parts used to build the custom field tabs are kept
+        return {
+            'id': fieldset['id'],
+            'name': fieldset['name'],
+            'fields': [
+                {
+                    'id': f['id'],
+                    'name': f['name'],
+                    'db_column_name': f['db_column_name'],
+                    'field_values_array': f.get('field_values_array'),
+                }
+                for f in fieldset['fields']['rows']
+            ],
+        }
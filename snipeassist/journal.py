@@ -0,0 +1,138 @@
+"""An append-only journal of completed scans so nothing scanned is lost if
+the Snipe server is slow or unreachable"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+SENT = 'sent'
+UNKNOWN = 'unknown'
+CREATED = 'created'
+CHECKED_OUT = 'checked_out'
+FAILED = 'failed'
+
+
+class ScanJournal:
+    """Every scan is written as a JSON line before it is submitted.  Each
+    change of state appends another line for the same entry id, so the
+    latest line for an id is its current state:
+
+        pending      saved, not sent yet (or the server could not be connected to)
+        sent         request sent, no answer yet
+        unknown      request sent and the answer lost (a read timeout, or a
+                     crash while it was sent).  Snipe may have acted on it, so
+                     the asset is looked up before anything is sent again.
+        created      asset created, check out still to do (if requested)
+        checked_out  asset created and checked out
+        failed       rejected by the server.  Not retried.
+
+    Entries that are pending, sent, unknown, or created with a check out
+    still to do are returned by unfinished() so they can be replayed.  An
+    entry left sent by an earlier run is loaded as unknown."""
+
+    def __init__(self, path=None):
+        if path is None:
+            path = settings.JOURNAL_FILE
+        self._path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._load()
+        self.compact()
+
+    def _load(self):
+        if not os.path.exists(self._path):
+            return
+        with open(self._path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A crash part way through a write leaves a partial
+                    # last line.  Everything before it is still good.
+                    logger.warning('Skipping unreadable journal line %s', line_number)
+                    continue
+                self._entries.setdefault(record['id'], {}).update(record)
+        for entry in self._entries.values():
+            if entry['state'] == SENT:
+                entry['state'] = UNKNOWN
+        logger.info('Loaded %s journal entries from %s.  %s unfinished',
+                    len(self._entries), self._path, len(self.unfinished()))
+
+    def _append(self, record):
+        with open(self._path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def add(self, asset, checkout=None):
+        """Saves a completed scan.  Returns its entry id."""
+        record = {
+            'id': uuid.uuid4().hex,
+            'state': PENDING,
+            'asset': asset,
+            'checkout': checkout,
+            'time': time.time(),
+        }
+        with self._lock:
+            self._append(record)
+            self._entries[record['id']] = dict(record)
+        return record['id']
+
+    def update(self, entry_id, state, **info):
+        """Records a new state for an entry, e.g. update(id, CREATED, snipe_id=12)"""
+        record = {'id': entry_id, 'state': state, 'time': time.time()}
+        record.update(info)
+        with self._lock:
+            self._append(record)
+            self._entries[entry_id].update(record)
+
+    def get(self, entry_id):
+        with self._lock:
+            return dict(self._entries[entry_id])
+
+    @staticmethod
+    def _is_unfinished(entry):
+        if entry['state'] in (PENDING, SENT, UNKNOWN):
+            return True
+        return entry['state'] == CREATED and bool(entry.get('checkout'))
+
+    def unfinished(self):
+        """Entries still to be sent, oldest first"""
+        with self._lock:
+            entries = [dict(e) for e in self._entries.values() if self._is_unfinished(e)]
+        return entries
+
+    def counts(self):
+        """Number of entries in each state"""
+        counts = {}
+        with self._lock:
+            for entry in self._entries.values():
+                counts[entry['state']] = counts.get(entry['state'], 0) + 1
+        return counts
+
+    def compact(self):
+        """Rewrites the journal with one line per unfinished or failed entry.
+        Finished entries are dropped; they are in Snipe and the log."""
+        with self._lock:
+            keep = {k: e for k, e in self._entries.items()
+                    if self._is_unfinished(e) or e['state'] == FAILED}
+            if not os.path.exists(self._path):
+                return
+            temp = self._path + '.tmp'
+            with open(temp, 'w', encoding='utf-8') as f:
+                for entry in keep.values():
+                    f.write(json.dumps(entry) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp, self._path)
+            self._entries = keep
@@ -0,0 +1,204 @@
+"""List models of Snipe rows for the comboboxes: IdListModel holds a whole
+list, LazyListModel loads one a page at a time as the list scrolls"""
+import logging
+import threading
+from array import array
+from collections import OrderedDict
+from functools import partial
+
+from PySide6 import QtCore
+
+import settings
+from snipeapi import SnipeGet
+from workers import run_task
+
+logger = logging.getLogger(__name__)
+
+
+class PageCache:
+    """Keeps the most recently used pages, up to max_pages of them"""
+
+    def __init__(self, max_pages=None):
+        if max_pages is None:
+            max_pages = settings.CHECKOUT_CACHE_PAGES
+        self._max_pages = max_pages
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+            return page
+
+    def put(self, key, page):
+        with self._lock:
+            self._pages[key] = page
+            self._pages.move_to_end(key)
+            while len(self._pages) > self._max_pages:
+                self._pages.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+
+
+class IdListModel(QtCore.QAbstractListModel):
+    """The id and name of each row of a list, kept in two parallel arrays
+    rather than a QStandardItem per row.  Names are shown; the id of a row
+    is returned by id_at() or the IdRole."""
+
+    IdRole = QtCore.Qt.UserRole + 1
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._ids = array('q')
+        self._names = []
+
+    @classmethod
+    def from_rows(cls, rows, name_key='name', parent=None):
+        """A model of Snipe rows sorted by name_key"""
+        model = cls(parent)
+        model.set_rows(rows, name_key)
+        return model
+
+    def set_rows(self, rows, name_key='name'):
+        """Replaces every row with rows sorted by name_key, in one reset.
+        Rows without a name (assets often have none) are shown blank."""
+        rows = sorted(rows, key=lambda r: r.get(name_key) or '')
+        self.beginResetModel()
+        self._ids = array('q', (r['id'] for r in rows))
+        self._names = [r.get(name_key) or '' for r in rows]
+        self.endResetModel()
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._ids)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self._ids):
+            return None
+        if role in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole):
+            return self._names[index.row()]
+        if role == self.IdRole:
+            return self._ids[index.row()]
+        return None
+
+    def id_at(self, row):
+        """The id of row, or None if there is no such row"""
+        if 0 <= row < len(self._ids):
+            return self._ids[row]
+        return None
+
+    def name_at(self, row):
+        if 0 <= row < len(self._names):
+            return self._names[row]
+        return None
+
+
+class LazyListModel(IdListModel):
+    """Rows of a Snipe endpoint, sorted by name_key and downloaded a page at
+    a time when a view asks for more (canFetchMore / fetchMore).
+
+    set_search() restarts the list with the rows the server matches for the
+    Snipe API search parameter.  Only the id and name of each row are kept.
+    Downloaded pages are shared through page_cache."""
+
+    page_loaded = QtCore.Signal()
+
+    def __init__(self, snipe_url, api_key, endpoint, name_key='name', page_cache=None, parent=None):
+        super().__init__(parent)
+        self._api = SnipeGet(snipe_url, api_key, endpoint, limit=settings.CHECKOUT_PAGE_SIZE,
+                             fields=('id', name_key))
+        self._endpoint = endpoint
+        self._name_key = name_key
+        self._page_cache = page_cache if page_cache is not None else PageCache()
+        self._total = None
+        self._search = ''
+        self._loading = False
+        self._failed = False
+        # Bumped by set_search so pages for an old search are ignored
+        self._generation = 0
+        self._load_page(0)
+
+    def canFetchMore(self, parent=QtCore.QModelIndex()):
+        if parent.isValid() or self._loading or self._failed:
+            return False
+        return self._total is None or len(self._ids) < self._total
+
+    def fetchMore(self, parent=QtCore.QModelIndex()):
+        if self.canFetchMore(parent):
+            self._load_page(len(self._ids))
+
+    def search_text(self):
+        return self._search
+
+    def set_search(self, text):
+        """Replaces the rows with the server's matches for text"""
+        text = text.strip()
+        if text == self._search:
+            return
+        logger.debug('Searching %s for %s', self._endpoint, text)
+        self._generation += 1
+        self.beginResetModel()
+        self._ids = array('q')
+        self._names = []
+        self._total = None
+        self._search = text
+        self._loading = False
+        self._failed = False
+        self.endResetModel()
+        self._load_page(0)
+
+    def _load_page(self, offset):
+        key = (self._endpoint, self._search, offset)
+        page = self._page_cache.get(key)
+        if page is not None:
+            logger.debug('Page %s of %s (%s) from cache', offset, self._endpoint, self._search)
+            self._append(page)
+            return
+        self._loading = True
+        run_task(self._fetch, self._search, offset,
+                 on_finished=partial(self._page_arrived, self._generation, key),
+                 on_failed=partial(self._page_failed, self._generation))
+
+    def _fetch(self, search, offset):
+        """Runs on a worker thread.  Returns the page trimmed to (id, name) pairs."""
+        params = {'sort': self._name_key, 'order': 'asc'}
+        if search:
+            params['search'] = search
+        page = self._api.get_page(offset, **params)
+        return {
+            'total': page['total'],
+            'rows': [(r['id'], r[self._name_key]) for r in page['rows']],
+        }
+
+    def _page_arrived(self, generation, key, page):
+        self._page_cache.put(key, page)
+        if generation != self._generation:
+            return
+        self._loading = False
+        self._append(page)
+
+    def _page_failed(self, generation, message):
+        if generation != self._generation:
+            return
+        logger.warning('Unable to load %s: %s', self._endpoint, message)
+        self._loading = False
+        self._failed = True
+
+    def _append(self, page):
+        self._total = page['total']
+        rows = page['rows']
+        if not rows:
+            # Nothing more on the server, even if total said otherwise
+            self._total = len(self._ids)
+            return
+        first = len(self._ids)
+        self.beginInsertRows(QtCore.QModelIndex(), first, first + len(rows) - 1)
+        self._ids.extend(_id for _id, _name in rows)
+        self._names.extend(name for _id, name in rows)
+        self.endInsertRows()
+        self.page_loaded.emit()
@@ -0,0 +1,97 @@
+"""Logging setup shared by Snipe Assist, snipe_import and snipe_scan.
+
+The handlers in settings.LOGGING_CONFIG (console and rotating file) are
+moved behind a QueueHandler, and a QueueListener thread writes the records
+to them.  Logging from the GUI thread then only formats the message and
+puts it on a queue; the console and file writes happen off that thread."""
+import atexit
+import json
+import logging
+import logging.config
+import logging.handlers
+import queue
+import threading
+
+import settings
+
+# Attributes every LogRecord has.  Anything else on a record was passed
+# with extra= and is added to the JSON output.
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_listener = None
+_lock = threading.Lock()
+_registered = False
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """The queue stays in this process, so the record only needs its message
+    merged now (the arguments may change before the listener gets to it).
+    Formatting, including any traceback, is left to the listener thread."""
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as one JSON object per line"""
+
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record, self.datefmt),
+            'level': record.levelname,
+            'logger': record.name,
+            'module': record.module,
+            'line': record.lineno,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+def configure(config=None):
+    """Applies the logging config and, if LOG_QUEUE is on, starts the
+    listener thread that writes log records.  Safe to call more than once.
+    The listener is stopped, and its queue drained, at exit."""
+    global _listener, _registered
+    logging.config.dictConfig(config or settings.LOGGING_CONFIG)
+    if not settings.LOG_QUEUE:
+        return
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+        root = logging.getLogger()
+        log_queue = queue.SimpleQueue()
+        _listener = logging.handlers.QueueListener(log_queue, *root.handlers, respect_handler_level=True)
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_QueueHandler(log_queue))
+        _listener.start()
+        if not _registered:
+            atexit.register(stop)
+            _registered = True
+
+
+def stop():
+    """Writes out any queued records and stops the listener thread"""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def log_rows(logger, endpoint, rows, name_key='name'):
+    """Logs one DEBUG line for a list of rows instead of one per row: the
+    count and the first LOG_SAMPLE_ROWS rows as (id, name)"""
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    sample = [(r['id'], r.get(name_key)) for r in rows[:settings.LOG_SAMPLE_ROWS]]
+    logger.debug('%s: %s rows.  First %s: %s', endpoint, len(rows), len(sample), sample,
+                 extra={'endpoint': endpoint, 'rows': len(rows)}, stacklevel=2)
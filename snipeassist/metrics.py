@@ -0,0 +1,233 @@
+"""Counters and latency histograms for every request to the Snipe server,
+so slow calls can be found on each station.
+
+Requests are counted per endpoint and method (requests, bytes received,
+errors, retries, and a latency histogram), and the number of pages each
+full list download took is recorded per endpoint.  The metrics can be
+written as a Prometheus text file (for the node_exporter textfile
+collector) and as a JSON snapshot, every METRICS_INTERVAL seconds."""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets.  Everything larger goes in +Inf.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+PAGE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+
+class Histogram:
+    """A fixed bucket histogram.  Not thread safe; Metrics locks around it."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimates the q quantile (0 to 1) by interpolating within its
+        bucket, as Prometheus' histogram_quantile does.  None if empty."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for i, count in enumerate(self.counts):
+            upper = self.buckets[i] if i < len(self.buckets) else None
+            if seen + count >= rank and count:
+                if upper is None:
+                    return lower
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            if upper is not None:
+                lower = upper
+        return lower
+
+    def snapshot(self):
+        return {
+            'buckets': {str(b): c for b, c in zip(self.buckets + ('+Inf',), self.counts)},
+            'sum': self.sum,
+            'count': self.count,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+        }
+
+
+class Metrics:
+    """Request metrics for the whole process.  Safe to use from any thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (endpoint, method) -> counters and a latency Histogram
+        self._requests = {}
+        # endpoint -> Histogram of pages per full download
+        self._pages = {}
+        self.started = time.time()
+
+    def _series(self, endpoint, method):
+        key = (endpoint, method)
+        series = self._requests.get(key)
+        if series is None:
+            series = self._requests[key] = {
+                'requests': 0, 'bytes': 0, 'errors': 0, 'retries': 0,
+                'latency': Histogram(LATENCY_BUCKETS),
+            }
+        return series
+
+    def record(self, endpoint, method, seconds, size=0, error=False):
+        """Records one request.  error is True for a failed request or an
+        error status."""
+        with self._lock:
+            series = self._series(endpoint, method)
+            series['requests'] += 1
+            series['bytes'] += size
+            series['errors'] += bool(error)
+            series['latency'].observe(seconds)
+
+    def retry(self, endpoint, method):
+        with self._lock:
+            self._series(endpoint, method)['retries'] += 1
+
+    def pages(self, endpoint, depth):
+        """Records the number of pages a full list download took"""
+        with self._lock:
+            if endpoint not in self._pages:
+                self._pages[endpoint] = Histogram(PAGE_BUCKETS)
+            self._pages[endpoint].observe(depth)
+
+    def snapshot(self):
+        """Returns every metric as a JSON-ready dict"""
+        with self._lock:
+            return {
+                'time': time.time(),
+                'uptime': time.time() - self.started,
+                'requests': [
+                    {
+                        'endpoint': endpoint,
+                        'method': method,
+                        'requests': s['requests'],
+                        'bytes': s['bytes'],
+                        'errors': s['errors'],
+                        'retries': s['retries'],
+                        'latency': s['latency'].snapshot(),
+                    }
+                    for (endpoint, method), s in sorted(self._requests.items())
+                ],
+                'pages': [
+                    dict(h.snapshot(), endpoint=endpoint)
+                    for endpoint, h in sorted(self._pages.items())
+                ],
+            }
+
+    def prometheus(self):
+        """Returns the metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            requests = sorted(self._requests.items())
+            pages = sorted(self._pages.items())
+            for name, key, kind, help_text in (
+                ('snipeassist_requests_total', 'requests', 'counter', 'Requests sent to Snipe'),
+                ('snipeassist_response_bytes_total', 'bytes', 'counter', 'Response bytes received'),
+                ('snipeassist_request_errors_total', 'errors', 'counter', 'Failed requests and error statuses'),
+                ('snipeassist_request_retries_total', 'retries', 'counter', 'Requests retried after a 429'),
+            ):
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+                for (endpoint, method), s in requests:
+                    lines.append(f'{name}{{endpoint="{endpoint}",method="{method}"}} {s[key]}')
+            lines += ['# HELP snipeassist_request_seconds Request latency',
+                      '# TYPE snipeassist_request_seconds histogram']
+            for (endpoint, method), s in requests:
+                lines += _histogram_lines('snipeassist_request_seconds', s['latency'],
+                                          f'endpoint="{endpoint}",method="{method}"')
+            lines += ['# HELP snipeassist_pagination_pages Pages per full list download',
+                      '# TYPE snipeassist_pagination_pages histogram']
+            for endpoint, h in pages:
+                lines += _histogram_lines('snipeassist_pagination_pages', h, f'endpoint="{endpoint}"')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """A one line summary for the status bar"""
+        with self._lock:
+            total = sum(s['requests'] for s in self._requests.values())
+            if not total:
+                return 'No Snipe requests yet'
+            errors = sum(s['errors'] for s in self._requests.values())
+            retries = sum(s['retries'] for s in self._requests.values())
+            size = sum(s['bytes'] for s in self._requests.values())
+            slowest, (endpoint, method) = max(
+                (s['latency'].quantile(0.95) or 0.0, key) for key, s in self._requests.items())
+        return (f'Snipe: {total} requests, {errors} errors, {retries} retries, '
+                f'{size / 1048576:.1f} MB  |  slowest p95: {method} {endpoint} {slowest:.2f}s')
+
+    def export(self):
+        """Writes the Prometheus and JSON files, if they are configured"""
+        for path, render in ((settings.METRICS_FILE, self.prometheus),
+                             (settings.METRICS_JSON_FILE, lambda: json.dumps(self.snapshot(), indent=4))):
+            if not path:
+                continue
+            try:
+                temp = path + '.tmp'
+                with open(temp, 'w', encoding='utf-8') as f:
+                    f.write(render())
+                os.replace(temp, path)
+            except OSError as e:
+                logger.warning('Unable to write metrics to %s: %s', path, e)
+
+
+def _histogram_lines(name, histogram, labels):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_sum{{{labels}}} {histogram.sum}')
+    lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+    return lines
+
+
+_metrics = Metrics()
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get_metrics():
+    """Returns the process-wide Metrics"""
+    return _metrics
+
+
+def start_exporter():
+    """Writes the metrics files every METRICS_INTERVAL seconds, and once
+    more at exit, on a background thread.  Does nothing if neither
+    METRICS_FILE nor METRICS_JSON_FILE is set.  Safe to call more than once."""
+    global _exporter
+    if not (settings.METRICS_FILE or settings.METRICS_JSON_FILE):
+        return
+    with _exporter_lock:
+        if _exporter is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(settings.METRICS_INTERVAL)
+                _metrics.export()
+        _exporter = threading.Thread(target=run, name='metrics-exporter', daemon=True)
+        _exporter.start()
+        atexit.register(_metrics.export)
+    logger.debug('Writing request metrics every %s seconds', settings.METRICS_INTERVAL)
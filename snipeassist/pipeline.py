@@ -0,0 +1,321 @@
+"""Creates and checks out scanned assets on background threads so scanning
+never waits on the Snipe server"""
+import json
+import logging
+import queue
+import threading
+import time
+
+import requests
+
+import settings
+import journal as scan_journal
+from journal import ScanJournal
+from snipeapi import SnipeGet, is_assigned, never_sent
+
+logger = logging.getLogger(__name__)
+
+
+class SubmissionPipeline:
+    """Queue of completed scans worked by a small pool of threads.
+
+    Every scan is written to a ScanJournal before it is queued.  If the Snipe
+    server can not be connected to the scan stays pending in the journal and
+    the pipeline goes offline; a replay thread checks the connection every
+    JOURNAL_RETRY_INTERVAL seconds and, once it is back, sends the pending
+    scans in batches of JOURNAL_REPLAY_BATCH.  Scans left unfinished by an
+    earlier run are replayed the same way.
+
+    A request whose answer is lost (a read timeout, or a connection dropped
+    after it was sent) may still have been carried out, so its scan is
+    marked unknown.  Before it is sent again the asset is looked up in
+    Snipe, so it is never created or checked out twice.
+
+    submit() returns straight away.  When a scan has been handled on_result
+    is called from a worker thread with a dict:
+
+        job         the journal entry id returned by submit()
+        status      'created', 'checked_out', 'checkout_failed', 'failed'
+                    or 'offline' (saved in the journal to send later,
+                    because Snipe was unreachable or did not answer)
+        snipe_id    Snipe ID of the new asset, or None
+        message     text for the operator
+        sound       'success', 'warning' or 'ding'
+        asset       the submitted asset
+        queued_at, sent_at, created_at, finished_at  time.time() stamps
+    """
+
+    def __init__(self, snipe_url, api_key, on_result, workers=None, journal=None):
+        if workers is None:
+            workers = settings.SUBMIT_WORKERS
+        if journal is None:
+            journal = ScanJournal()
+        self._snipe_url = snipe_url
+        self._api_key = api_key
+        self._on_result = on_result
+        self.journal = journal
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._queued = set()
+        self._online = True
+        self._stop = threading.Event()
+        self._threads = []
+        for i in range(max(1, workers)):
+            thread = threading.Thread(target=self._worker, name=f'submit-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self._replay_thread = threading.Thread(target=self._replay, name='submit-replay', daemon=True)
+        self._replay_thread.start()
+        logger.debug('Submission pipeline started with %s workers', len(self._threads))
+
+    def submit(self, asset, checkout=None):
+        """Journals asset and queues it for creation.  checkout is None or a
+        tuple of (checkout type, assigned to id).  Returns the job id."""
+        entry_id = self.journal.add(asset, checkout)
+        with self._lock:
+            online = self._online
+        if online:
+            self._enqueue(self.journal.get(entry_id))
+        else:
+            logger.info('Snipe offline.  Asset saved to journal: %s', entry_id)
+            self._emit({'job': entry_id, 'asset': asset, 'queued_at': time.time()},
+                       'offline', None, self._offline_message(), 'ding')
+        return entry_id
+
+    def in_flight(self):
+        """Number of queued assets that do not have a result yet"""
+        with self._lock:
+            return len(self._queued)
+
+    def pending(self):
+        """Number of journaled assets not yet in Snipe, queued or not"""
+        return len(self.journal.unfinished())
+
+    def is_online(self):
+        with self._lock:
+            return self._online
+
+    def close(self, wait=True):
+        """Stops the workers once the queue is empty"""
+        self._stop.set()
+        for _thread in self._threads:
+            self._queue.put(None)
+        if wait:
+            if self.in_flight():
+                logger.info('Waiting for %s assets to finish submitting', self.in_flight())
+            for thread in self._threads:
+                thread.join()
+            self._replay_thread.join()
+        if self.pending():
+            logger.warning('%s scanned assets have not been sent to Snipe.  '
+                           'They will be sent the next time Snipe Assist starts.', self.pending())
+
+    def _enqueue(self, entry):
+        with self._lock:
+            if entry['id'] in self._queued:
+                return
+            self._queued.add(entry['id'])
+        self._queue.put({
+            'job': entry['id'],
+            'asset': entry['asset'],
+            'checkout': entry.get('checkout'),
+            'snipe_id': entry.get('snipe_id'),
+            'state': entry['state'],
+            'queued_at': time.time(),
+        })
+
+    def _done(self, job_id):
+        with self._lock:
+            self._queued.discard(job_id)
+            self._idle.notify_all()
+
+    def _offline_message(self):
+        return f'Snipe offline.  Asset saved ({self.pending()} waiting to send)'
+
+    def _worker(self):
+        api = SnipeGet(self._snipe_url, self._api_key, 'hardware')
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            if not self.is_online():
+                # Do not wait out a timeout for every queued scan once the
+                # server is known to be down.  The scan is already pending
+                # in the journal.
+                self._emit(job, 'offline', job.get('snipe_id'), self._offline_message(), 'ding')
+                self._done(job['job'])
+                continue
+            try:
+                self._process(api, job)
+            except requests.ConnectionError as e:
+                # The server could not be reached.  Keep the scan in the
+                # journal and let the replay thread send it later.
+                logger.warning('Unable to reach Snipe: %s', e)
+                with self._lock:
+                    self._online = False
+                self._unsent(job, e, connected=not never_sent(e))
+                self._emit(job, 'offline', job.get('snipe_id'), self._offline_message(), 'ding')
+            except (requests.RequestException, json.JSONDecodeError) as e:
+                # Snipe (or a proxy in front of it) is up but the answer was
+                # lost or unreadable.  The replay thread tries again.
+                logger.warning('No answer from Snipe: %s', e)
+                self._unsent(job, e, connected=True)
+                self._emit(job, 'offline', job.get('snipe_id'),
+                           f'No answer from Snipe.  Asset saved ({self.pending()} waiting to send)', 'ding')
+            except Exception as e:
+                logger.warning('Asset not created: %s', e)
+                self.journal.update(job['job'], scan_journal.FAILED, message=str(e))
+                self._emit(job, 'failed', None, f'Asset Not Created: {e}', 'warning')
+            finally:
+                self._done(job['job'])
+
+    def _unsent(self, job, error, connected):
+        """Records a job whose request failed.  A request sent over a
+        connection that was made may have reached Snipe, so the job is
+        unknown until it is looked up; otherwise nothing was sent."""
+        if job['state'] == scan_journal.SENT:
+            state = scan_journal.UNKNOWN if connected else (
+                scan_journal.PENDING if job.get('snipe_id') is None else scan_journal.CREATED)
+        else:
+            state = job['state']
+        self.journal.update(job['job'], state, message=str(error))
+
+    def _sending(self, job, state):
+        self.journal.update(job['job'], state)
+        job['state'] = state
+
+    def _check_unknown(self, api, job):
+        """Looks up a job whose last request may or may not have reached
+        Snipe.  Returns False if the lookup shows it is finished, True if
+        there is still something to send."""
+        snipe_id = job.get('snipe_id')
+        if snipe_id is None:
+            row = api.find_asset(job['asset'])
+            if row is None:
+                logger.info('Asset %s is not in Snipe.  Sending it again', job['job'])
+                self._sending(job, scan_journal.PENDING)
+                return True
+            snipe_id = row['id']
+            logger.info('Asset %s was already created.  Snipe ID: %s', job['job'], snipe_id)
+        else:
+            row = api.get_by_id(snipe_id)
+            if row is None:
+                raise requests.RequestException(f'Unable to look up Snipe ID {snipe_id}')
+        job['snipe_id'] = snipe_id
+        if job['checkout'] and is_assigned(row, job['checkout'][1]):
+            logger.info('Asset %s was already checked out.  Snipe ID: %s', job['job'], snipe_id)
+            self._sending(job, scan_journal.CHECKED_OUT)
+            self._emit(job, 'checked_out', snipe_id,
+                       f'Asset Checked Out: {snipe_id} - {row.get("asset_tag")}', 'success')
+            return False
+        self.journal.update(job['job'], scan_journal.CREATED, snipe_id=snipe_id)
+        job['state'] = scan_journal.CREATED
+        return True
+
+    def _process(self, api, job):
+        if job['state'] in (scan_journal.SENT, scan_journal.UNKNOWN):
+            if not self._check_unknown(api, job):
+                return None
+        snipe_id = job.get('snipe_id')
+        if snipe_id is None:
+            self._sending(job, scan_journal.SENT)
+            job['sent_at'] = time.time()
+            checked_out_on_create = False
+            if job['checkout'] and settings.COMBINED_CHECKOUT:
+                created, checked_out_on_create = api.create_asset_checked_out(job['asset'], *job['checkout'])
+            else:
+                created = api.create_asset(job['asset'])
+            job['created_at'] = time.time()
+            if created.get('messages') != 'Asset created successfully. :)':
+                logger.warning(f'Asset not created: {created.get("messages")}')
+                self.journal.update(job['job'], scan_journal.FAILED, message=str(created.get('messages')))
+                return self._emit(job, 'failed', None, 'Asset Not Created', 'warning')
+            snipe_id = created['payload']['id']
+            logger.info(f'Asset Create.  Snipe ID: {snipe_id}')
+            if checked_out_on_create:
+                asset_tag = created['payload'].get('asset_tag')
+                logger.info(f'Asset Checked out on create.  Asset Snipe ID: {snipe_id}, Checkout ID: {asset_tag}')
+                self.journal.update(job['job'], scan_journal.CHECKED_OUT, snipe_id=snipe_id)
+                return self._emit(job, 'checked_out', snipe_id,
+                                  f'Asset Checked Out: {snipe_id} - {asset_tag}', 'success')
+            self.journal.update(job['job'], scan_journal.CREATED, snipe_id=snipe_id)
+            job['snipe_id'] = snipe_id
+            job['state'] = scan_journal.CREATED
+        if not job['checkout']:
+            return self._emit(job, 'created', snipe_id, f'Asset Created: {snipe_id}', 'success')
+        checkout_type, assigned_to_id = job['checkout']
+        logger.debug(f'Check out is checked, Checking out SNIPE ID: {snipe_id}')
+        self._sending(job, scan_journal.SENT)
+        checked_out = api.checkout_asset(snipe_id, checkout_type, assigned_to_id)
+        if checked_out.get('messages') == 'Asset checked out successfully.':
+            logger.info(f'Asset Checked out.  Asset Snipe ID: {snipe_id}, Checkout ID: {checked_out["payload"]["asset"]}')
+            self.journal.update(job['job'], scan_journal.CHECKED_OUT)
+            return self._emit(job, 'checked_out', snipe_id,
+                              f'Asset Checked Out: {snipe_id} - {checked_out["payload"]["asset"]}', 'success')
+        logger.warning(f'Asset created, but not checked out: {checked_out.get("messages")}')
+        self.journal.update(job['job'], scan_journal.FAILED, message=str(checked_out.get('messages')))
+        return self._emit(job, 'checkout_failed', snipe_id,
+                          f'Asset Created, check out fail: {snipe_id}', 'warning')
+
+    def _replay(self):
+        """Sends unfinished journal entries whenever Snipe is reachable"""
+        # statuslabels is a short list, so counting it is a cheap check
+        # that the server is reachable.
+        probe = SnipeGet(self._snipe_url, self._api_key, 'statuslabels')
+        # Wait before the next batch.  Doubles while batches settle nothing
+        # (e.g. Snipe answering every create with an error page), so
+        # entries that keep failing do not use up the rate limit.
+        delay = settings.JOURNAL_RETRY_INTERVAL
+        while not self._stop.is_set():
+            with self._lock:
+                queued = set(self._queued)
+                online = self._online
+            waiting = [e for e in self.journal.unfinished() if e['id'] not in queued]
+            if waiting:
+                if not online and probe.count() is not None:
+                    logger.info('Snipe is reachable again.  Sending %s saved assets', len(waiting))
+                    with self._lock:
+                        self._online = online = True
+                if online:
+                    if self._replay_batch(waiting[:settings.JOURNAL_REPLAY_BATCH]):
+                        delay = settings.JOURNAL_RETRY_INTERVAL
+                        continue
+                    logger.info('No saved assets could be sent.  Trying again in %.0f seconds', delay)
+                    self._stop.wait(delay)
+                    delay = min(delay * 2, settings.JOURNAL_RETRY_MAX)
+                    continue
+            delay = settings.JOURNAL_RETRY_INTERVAL
+            self._stop.wait(delay)
+
+    def _replay_batch(self, entries):
+        """Queues entries and waits until they have all been handled.
+        Returns the number of them that are finished."""
+        logger.debug('Replaying %s journal entries', len(entries))
+        for entry in entries:
+            self._enqueue(entry)
+        ids = {e['id'] for e in entries}
+        with self._idle:
+            while ids & self._queued and not self._stop.is_set():
+                self._idle.wait(1)
+        unfinished = {e['id'] for e in self.journal.unfinished()}
+        return len(ids - unfinished)
+
+    def _emit(self, job, status, snipe_id, message, sound):
+        result = {
+            'job': job['job'],
+            'status': status,
+            'snipe_id': snipe_id,
+            'message': message,
+            'sound': sound,
+            'asset': job['asset'],
+            'queued_at': job['queued_at'],
+            'sent_at': job.get('sent_at'),
+            'created_at': job.get('created_at'),
+            'finished_at': time.time(),
+        }
+        try:
+            self._on_result(result)
+        except Exception:
+            logger.exception('Error handling submission result')
+        return result
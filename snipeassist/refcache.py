@@ -0,0 +1,156 @@
+"""A local SQLite cache of Snipe reference data (companies, models, etc.)"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+
+class RefCache:
+    """Stores the rows of an endpoint keyed by Snipe URL and endpoint.
+
+    get() returns cached rows even when they are older than the endpoint's
+    TTL so the UI can show them straight away; use is_fresh() to decide
+    whether to download them again.
+
+    The local copies kept by snipeapi.DeltaSync are stored a row at a time
+    with load_synced() and save_synced(), so a sync writes only the rows
+    that changed.  They are not lookups of the reference lists and are
+    left out of the hit rate."""
+
+    def __init__(self, path=None):
+        if path is None:
+            path = settings.CACHE_FILE
+        self._path = path
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._stale = 0
+        self._misses = 0
+        # The cache is shared with background workers, so one connection
+        # is used from several threads behind self._lock.
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            ' snipe_url TEXT NOT NULL,'
+            ' endpoint TEXT NOT NULL,'
+            ' fetched_at REAL NOT NULL,'
+            ' row_count INTEGER NOT NULL,'
+            ' rows TEXT NOT NULL,'
+            ' PRIMARY KEY (snipe_url, endpoint))'
+        )
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS synced ('
+            ' snipe_url TEXT NOT NULL,'
+            ' key TEXT NOT NULL,'
+            ' id INTEGER NOT NULL,'
+            ' row TEXT NOT NULL,'
+            ' PRIMARY KEY (snipe_url, key, id))'
+        )
+        self._db.commit()
+        logger.debug('Reference cache opened: %s', path)
+
+    @staticmethod
+    def ttl(endpoint):
+        """Returns the number of seconds cached rows for endpoint stay fresh"""
+        return settings.CACHE_TTLS.get(endpoint, settings.CACHE_TTL)
+
+    def is_fresh(self, endpoint, age):
+        return age is not None and age < self.ttl(endpoint)
+
+    def get(self, snipe_url, endpoint):
+        """Returns (rows, age in seconds) or (None, None) if nothing is cached"""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT fetched_at, rows FROM entries WHERE snipe_url = ? AND endpoint = ?',
+                (snipe_url, endpoint)
+            ).fetchone()
+            if row is None:
+                self._misses += 1
+                logger.debug('Cache miss for %s', endpoint)
+                return None, None
+            age = time.time() - row[0]
+            if self.is_fresh(endpoint, age):
+                self._hits += 1
+            else:
+                self._stale += 1
+        logger.debug('Cache hit for %s.  Age: %.0f seconds', endpoint, age)
+        return json.loads(row[1]), age
+
+    def put(self, snipe_url, endpoint, rows):
+        data = json.dumps(rows)
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO entries (snipe_url, endpoint, fetched_at, row_count, rows)'
+                ' VALUES (?, ?, ?, ?, ?)',
+                (snipe_url, endpoint, time.time(), len(rows), data)
+            )
+            self._db.commit()
+        logger.debug('Cached %s rows for %s', len(rows), endpoint)
+
+    def load_synced(self, snipe_url, key):
+        """Returns the rows saved for the DeltaSync key, [] if there are none"""
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT row FROM synced WHERE snipe_url = ? AND key = ?', (snipe_url, key)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def save_synced(self, snipe_url, key, changed, removed):
+        """Applies a sync to the rows saved for key: stores the changed rows
+        and deletes the removed ids"""
+        with self._lock:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO synced (snipe_url, key, id, row) VALUES (?, ?, ?, ?)',
+                ((snipe_url, key, r['id'], json.dumps(r)) for r in changed)
+            )
+            self._db.executemany(
+                'DELETE FROM synced WHERE snipe_url = ? AND key = ? AND id = ?',
+                ((snipe_url, key, i) for i in removed)
+            )
+            self._db.commit()
+        logger.debug('Saved %s changed and %s removed rows for %s', len(changed), len(removed), key)
+
+    def invalidate(self, snipe_url, endpoint=None):
+        """Drops the cached rows for endpoint, or every endpoint if None"""
+        with self._lock:
+            if endpoint is None:
+                self._db.execute('DELETE FROM entries WHERE snipe_url = ?', (snipe_url,))
+                self._db.execute('DELETE FROM synced WHERE snipe_url = ?', (snipe_url,))
+            else:
+                self._db.execute('DELETE FROM entries WHERE snipe_url = ? AND endpoint = ?',
+                                 (snipe_url, endpoint))
+            self._db.commit()
+
+    def stats(self, snipe_url):
+        """Returns lookup counts, hit rate and the row count and age of every
+        cached endpoint for snipe_url"""
+        now = time.time()
+        with self._lock:
+            entries = self._db.execute(
+                'SELECT endpoint, row_count, fetched_at FROM entries WHERE snipe_url = ? ORDER BY endpoint',
+                (snipe_url,)
+            ).fetchall()
+            lookups = self._hits + self._stale + self._misses
+            return {
+                'hits': self._hits,
+                'stale': self._stale,
+                'misses': self._misses,
+                'hit_rate': (self._hits + self._stale) / lookups if lookups else 0.0,
+                'entries': [
+                    {
+                        'endpoint': endpoint,
+                        'rows': row_count,
+                        'age': now - fetched_at,
+                        'fresh': self.is_fresh(endpoint, now - fetched_at),
+                    }
+                    for endpoint, row_count, fetched_at in entries
+                ],
+            }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,209 @@
+"""Times each stage of every scanned asset, so assets per hour per station
+can be measured and the slow stage found.
+
+One JSON line is written to TIMING_FILE (next to the log) per asset:
+
+    session         time.time() the scanning session started
+    job             the submission job id
+    status          the pipeline result ('created', 'checked_out', ...)
+    fields          {field: seconds from being asked for it to the scan}
+    rejected        scans turned away as duplicates
+    scan_seconds    first prompt to the final scan (operator time)
+    queue_seconds   final scan to the create request being sent
+    create_seconds  create request to the create response
+    to_create_seconds  final scan to the create response
+    checkout_seconds   create response to the check out response
+    sound_seconds   final scan to the result sound
+    total_seconds   first prompt to the result sound
+    started, ended  time.time() of the first prompt and the result sound
+
+Stages that did not happen (no check out, an offline save) are left out.
+Running this module on a timing file prints the aggregates of each
+session:
+
+    python scantiming.py [snipeassist_timing.jsonl]"""
+import json
+import logging
+import sys
+import time
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('scan_seconds', 'queue_seconds', 'create_seconds', 'to_create_seconds',
+          'checkout_seconds', 'sound_seconds', 'total_seconds')
+# Results after which the pipeline is done with an asset.  'offline' is
+# not one: the asset is sent, and reported again, once Snipe is back.
+FINAL = ('created', 'checked_out', 'checkout_failed', 'failed')
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def aggregate(records):
+    """Returns assets, assets per hour and the p50/p95 of each stage of
+    a list of timing records"""
+    summary = {'assets': len(records)}
+    if not records:
+        return summary
+    # Time between sessions is not scanning time
+    spans = {}
+    for r in records:
+        started, ended = spans.get(r['session'], (r['started'], r['ended']))
+        spans[r['session']] = (min(started, r['started']), max(ended, r['ended']))
+    hours = sum(ended - started for started, ended in spans.values()) / 3600
+    summary['assets_per_hour'] = len(records) / hours if hours else None
+    for stage in STAGES:
+        values = [r[stage] for r in records if r.get(stage) is not None]
+        if values:
+            summary[stage] = {'p50': percentile(values, 50), 'p95': percentile(values, 95)}
+    return summary
+
+
+def format_summary(summary):
+    lines = [f'{summary["assets"]} assets'
+             + (f', {summary["assets_per_hour"]:.0f} an hour' if summary.get('assets_per_hour') else '')]
+    for stage in STAGES:
+        if stage in summary:
+            lines.append(f'  {stage[:-8]:10} p50 {summary[stage]["p50"]:7.2f}s  p95 {summary[stage]["p95"]:7.2f}s')
+    return '\n'.join(lines)
+
+
+class ScanTimer:
+    """Collects the stage times of each asset in the scan loop.  Called from
+    the GUI thread only."""
+
+    def __init__(self, path=None):
+        if path is None:
+            path = settings.TIMING_FILE
+        self._path = path
+        self._file = None
+        self.session = None
+        self.records = []
+        self._asset = None
+        self._field = None
+        self._prompted = None
+        # job id -> timing of an asset waiting on its result
+        self._pending = {}
+
+    def start_session(self):
+        self.session = time.time()
+        self.records = []
+        self._asset = None
+
+    def end_session(self):
+        """Logs the aggregates of the session and returns them"""
+        summary = aggregate(self.records)
+        if self.records:
+            logger.info('Scanning session: %s', format_summary(summary))
+        self.session = None
+        self._asset = None
+        return summary
+
+    def prompt(self, field):
+        """The operator is asked to scan field"""
+        now = time.time()
+        if self._asset is None:
+            self._asset = {'session': self.session, 'started': now, 'fields': {}, 'rejected': 0}
+        elif field == self._field:
+            # Asked again, e.g. Enter on an empty line.  Still the same wait.
+            return
+        self._field = field
+        self._prompted = now
+
+    def rejected(self):
+        if self._asset is not None:
+            self._asset['rejected'] += 1
+
+    def scanned(self, field):
+        if self._asset is None or self._prompted is None:
+            return
+        now = time.time()
+        self._asset['fields'][field] = now - self._prompted
+        self._asset['scanned'] = now
+
+    def queued(self, job):
+        """The asset was completed and submitted as job"""
+        if self._asset is None:
+            return
+        self._asset.setdefault('scanned', time.time())
+        self._pending[job] = self._asset
+        self._asset = None
+
+    def finished(self, result):
+        """Records a pipeline result once its sound has been played"""
+        if result['status'] not in FINAL:
+            return
+        sound_at = time.time()
+        asset = self._pending.pop(result['job'], None)
+        record = {'session': asset['session'] if asset else self.session,
+                  'job': result['job'], 'status': result['status']}
+        if asset is None:
+            # Sent from the journal after an earlier session, so there are
+            # no scan times
+            scanned = result['queued_at']
+            record['replayed'] = True
+        else:
+            scanned = asset['scanned']
+            record.update(fields=asset['fields'], rejected=asset['rejected'],
+                          scan_seconds=scanned - asset['started'])
+        sent_at = result.get('sent_at')
+        created_at = result.get('created_at')
+        if sent_at is not None:
+            record['queue_seconds'] = sent_at - scanned
+            if created_at is not None:
+                record['create_seconds'] = created_at - sent_at
+        if created_at is not None:
+            record['to_create_seconds'] = created_at - scanned
+            if result['status'] in ('checked_out', 'checkout_failed'):
+                record['checkout_seconds'] = result['finished_at'] - created_at
+        record['sound_seconds'] = sound_at - scanned
+        record['started'] = asset['started'] if asset else scanned
+        record['ended'] = sound_at
+        if asset is not None:
+            record['total_seconds'] = sound_at - asset['started']
+            self.records.append(record)
+        self._write(record)
+        return record
+
+    def _write(self, record):
+        if not self._path:
+            return
+        try:
+            if self._file is None:
+                self._file = open(self._path, 'a', encoding='utf-8')
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
+        except OSError as e:
+            logger.warning('Unable to write scan timing to %s: %s', self._path, e)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    path = argv[0] if argv else settings.TIMING_FILE
+    sessions = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            if not record.get('replayed'):
+                sessions.setdefault(record['session'], []).append(record)
+    for session, records in sorted(sessions.items(), key=lambda s: s[0] or 0):
+        when = time.strftime('%Y-%m-%d %H:%M', time.localtime(session)) if session else 'unknown'
+        print(f'Session {when}: ' + format_summary(aggregate(records)))
+    if len(sessions) > 1:
+        print('All sessions: ' + format_summary(aggregate([r for s in sessions.values() for r in s])))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
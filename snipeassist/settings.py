@@ -22,6 +22,10 @@ API_KEY = os.getenv('API_KEY')
 # Save settings on exit
 SAVE_ON_EXIT = os.getenv("SAVE_ON_EXIT", 'True').lower() in ('true', '1', 't')
 
+# While scanning, changed settings are written at most every
+# SETTINGS_SAVE_DELAY seconds, on a background thread.
+SETTINGS_SAVE_DELAY = float(os.getenv("SETTINGS_SAVE_DELAY", 5))
+
 # Ask before quit
 ASK_BEFORE_QUIT = os.getenv("ASK_BEFORE_QUIT", 'True').lower() in ('true', '1', 't')
 
@@ -30,12 +34,121 @@ SOUND_DING = SNIPEASSIST_PATH + os.getenv("SOUND_DING", '/ding.mp3')
 SOUND_SUCCESS = SNIPEASSIST_PATH + os.getenv("SOUND_SUCCESS", '/success.mp3')
 SOUND_WARNING = SNIPEASSIST_PATH + os.getenv("SOUND_WARNING", '/warning.mp3')
 
+# Decode the sounds once at startup and play them from memory, so a cue
+# is heard as soon as it is asked for.  The same cue asked for again within
+# SOUND_COALESCE_MS milliseconds is played once.
+SOUND_PRELOAD = os.getenv("SOUND_PRELOAD", 'True').lower() in ('true', '1', 't')
+SOUND_COALESCE_MS = int(os.getenv("SOUND_COALESCE_MS", 100))
+
+# HTTP connection pool.  All Snipe API calls share one keep-alive session.
+# HTTP_POOL_SIZE is the most connections kept open to the Snipe server.
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 10))
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", 1))
+HTTP_KEEP_ALIVE = os.getenv("HTTP_KEEP_ALIVE", 'True').lower() in ('true', '1', 't')
+# Seconds to wait to connect to, and then hear back from, the Snipe server
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 5))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 30))
+
+# Number of pages fetched at the same time when downloading a full list.
+# Set to 1 to fetch one page after another.
+PAGE_WORKERS = int(os.getenv("PAGE_WORKERS", 4))
+
+# Every request to Snipe shares one rate limit of API_RATE_LIMIT requests
+# a minute, with bursts of up to API_RATE_BURST.  Snipe allows 120 a minute
+# unless its API_THROTTLE_PER_MINUTE is changed.  0 turns the limit off.
+# Throttled (429) requests are retried API_RETRIES times, waiting for the
+# server's Retry-After, or API_BACKOFF seconds doubling each time, at most
+# API_BACKOFF_MAX seconds.
+API_RATE_LIMIT = float(os.getenv("API_RATE_LIMIT", 120))
+API_RATE_BURST = float(os.getenv("API_RATE_BURST", 20))
+API_RETRIES = int(os.getenv("API_RETRIES", 5))
+API_BACKOFF = float(os.getenv("API_BACKOFF", 1))
+API_BACKOFF_MAX = float(os.getenv("API_BACKOFF_MAX", 60))
+
+# Request metrics (counts, bytes, errors, retries and latency for each Snipe
+# endpoint) are written every METRICS_INTERVAL seconds to METRICS_FILE in
+# the Prometheus text format and to METRICS_JSON_FILE as JSON.  Leave a
+# file name empty to not write it.  The main window's status bar always
+# shows a summary.
+METRICS_FILE = os.getenv("METRICS_FILE", '')
+METRICS_JSON_FILE = os.getenv("METRICS_JSON_FILE", '')
+METRICS_INTERVAL = float(os.getenv("METRICS_INTERVAL", 60))
+
+# Number of scanned assets created in Snipe at the same time.  Scanning
+# carries on while assets are being created.
+SUBMIT_WORKERS = int(os.getenv("SUBMIT_WORKERS", 2))
+
+# Send the check out fields with the create request, so a scanned asset is
+# created and checked out in one round trip.  If Snipe rejects or ignores
+# them the asset is checked out with a second request as before.
+COMBINED_CHECKOUT = os.getenv("COMBINED_CHECKOUT", 'True').lower() in ('true', '1', 't')
+
+# Every scan is saved to the journal before it is sent to Snipe.  If Snipe
+# can not be reached, saved scans are sent once it is back, checking every
+# JOURNAL_RETRY_INTERVAL seconds and sending JOURNAL_REPLAY_BATCH at a time.
+# A batch that leaves every scan unsent is tried again after a wait that
+# doubles from JOURNAL_RETRY_INTERVAL up to JOURNAL_RETRY_MAX seconds.
+JOURNAL_FILE = os.getenv("JOURNAL_FILE", 'snipeassist_journal.jsonl')
+JOURNAL_RETRY_INTERVAL = float(os.getenv("JOURNAL_RETRY_INTERVAL", 15))
+JOURNAL_RETRY_MAX = float(os.getenv("JOURNAL_RETRY_MAX", 300))
+JOURNAL_REPLAY_BATCH = int(os.getenv("JOURNAL_REPLAY_BATCH", 20))
+
+# Check Out To list: rows downloaded per page, pages kept in memory, and
+# milliseconds to wait after typing stops before searching Snipe.
+CHECKOUT_PAGE_SIZE = int(os.getenv("CHECKOUT_PAGE_SIZE", 100))
+CHECKOUT_CACHE_PAGES = int(os.getenv("CHECKOUT_CACHE_PAGES", 50))
+CHECKOUT_SEARCH_DELAY = int(os.getenv("CHECKOUT_SEARCH_DELAY", 300))
+
+# snipe_import.py: requests in flight grow from IMPORT_MIN_WORKERS up to
+# IMPORT_MAX_WORKERS while the server answers within IMPORT_TARGET_LATENCY
+# seconds, and are halved when it is slower or returns errors.  Failed
+# requests are tried IMPORT_RETRIES more times.
+IMPORT_MIN_WORKERS = int(os.getenv("IMPORT_MIN_WORKERS", 1))
+IMPORT_MAX_WORKERS = int(os.getenv("IMPORT_MAX_WORKERS", 16))
+IMPORT_TARGET_LATENCY = float(os.getenv("IMPORT_TARGET_LATENCY", 2))
+IMPORT_RETRIES = int(os.getenv("IMPORT_RETRIES", 3))
+IMPORT_PROGRESS_EVERY = int(os.getenv("IMPORT_PROGRESS_EVERY", 100))
+
+# Scanned values that must not already be in Snipe (comma separated, empty
+# to turn the check off).
+DUPLICATE_FIELDS = [f.strip() for f in os.getenv("DUPLICATE_FIELDS", 'asset_tag,serial').split(',') if f.strip()]
+# Local copies of hardware and users (the duplicate index and Check Out To)
+# are brought up to date with the rows changed in Snipe every SYNC_INTERVAL
+# seconds.  DUPLICATE_REFRESH_INTERVAL is its old name.  Every
+# SYNC_FULL_INTERVAL seconds (0 for never) all rows are downloaded again to
+# find those removed from Snipe that the changes alone do not show.
+SYNC_INTERVAL = float(os.getenv("SYNC_INTERVAL", os.getenv("DUPLICATE_REFRESH_INTERVAL", 60)))
+SYNC_FULL_INTERVAL = float(os.getenv("SYNC_FULL_INTERVAL", 3600))
+
+# Local cache of the required item lists (companies, models, etc.).
+# Cached lists are shown at startup and downloaded again in the background
+# once they are older than CACHE_TTL seconds.  A different TTL can be set
+# for an endpoint with CACHE_TTL_<ENDPOINT>, e.g. CACHE_TTL_MODELS=600
+CACHE_FILE = os.getenv("CACHE_FILE", 'snipeassist_cache.db')
+CACHE_TTL = int(os.getenv("CACHE_TTL", 3600))
+CACHE_TTLS = {
+    endpoint: int(os.getenv('CACHE_TTL_' + endpoint.upper(), CACHE_TTL))
+    for endpoint in ('companies', 'models', 'locations', 'statuslabels', 'suppliers')
+}
+# Fieldsets are indexed from the model list, so they expire with it
+CACHE_TTLS['fieldsets'] = CACHE_TTLS['models']
+
 # Logging configuration
 LOG_LEVEL = os.getenv("LOG_LEVEL", 'DEBUG').upper()
 LOG_FILE_LEVEL = os.getenv("LOG_FILE_LEVEL", 'INFO').upper()
 LOG_NAME = os.getenv("LOG_NAME", 'snipeassist.log')
 LOG_SIZE = int(os.getenv("LOG_SIZE", 1024000))
 LOG_COUNT = int(os.getenv("LOG_COUNT", 3))
+# LOG_FORMAT = 'json' writes one JSON object per log line instead of text.
+# Log records are written by a background thread unless LOG_QUEUE is False.
+# Lists of rows are logged as a count and the first LOG_SAMPLE_ROWS rows.
+LOG_FORMAT = os.getenv("LOG_FORMAT", 'text').lower()
+LOG_QUEUE = os.getenv("LOG_QUEUE", 'True').lower() in ('true', '1', 't')
+LOG_SAMPLE_ROWS = int(os.getenv("LOG_SAMPLE_ROWS", 5))
+
+# The stage times of each scanned asset are written as JSON lines to
+# TIMING_FILE, next to the log by default.  Empty to not write them.
+TIMING_FILE = os.getenv("TIMING_FILE", os.path.splitext(LOG_NAME)[0] + '_timing.jsonl')
 
 LOGGING_CONFIG = { 
     'version':1,
@@ -49,16 +162,19 @@ LOGGING_CONFIG = {
             'format': '%(asctime)s | %(name)s | %(module)s : %(lineno)d | %(levelname)s: %(message)s',
             'datefmt': '%Y-%d-%m %I:%M:%S',
         },
+        'json': {
+            '()': 'logsetup.JsonFormatter',
+        },
     },
     'handlers':{
         'console':{
             'level': LOG_LEVEL,
-            'formatter': 'standard',
+            'formatter': 'json' if LOG_FORMAT == 'json' else 'standard',
             'class': 'logging.StreamHandler',
         },
         'file':{
             'level': LOG_FILE_LEVEL,
-            'formatter': 'complex',
+            'formatter': 'json' if LOG_FORMAT == 'json' else 'complex',
             'class': 'logging.handlers.RotatingFileHandler',
             'filename': LOG_NAME,
             'maxBytes': LOG_SIZE,
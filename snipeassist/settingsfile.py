@@ -0,0 +1,92 @@
+"""Writes the form settings (snipeassist.json) off the GUI thread.
+
+Settings are marked dirty while scanning and written at most every
+SETTINGS_SAVE_DELAY seconds, rather than after every asset.  The values
+are read from the form on the GUI thread and written by a background
+thread to a temporary file that then replaces snipeassist.json, so a
+crash part way through a write never leaves a broken settings file."""
+import json
+import logging
+import os
+import pathlib
+import threading
+
+from PySide6 import QtCore
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+
+class SettingsWriter(QtCore.QObject):
+    """Saves a pyqtconfig ConfigManager.  mark_dirty(), flush() and close()
+    are called from the GUI thread."""
+
+    def __init__(self, config, delay=None, parent=None):
+        super().__init__(parent)
+        if delay is None:
+            delay = settings.SETTINGS_SAVE_DELAY
+        self._config = config
+        self._dirty = False
+        # Started by the first change and not restarted by later ones, so
+        # scanning without a break still saves every delay seconds
+        self._timer = QtCore.QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(int(delay * 1000))
+        self._timer.timeout.connect(self.flush)
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        # The newest settings waiting to be written.  Older ones are
+        # dropped, only the latest matters.
+        self._snapshot = None
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name='settings-writer', daemon=True)
+        self._thread.start()
+
+    def mark_dirty(self):
+        """The settings have changed and should be written soon"""
+        self._dirty = True
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def flush(self):
+        """Queues the current settings to be written now"""
+        self._timer.stop()
+        self._dirty = False
+        snapshot = self._config.as_dict()
+        with self._lock:
+            self._snapshot = snapshot
+            self._wake.notify()
+
+    def close(self):
+        """Writes any unsaved changes and waits for the writes to finish"""
+        if self._dirty:
+            self.flush()
+        with self._lock:
+            self._stop = True
+            self._wake.notify()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while self._snapshot is None and not self._stop:
+                    self._wake.wait()
+                if self._snapshot is None:
+                    return
+                snapshot, self._snapshot = self._snapshot, None
+            self._write(snapshot)
+
+    def _write(self, snapshot):
+        path = self._config.path
+        logger.debug('Writing settings to %s', path)
+        try:
+            pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+            temp = path + '.tmp'
+            with open(temp, 'w') as f:
+                json.dump(snapshot, f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp, path)
+        except OSError as e:
+            logger.warning('Unable to save settings to %s: %s', path, e)
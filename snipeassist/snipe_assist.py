@@ -2,19 +2,35 @@
 
 import sys
 import logging
-import logging.config
-
-from PySide6.QtWidgets import QApplication
+import threading
 
+import logsetup
 import settings
-from snipeapi import SnipeGet
-from ui import Window
 
 
-def main():
-    """Main function to load the program and get things started."""
-    #let's setup logging
-    logging.config.dictConfig(settings.LOGGING_CONFIG)
+def check_connection():
+    """Tests connectivity to the Snipe server.  Runs on a background thread
+    while the UI is built, so startup does not wait on the network."""
+    from snipeapi import SnipeGet
+    logger = logging.getLogger('snipeassist')
+    # For a properly configured Snipe deployment there should be at least
+    # one user.  If 0 or None is returned, carry on offline: the lists come
+    # from the local cache and scans are saved to the journal until Snipe
+    # is back.
+    if SnipeGet(settings.SNIPE_URL, settings.API_KEY, 'users').count():
+        logger.info('Successfully connected to the Snipe Server')
+    else:
+        logger.critical('No connection to the Snipe Server.')
+        logger.critical(settings.SNIPE_URL)
+        logger.warning('Starting offline.  Scans will be sent when the Snipe Server is reachable.')
+
+
+def start(argv):
+    """Sets up logging, starts the connection check and builds the UI.
+    Returns the QApplication and the shown main window."""
+    # let's setup logging.  This is the only place logging is configured
+    # for the GUI; the other modules only get their loggers.
+    logsetup.configure()
     logger = logging.getLogger('snipeassist')
     logger.info('***************************************')
     logger.info('          Snipe Assist starting')
@@ -32,22 +48,23 @@ def main():
     logger.debug('Log File Size:        %s', settings.LOG_SIZE)
     logger.debug('Log File Count:       %s', settings.LOG_COUNT)
 
-    # Test connectivity to the Snipe server.  For a properly configured
-    # Snipe deployment there should be at least one user returned.  If
-    # 0 or None is returned, then exit the program with an error.
+    from metrics import start_exporter
+    start_exporter()
+    threading.Thread(target=check_connection, name='connection-check', daemon=True).start()
 
-    if SnipeGet(settings.SNIPE_URL, settings.API_KEY, 'users').count():
-        logger.info('Successfully connected to the Snipe Server')
-    else:
-        logger.critical('No connection to the Snipe Server.')
-        logger.critical(settings.SNIPE_URL)
-        sys.exit()
-
-    
-    # Launch the UI
-    app = QApplication(sys.argv)
+    # Launch the UI.  Qt is imported here so the connection check is
+    # already under way while it loads.
+    from PySide6.QtWidgets import QApplication
+    from ui import Window
+    app = QApplication(argv)
     win = Window()
     win.show()
+    return app, win
+
+
+def main():
+    """Main function to load the program and get things started."""
+    app, _win = start(sys.argv)
     app.exec()
 
 
@@ -0,0 +1,473 @@
+"""Imports a CSV of assets into SnipeIT without the GUI.
+
+Every row is created from the same master asset defaults the GUI builds
+when scanning starts, with the CSV columns (asset_tag, serial, custom field
+db column names, ...) taking the place of the scanned fields:
+
+    python snipe_import.py manifest.csv --company "Acme" --model "Latitude 5440"
+        --location HQ --status Ready --supplier Dell --checkout-type User
+        --checkout-to 12
+
+Results are appended to a results CSV (manifest.results.csv by default),
+one line per row handled.  Running the same command again skips the rows
+that are already in Snipe, so an interrupted import can be resumed."""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+
+import requests
+
+import logsetup
+import settings
+from metrics import start_exporter
+from refcache import RefCache
+from snipeapi import SnipeGet, close_session, is_assigned, never_sent, throttle_stats
+
+logger = logging.getLogger('snipeassist')
+
+RESULT_FIELDS = ['row', 'status', 'snipe_id', 'asset_tag', 'serial', 'message', 'time']
+
+# Rows with one of these results are in Snipe and are not sent again.
+# 'created' is done too when there is no check out to do.
+DONE = ('checked_out', 'checkout_failed')
+# Rows that may already be in Snipe (or checked out) from an attempt whose
+# answer was lost.  They are looked up before anything is sent again.
+UNKNOWN = 'unknown'
+
+
+class AdaptiveLimit:
+    """Limits the number of requests in flight, adapting the limit with
+    additive increase / multiplicative decrease (AIMD).
+
+    Each request that answers within target_latency seconds raises the limit
+    by 1/limit, so it grows by about one for every limit requests.  A slow
+    answer, or a server or connection error, halves it.  Only one cut is
+    made per target_latency seconds so the requests already in flight when
+    the server slows down do not all cut it again."""
+
+    def __init__(self, minimum, maximum, target_latency, window=50):
+        self._minimum = max(1, minimum)
+        self._maximum = max(self._minimum, maximum)
+        self._target = target_latency
+        self._limit = float(self._minimum)
+        self._in_flight = 0
+        self._last_cut = 0.0
+        self._outcomes = deque(maxlen=window)
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self._in_flight >= int(self._limit):
+                self._cond.wait()
+            self._in_flight += 1
+
+    def release(self, latency, error=False):
+        with self._cond:
+            self._in_flight -= 1
+            self._outcomes.append(error)
+            now = time.monotonic()
+            if error or latency > self._target:
+                if now - self._last_cut > self._target:
+                    self._limit = max(self._minimum, self._limit / 2)
+                    self._last_cut = now
+                    logger.debug('Concurrency cut to %s (latency %.2fs, error %s)',
+                                 int(self._limit), latency, error)
+            else:
+                self._limit = min(self._maximum, self._limit + 1 / self._limit)
+            self._cond.notify_all()
+
+    def limit(self):
+        with self._cond:
+            return int(self._limit)
+
+    def error_rate(self):
+        """Share of the last window requests that hit a server or connection error"""
+        with self._cond:
+            if not self._outcomes:
+                return 0.0
+            return sum(self._outcomes) / len(self._outcomes)
+
+
+class CongestionError(Exception):
+    """The server did not answer with JSON, did not answer, or refused the
+    request because it is busy.  The request can be tried again."""
+
+
+class Unanswered(CongestionError):
+    """A create or check out was sent but its answer was lost, so Snipe may
+    have carried it out.  Look it up before sending it again."""
+
+
+class ResultsFile:
+    """Per-row results appended to a CSV.  The latest line for a row is its
+    current result, which is what resuming an import goes by."""
+
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self.results = {}
+        if os.path.exists(path):
+            with open(path, newline='', encoding='utf-8') as f:
+                for line in csv.DictReader(f):
+                    self.results[int(line['row'])] = line
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, 'a', newline='', encoding='utf-8')
+        self._writer = csv.DictWriter(self._file, fieldnames=RESULT_FIELDS)
+        if new:
+            self._writer.writeheader()
+
+    def write(self, row, status, snipe_id, asset, message):
+        line = {
+            'row': row,
+            'status': status,
+            'snipe_id': '' if snipe_id is None else snipe_id,
+            'asset_tag': asset.get('asset_tag', ''),
+            'serial': asset.get('serial', ''),
+            'message': message,
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        with self._lock:
+            self._writer.writerow(line)
+            self._file.flush()
+            self.results[row] = line
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class Importer:
+    """Creates (and optionally checks out) every row on a pool of threads
+    sharing one AdaptiveLimit"""
+
+    def __init__(self, snipe_url, api_key, master_asset, checkout, results,
+                 name_append=None, workers=None, min_workers=None,
+                 target_latency=None, retries=None):
+        self._snipe_url = snipe_url
+        self._api_key = api_key
+        self._master_asset = master_asset
+        self._checkout = checkout
+        self._results = results
+        self._name_append = name_append
+        self._workers = workers or settings.IMPORT_MAX_WORKERS
+        self._retries = settings.IMPORT_RETRIES if retries is None else retries
+        self.limit = AdaptiveLimit(
+            min_workers or settings.IMPORT_MIN_WORKERS,
+            self._workers,
+            target_latency or settings.IMPORT_TARGET_LATENCY,
+        )
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._done = 0
+        self._total = 0
+        self._started = None
+
+    def build_asset(self, number, row):
+        """Returns the asset for CSV row number: the master asset with the
+        row's non-empty columns on top"""
+        asset = dict(self._master_asset)
+        asset.update({k.strip(): v.strip() for k, v in row.items() if k and v and v.strip()})
+        if self._name_append is not None and 'name' in asset:
+            # Same numbering as Append in the GUI, counted from the row number
+            width = len(self._name_append)
+            asset['name'] += str(int(self._name_append) + number - 1).zfill(width)
+        return asset
+
+    def run(self, rows):
+        """rows is a list of (row number, CSV dict).  Returns counts of each
+        result status."""
+        for number, row in rows:
+            previous = self._results.results.get(number, {})
+            status = previous.get('status')
+            if status in DONE or (status == 'created' and not self._checkout):
+                continue
+            snipe_id = previous.get('snipe_id') or None
+            # A check out that did not finish may still have gone through
+            unknown = status == UNKNOWN or (status == 'created' and snipe_id is not None)
+            self._queue.put((number, self.build_asset(number, row), snipe_id, unknown))
+        self._total = self._queue.qsize()
+        logger.info('Importing %s rows (%s already in Snipe)', self._total, len(rows) - self._total)
+        self._started = time.monotonic()
+        threads = []
+        for i in range(min(self._workers, max(1, self._total))):
+            self._queue.put(None)
+            thread = threading.Thread(target=self._worker, name=f'import-{i}', daemon=True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        if self._done % settings.IMPORT_PROGRESS_EVERY:
+            self._log_progress()
+        return dict(self._counts)
+
+    def _worker(self):
+        api = SnipeGet(self._snipe_url, self._api_key, 'hardware')
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            number, asset, snipe_id, unknown = job
+            # _process records the Snipe ID here as soon as the asset is
+            # created, and whether the last create or check out may have gone
+            # through unanswered, so both are kept if anything after raises
+            state = {'snipe_id': snipe_id, 'unknown': unknown}
+            try:
+                status, snipe_id, message = self._process(api, asset, state)
+            except Exception as e:
+                # Not in Snipe (or not checked out).  Resuming tries again,
+                # looking the row up first if it may have gone through.
+                logger.warning('Row %s: %s', number, e)
+                snipe_id = state['snipe_id']
+                if isinstance(e, Unanswered) or state['unknown']:
+                    status = UNKNOWN
+                else:
+                    status = 'created' if snipe_id else 'error'
+                message = str(e)
+            self._results.write(number, status, snipe_id, asset, message)
+            with self._lock:
+                self._counts[status] = self._counts.get(status, 0) + 1
+                self._done += 1
+                done = self._done
+            if done % settings.IMPORT_PROGRESS_EVERY == 0:
+                self._log_progress()
+
+    def _process(self, api, asset, state):
+        """Returns (status, snipe id, message) for one row.  state holds the
+        row's Snipe ID, if it has one yet, and unknown.  If unknown the row
+        may already be created (and checked out) by an attempt whose answer
+        was lost, so it is looked up before anything is sent."""
+        error = None
+        for _attempt in range(self._retries + 1):
+            if state['snipe_id'] is not None:
+                break
+            if state['unknown']:
+                row = self._call(api.find_asset, asset)
+                if row is not None:
+                    state['snipe_id'] = row['id']
+                    logger.info('%s is already in Snipe as %s', asset.get('asset_tag') or asset.get('serial'), row['id'])
+                    if self._checkout and is_assigned(row, self._checkout[1]):
+                        return 'checked_out', row['id'], ''
+                    state['unknown'] = False
+                    break
+            checked_out_on_create = False
+            try:
+                if self._checkout and settings.COMBINED_CHECKOUT:
+                    created, checked_out_on_create = self._call(api.create_asset_checked_out, asset,
+                                                                *self._checkout, post=True)
+                else:
+                    created = self._call(api.create_asset, asset, post=True)
+            except Unanswered as e:
+                error = e
+                state['unknown'] = True
+                continue
+            if created.get('messages') != 'Asset created successfully. :)':
+                return 'failed', None, str(created.get('messages'))
+            state['snipe_id'] = created['payload']['id']
+            if checked_out_on_create:
+                return 'checked_out', state['snipe_id'], ''
+            state['unknown'] = False
+            break
+        else:
+            raise error
+        snipe_id = state['snipe_id']
+        if not self._checkout:
+            return 'created', snipe_id, ''
+        checkout_type, assigned_to_id = self._checkout
+        for _attempt in range(self._retries + 1):
+            if state['unknown']:
+                row = self._call(api.get_by_id, snipe_id)
+                if row is None:
+                    return UNKNOWN, snipe_id, f'Unable to tell if {snipe_id} was checked out'
+                if is_assigned(row, assigned_to_id):
+                    return 'checked_out', snipe_id, ''
+            try:
+                checked_out = self._call(api.checkout_asset, snipe_id, checkout_type, assigned_to_id, post=True)
+            except Unanswered as e:
+                state['unknown'] = True
+                error = e
+                continue
+            except CongestionError as e:
+                return 'created', snipe_id, f'Not checked out: {e}'
+            break
+        else:
+            return UNKNOWN, snipe_id, f'Not checked out: {error}'
+        if checked_out.get('messages') == 'Asset checked out successfully.':
+            return 'checked_out', snipe_id, ''
+        return 'checkout_failed', snipe_id, str(checked_out.get('messages'))
+
+    def _call(self, fn, *args, post=False):
+        """Calls fn under the concurrency limit, retrying connection and
+        server errors with a growing pause.  Raises CongestionError once the
+        retries are used up.  An answer that is JSON but not what Snipe
+        sends (e.g. {"message": "Server Error"}) counts as a server error.
+
+        A post (a create or check out) is only sent again after an error
+        that came before a connection was made.  After any other error
+        Snipe may have acted on it, so Unanswered is raised for the caller
+        to look it up."""
+        for attempt in range(self._retries + 1):
+            self.limit.acquire()
+            started = time.monotonic()
+            failed = True
+            try:
+                data = fn(*args)
+                failed = False
+            except (requests.RequestException, json.JSONDecodeError) as e:
+                error = e
+            except (KeyError, TypeError, AttributeError) as e:
+                error = CongestionError(f'Unexpected answer from Snipe: {e!r}')
+            finally:
+                self.limit.release(time.monotonic() - started, error=failed)
+            if not failed:
+                return data
+            if post and not (isinstance(error, requests.RequestException) and never_sent(error)):
+                raise Unanswered(str(error)) from error
+            if attempt < self._retries:
+                logger.debug('Retrying after %s', error)
+                time.sleep(2 ** attempt)
+        raise CongestionError(str(error))
+
+    def _log_progress(self):
+        with self._lock:
+            done = self._done
+        elapsed = time.monotonic() - self._started
+        throttle = throttle_stats()
+        logger.info('%s of %s rows done.  %.1f rows/s, concurrency %s, error rate %.0f%%, '
+                    'rate limited %.0fs, throttled %s times',
+                    done, self._total, done / elapsed if elapsed else 0.0,
+                    self.limit.limit(), self.limit.error_rate() * 100,
+                    throttle['wait_seconds'], throttle['throttled'])
+
+
+def resolve(endpoint, value, cache=None):
+    """Returns the Snipe id for value, which is either an id or the name of
+    an entry of endpoint.  Names are looked up in the cached list first and
+    on the server if the cache does not have them."""
+    if value.isdigit():
+        return int(value)
+    rows = cache.get(settings.SNIPE_URL, endpoint)[0] if cache else None
+    matches = [r['id'] for r in rows or [] if r['name'] == value]
+    if not matches:
+        rows = SnipeGet(settings.SNIPE_URL, settings.API_KEY, endpoint).get_all()
+        if rows and cache:
+            cache.put(settings.SNIPE_URL, endpoint, rows)
+        matches = [r['id'] for r in rows or [] if r['name'] == value]
+    if len(matches) > 1:
+        raise ValueError(f'More than one {endpoint} named {value}.  Use the id instead')
+    if not matches:
+        raise ValueError(f'No {endpoint} named {value}')
+    return matches[0]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Import a CSV of assets into SnipeIT.')
+    parser.add_argument('csv', help='CSV file with a header row.  Columns are asset fields, e.g. asset_tag,serial')
+    parser.add_argument('--results', help='Results CSV.  Default: <csv>.results.csv')
+    defaults = parser.add_argument_group('master asset', 'Required items take a Snipe id or name')
+    defaults.add_argument('--company', required=True)
+    defaults.add_argument('--model', required=True)
+    defaults.add_argument('--location', required=True)
+    defaults.add_argument('--status', required=True)
+    defaults.add_argument('--supplier', required=True)
+    defaults.add_argument('--name', help='Asset name')
+    defaults.add_argument('--name-append', metavar='START',
+                          help='Append a number counting up from START to the name, e.g. 0001')
+    defaults.add_argument('--purchase-date', help='yyyy-mm-dd')
+    defaults.add_argument('--order-number')
+    defaults.add_argument('--purchase-cost')
+    defaults.add_argument('--warranty', help='Warranty months')
+    defaults.add_argument('--notes')
+    defaults.add_argument('--field', action='append', default=[], metavar='DB_COLUMN=VALUE',
+                          help='Fill a custom field, e.g. --field _snipeit_mac_address_1=none')
+    checkout = parser.add_argument_group('check out')
+    checkout.add_argument('--checkout-type', choices=['User', 'Location', 'Asset'])
+    checkout.add_argument('--checkout-to', type=int, metavar='ID', help='Snipe id to check out to')
+    pool = parser.add_argument_group('concurrency')
+    pool.add_argument('--workers', type=int, default=settings.IMPORT_MAX_WORKERS,
+                      help=f'Most requests in flight (default {settings.IMPORT_MAX_WORKERS})')
+    pool.add_argument('--min-workers', type=int, default=settings.IMPORT_MIN_WORKERS,
+                      help=f'Fewest requests in flight (default {settings.IMPORT_MIN_WORKERS})')
+    pool.add_argument('--target-latency', type=float, default=settings.IMPORT_TARGET_LATENCY,
+                      help='Seconds per request above which concurrency is cut '
+                           f'(default {settings.IMPORT_TARGET_LATENCY})')
+    args = parser.parse_args(argv)
+    if bool(args.checkout_type) != bool(args.checkout_to):
+        parser.error('--checkout-type and --checkout-to go together')
+    for field in args.field:
+        if '=' not in field:
+            parser.error(f'--field {field} is not DB_COLUMN=VALUE')
+    return args
+
+
+def master_asset(args, cache=None):
+    """Builds the master asset the same way the GUI does in start_scanning"""
+    asset = {
+        'company_id': resolve('companies', args.company, cache),
+        'model_id': resolve('models', args.model, cache),
+        'location_id': resolve('locations', args.location, cache),
+        'status_id': resolve('statuslabels', args.status, cache),
+        'supplier_id': resolve('suppliers', args.supplier, cache),
+    }
+    asset['rtd_location_id'] = asset['location_id']
+    optional = {
+        'name': args.name,
+        'purchase_date': args.purchase_date,
+        'order_number': args.order_number,
+        'purchase_cost': args.purchase_cost,
+        'warranty': args.warranty,
+        'notes': args.notes,
+    }
+    asset.update({k: v for k, v in optional.items() if v is not None})
+    for field in args.field:
+        column, value = field.split('=', 1)
+        asset[column.strip()] = value
+    return asset
+
+
+def main(argv=None):
+    logsetup.configure()
+    start_exporter()
+    args = parse_args(argv)
+    logger.info('***************************************')
+    logger.info('          Snipe Import starting')
+    logger.info('***************************************')
+    logger.debug('Snipe URL:            %s', settings.SNIPE_URL)
+    logger.debug('CSV:                  %s', args.csv)
+
+    with open(args.csv, newline='', encoding='utf-8-sig') as f:
+        rows = list(enumerate(csv.DictReader(f), 1))
+    cache = RefCache()
+    try:
+        asset = master_asset(args, cache)
+    except ValueError as e:
+        logger.critical(e)
+        return 1
+    finally:
+        cache.close()
+    logger.debug('Master asset: %s', asset)
+    checkout = (args.checkout_type, args.checkout_to) if args.checkout_type else None
+
+    results = ResultsFile(args.results or os.path.splitext(args.csv)[0] + '.results.csv')
+    importer = Importer(settings.SNIPE_URL, settings.API_KEY, asset, checkout, results,
+                        name_append=args.name_append, workers=args.workers,
+                        min_workers=args.min_workers, target_latency=args.target_latency)
+    try:
+        counts = importer.run(rows)
+    finally:
+        results.close()
+        close_session()
+    logger.info('Import finished: %s', ', '.join(f'{k} {v}' for k, v in sorted(counts.items())) or 'nothing to do')
+    return 0 if not set(counts) - {'created', 'checked_out'} else 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,235 @@
+"""Scans assets into SnipeIT from a terminal, without Qt.
+
+Uses the settings last saved by the GUI (snipeassist.json) as the master
+asset, then reads scanner lines from stdin, prompting for each {{SCAN}}
+field in turn just like the Scanning box in the GUI.  Completed assets are
+created in the background through the same journaled submission pipeline,
+so scanning never waits on Snipe.  Ctrl-D or Ctrl-C stops scanning.
+
+    python snipe_scan.py [--config snipeassist.json]"""
+
+import argparse
+import copy
+import json
+import logging
+import os
+import sys
+import threading
+from datetime import datetime
+
+import logsetup
+import settings
+from fieldsetindex import FieldsetIndex
+from metrics import start_exporter
+from pipeline import SubmissionPipeline
+from refcache import RefCache
+from snipeapi import SnipeGet, close_session
+
+logger = logging.getLogger('snipeassist')
+
+# Saved combobox name, endpoint and master asset key of each required item
+REQUIRED_ITEMS = (
+    ('comboBoxCompany', 'companies', 'company_id'),
+    ('comboBoxModel', 'models', 'model_id'),
+    ('comboBoxLocation', 'locations', 'location_id'),
+    ('comboBoxStatus', 'statuslabels', 'status_id'),
+    ('comboBoxSupplier', 'suppliers', 'supplier_id'),
+)
+
+# Saved check box, line edit and master asset key of each static field
+STATIC_ITEMS = (
+    ('checkBoxAssetName', 'lineEditAssetName', 'name'),
+    ('checkBoxOrderNumber', 'lineEditOrderNumber', 'order_number'),
+    ('checkBoxPurchaseCost', 'lineEditPurchaseCost', 'purchase_cost'),
+    ('checkBoxWarranty', 'lineEditWarranty', 'warranty'),
+    ('checkBoxNotes', 'lineEditNotes', 'notes'),
+)
+
+_print_lock = threading.Lock()
+
+
+def say(text, bell=False):
+    with _print_lock:
+        sys.stdout.write(('\a' if bell else '') + text + '\n')
+        sys.stdout.flush()
+
+
+def cached_rows(cache, endpoint):
+    """Returns the rows of endpoint from the reference cache, downloading
+    (and caching) them if they are not cached"""
+    rows, _age = cache.get(settings.SNIPE_URL, endpoint)
+    if rows is None:
+        logger.info('%s not cached.  Downloading', endpoint)
+        rows = SnipeGet(settings.SNIPE_URL, settings.API_KEY, endpoint).get_all()
+        if rows:
+            cache.put(settings.SNIPE_URL, endpoint, rows)
+    return rows or []
+
+
+def find_id(rows, name):
+    """Returns the id of the first row named name, as findText would pick it"""
+    for row in sorted(rows, key=lambda r: r['name']):
+        if row['name'] == name:
+            return row['id']
+    return None
+
+
+def model_fields(cache, model_id):
+    """Returns the custom fields of a model, [] if it has none"""
+    index = FieldsetIndex()
+    index.set_models(cached_rows(cache, 'models'))
+    index.set_fieldsets(cached_rows(cache, 'fieldsets'))
+    try:
+        fieldset_id = index.fieldset_id(model_id)
+    except KeyError:
+        model = SnipeGet(settings.SNIPE_URL, settings.API_KEY, 'models').get_by_id(model_id)
+        fieldset_id = model['fieldset']['id'] if model['fieldset'] else None
+    if fieldset_id is None:
+        return []
+    if index.fieldset(fieldset_id) is None:
+        index.add_fieldset(SnipeGet(settings.SNIPE_URL, settings.API_KEY, 'fieldsets').get_by_id(fieldset_id))
+    return index.fieldset(fieldset_id)['fields']
+
+
+def build_template(saved, cache):
+    """Builds the master asset and check out from the saved GUI settings, the
+    same way the GUI does when Start Scanning is pressed.  Raises ValueError
+    if a saved required item is no longer in Snipe."""
+    asset = {}
+    for combobox, endpoint, key in REQUIRED_ITEMS:
+        _id = find_id(cached_rows(cache, endpoint), saved.get(combobox))
+        if _id is None:
+            raise ValueError(f'{endpoint}: {saved.get(combobox)!r} not found.  Choose it again in the GUI')
+        asset[key] = _id
+    asset['rtd_location_id'] = asset['location_id']
+    for checkbox, line_edit, key in STATIC_ITEMS:
+        if saved.get(checkbox):
+            asset[key] = saved.get(line_edit, '')
+    if saved.get('checkBoxPurchaseDate'):
+        try:
+            date = datetime.strptime(saved.get('lineEditPurchaseDate', ''), '%Y%m%d')
+            asset['purchase_date'] = date.strftime('%Y-%m-%d')
+        except ValueError:
+            logger.warning('Saved purchase date %r is not valid.  Not recording it',
+                           saved.get('lineEditPurchaseDate'))
+    if saved.get('checkBoxScanAssetTag'):
+        asset['asset_tag'] = '{{SCAN}}'
+    if saved.get('checkBoxScanSerial'):
+        asset['serial'] = '{{SCAN}}'
+    for f in model_fields(cache, asset['model_id']):
+        column = f['db_column_name']
+        scan = saved.get(column + '_scan', 'Do not record')
+        if scan == 'Scan':
+            asset[column] = '{{SCAN}}'
+        elif scan == 'Fill':
+            asset[column] = saved.get(column + '_data', '')
+    checkout = None
+    checkout_type = saved.get('comboBoxEditCheckOutType', 'None')
+    if saved.get('checkBoxCheckOutEnabled') and checkout_type != 'None':
+        if not saved.get('checkoutToId'):
+            raise ValueError('Check out is enabled but nobody to check out to is saved')
+        checkout = (checkout_type, int(saved['checkoutToId']))
+    return asset, checkout
+
+
+def save_append(path, saved):
+    """Writes the asset name counter back to the settings file"""
+    temp = path + '.tmp'
+    with open(temp, 'w', encoding='utf-8') as f:
+        json.dump(saved, f, indent=4)
+    os.replace(temp, path)
+
+
+class TerminalScanner:
+    """The {{SCAN}} loop of the GUI's Scanning box, reading from a stream"""
+
+    def __init__(self, template, checkout, saved, pipeline, stream=sys.stdin):
+        self._template = template
+        self._checkout = checkout
+        self._saved = saved
+        self._pipeline = pipeline
+        self._stream = stream
+        self.queued = 0
+
+    def run(self):
+        """Scans assets until the stream ends"""
+        while True:
+            asset = copy.deepcopy(self._template)
+            for key, val in asset.items():
+                if val != '{{SCAN}}':
+                    continue
+                line = ''
+                while not line:
+                    with _print_lock:
+                        sys.stdout.write(f'{key}: ')
+                        sys.stdout.flush()
+                    line = self._stream.readline()
+                    if not line:
+                        return
+                    line = line.strip()
+                asset[key] = line
+            self._append_name(asset)
+            logger.debug(asset)
+            self._pipeline.submit(asset, self._checkout)
+            self.queued += 1
+            say(f'Asset Queued ({self._pipeline.in_flight()} in flight)')
+
+    def _append_name(self, asset):
+        append = self._saved.get('lineEditAssetNameAppend', '')
+        if not self._saved.get('checkBoxAppend'):
+            return
+        if 'name' in asset:
+            asset['name'] += append
+        self._saved['lineEditAssetNameAppend'] = str(int('9' + append) + 1)[1:]
+
+
+def show_result(result):
+    say(result['message'], bell=result['sound'] == 'warning')
+
+
+def main(argv=None):
+    logsetup.configure()
+    start_exporter()
+    parser = argparse.ArgumentParser(description='Scan assets into SnipeIT from a terminal.')
+    parser.add_argument('--config', default='snipeassist.json',
+                        help='Settings saved by the GUI (default snipeassist.json)')
+    args = parser.parse_args(argv)
+
+    try:
+        with open(args.config, encoding='utf-8') as f:
+            saved = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.critical('Unable to read %s: %s.  Set up and save a scan in the GUI first', args.config, e)
+        return 1
+    cache = RefCache()
+    try:
+        template, checkout = build_template(saved, cache)
+    except ValueError as e:
+        logger.critical(e)
+        return 1
+    finally:
+        cache.close()
+    if '{{SCAN}}' not in template.values():
+        logger.critical('Nothing to Scan.  Nothing to do.')
+        return 1
+    logger.debug(template)
+
+    pipeline = SubmissionPipeline(settings.SNIPE_URL, settings.API_KEY, show_result)
+    scanner = TerminalScanner(template, checkout, saved, pipeline)
+    say('Scanning.  Ctrl-D to stop.')
+    try:
+        scanner.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        say('Finishing queued assets')
+        pipeline.close()
+        close_session()
+        if settings.SAVE_ON_EXIT:
+            save_append(args.config, saved)
+    logger.info('Scanning stopped.  %s assets queued this session', scanner.queued)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
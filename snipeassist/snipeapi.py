@@ -1,78 +1,595 @@
 """A small API Interface for the things I'll need from Snipe"""
+import codecs
 import logging
-import logging.config
 import json
+import itertools
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
+import urllib3
+from requests.adapters import HTTPAdapter
 
 import settings
+from metrics import get_metrics
 from project import all_snipe_endpoints
 
 MAX_LIMIT = 500
+# Bytes read at a time when a page is parsed as it downloads
+CHUNK_SIZE = 65536
 
-logging.config.dictConfig(settings.LOGGING_CONFIG)
 logger = logging.getLogger(__name__)
 
-class SnipeGet:
+# One pooled, keep-alive session is shared by every SnipeGet instance so
+# repeated calls reuse open TCP/TLS connections instead of reconnecting.
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Returns the process-wide pooled requests session, creating it on first use"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                logger.debug('Creating HTTP session.  Pool size: %s, Keep-alive: %s',
+                             settings.HTTP_POOL_SIZE, settings.HTTP_KEEP_ALIVE)
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=settings.HTTP_POOL_CONNECTIONS,
+                    pool_maxsize=settings.HTTP_POOL_SIZE,
+                    pool_block=True,
+                )
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                if not settings.HTTP_KEEP_ALIVE:
+                    session.headers['Connection'] = 'close'
+                _session = session
+    return _session
+
+
+def close_session():
+    """Closes the shared session and its pooled connections"""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            logger.debug('Closing HTTP session')
+            _session.close()
+            _session = None
+
+
+class RateLimiter:
+    """A token bucket shared by every request to the Snipe server.
+
+    Tokens refill at rate per second up to burst.  Each request takes one;
+    when the bucket is empty the request waits for the next token, so
+    bursts are smoothed out to the server's limit instead of being
+    throttled.  pause() holds every request back, e.g. for a Retry-After.
+    A rate of 0 or less turns the limit off."""
+
+    def __init__(self, rate, burst):
+        self._rate = rate
+        self._burst = max(1.0, burst)
+        self._tokens = self._burst
+        self._updated = time.monotonic()
+        self._not_before = 0.0
+        self._lock = threading.Lock()
+        self._stats = {
+            'requests': 0,
+            'delayed': 0,
+            'wait_seconds': 0.0,
+            'throttled': 0,
+            'retries': 0,
+            'retry_wait_seconds': 0.0,
+            'server_limit': None,
+            'server_remaining': None,
+        }
+
+    def reserve(self):
+        """Takes a token and returns the seconds to wait before sending the
+        request.  For callers that sleep their own way (asyncio)."""
+        with self._lock:
+            now = time.monotonic()
+            delay = max(0.0, self._not_before - now)
+            if self._rate > 0:
+                self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                self._tokens -= 1
+                if self._tokens < 0:
+                    delay = max(delay, -self._tokens / self._rate)
+            self._stats['requests'] += 1
+            if delay:
+                self._stats['delayed'] += 1
+                self._stats['wait_seconds'] += delay
+            return delay
+
+    def acquire(self):
+        """Waits until a request may be sent"""
+        delay = self.reserve()
+        if delay:
+            logger.debug('Rate limit: waiting %.2f seconds', delay)
+            time.sleep(delay)
+
+    def pause(self, seconds):
+        """Holds back every request for seconds, e.g. after a 429"""
+        with self._lock:
+            self._not_before = max(self._not_before, time.monotonic() + seconds)
+            self._stats['throttled'] += 1
+            self._stats['retries'] += 1
+            self._stats['retry_wait_seconds'] += seconds
+
+    def observe(self, headers):
+        """Records the server's X-RateLimit-Limit / -Remaining headers"""
+        limit = headers.get('X-RateLimit-Limit')
+        remaining = headers.get('X-RateLimit-Remaining')
+        if limit is None and remaining is None:
+            return
+        with self._lock:
+            if limit is not None and limit.isdigit():
+                self._stats['server_limit'] = int(limit)
+            if remaining is not None and remaining.isdigit():
+                self._stats['server_remaining'] = int(remaining)
+
+    def stats(self):
+        """Returns counts of requests, requests delayed by the limiter and
+        429 responses, seconds spent waiting, and the last limit and
+        remaining requests reported by the server"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['rate'] = self._rate
+        stats['burst'] = self._burst
+        return stats
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Returns the process-wide RateLimiter, creating it on first use"""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                logger.debug('Rate limit: %s requests a minute, bursts of %s',
+                             settings.API_RATE_LIMIT, settings.API_RATE_BURST)
+                _limiter = RateLimiter(settings.API_RATE_LIMIT / 60, settings.API_RATE_BURST)
+    return _limiter
+
+
+def throttle_stats():
+    """Rate limiting and throttling counts for every request so far"""
+    return get_rate_limiter().stats()
+
+
+def retry_delay(headers, attempt):
+    """Returns the seconds to wait before retrying a throttled request:
+    the Retry-After header if the server sent one, otherwise an exponential
+    backoff of API_BACKOFF * 2**attempt, capped at API_BACKOFF_MAX"""
+    retry_after = headers.get('Retry-After')
+    if retry_after:
+        try:
+            return min(settings.API_BACKOFF_MAX, max(0.0, float(retry_after)))
+        except ValueError:
+            try:
+                when = parsedate_to_datetime(retry_after).timestamp()
+                return min(settings.API_BACKOFF_MAX, max(0.0, when - time.time()))
+            except (TypeError, ValueError):
+                pass
+    return min(settings.API_BACKOFF_MAX, settings.API_BACKOFF * 2 ** attempt)
+
+
+def validate_endpoint(endpoint):
+    """Returns endpoint if it is a known Snipe endpoint, otherwise hardware"""
+    if endpoint in all_snipe_endpoints:
+        logger.debug('New Snipe Instance for endpoint: %s', endpoint)
+        return endpoint
+    logger.error('Endpoint %s not defined, defaulting to hardware', endpoint)
+    return 'hardware'
+
+
+def clamp_limit(limit):
+    """Returns limit clamped to 1..MAX_LIMIT.  Out of range values become MAX_LIMIT."""
+    if limit > MAX_LIMIT:
+        logger.warning('Limit %s is higher than %s, setting to %s',
+                            limit, MAX_LIMIT, MAX_LIMIT)
+        limit = MAX_LIMIT
+    elif limit <= 0:
+        logger.warning('Limit %s is lower than 1, setting to %s',
+                            limit, MAX_LIMIT)
+        limit = MAX_LIMIT
+    return limit
+
+
+def never_sent(error):
+    """True if a requests error happened before a connection was made
+    (refused, unresolvable or a connect timeout), so Snipe can not have
+    acted on the request.  Any other error may have come after Snipe
+    received it."""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+
+def checkout_payload(checkout_type, assigned_to_id):
+    """Builds the body for a checkout request.  Returns None if checkout_type
+    is not user, asset, or location."""
+    checkout_type = checkout_type.lower()
+    if checkout_type not in ['user', 'asset', 'location']:
+        logger.warning(f'Check out type not valid: {checkout_type}.  Expected user, asset, or location')
+        return None
+    return {
+        'checkout_to_type': checkout_type,
+        'assigned_' + checkout_type: assigned_to_id,
+    }
+
+
+def assigned_on_create(created, assigned_to_id):
+    """True if a create response shows the new asset already checked out to
+    assigned_to_id.  Snipe versions that do not check out on create leave
+    assigned_to empty."""
+    return is_assigned(created.get('payload') or {}, assigned_to_id)
+
+
+def is_assigned(row, assigned_to_id):
+    """True if a hardware row is checked out to assigned_to_id"""
+    assigned = row.get('assigned_to')
+    if isinstance(assigned, dict):
+        assigned = assigned.get('id')
+    try:
+        return assigned is not None and int(assigned) == int(assigned_to_id)
+    except (TypeError, ValueError):
+        return False
+
+
+def rejects_checkout_fields(created, checkout):
+    """True if a create failed only because of the check out fields (the
+    validation messages are all about them), so it can be sent again
+    without them"""
+    messages = created.get('messages')
+    return (created.get('status') == 'error' and isinstance(messages, dict)
+            and bool(messages) and set(messages) <= set(checkout))
+
+
+# Snipe URLs that ignored check out fields in a create request.  Their
+# assets are created and then checked out in two requests.
+_no_combined_checkout = set()
+
+
+def combined_checkout_enabled(snipe_url):
+    """False once the server at snipe_url has shown that it ignores check
+    out fields in a create"""
+    return snipe_url not in _no_combined_checkout
+
+
+def checked_out_on_create(snipe_url, created, assigned_to_id):
+    """True if a create sent with check out fields checked the asset out.
+    If Snipe created the asset but left it unassigned it ignores the
+    fields, so later creates to snipe_url are sent without them."""
+    if assigned_on_create(created, assigned_to_id):
+        return True
+    if created.get('status') == 'success':
+        logger.info('Snipe does not check out on create.  Creating and checking out separately')
+        _no_combined_checkout.add(snipe_url)
+    return False
+
+
+def log_create_response(data):
+    if data['status'] == 'success':
+        logger.debug('Snipe API Reports status success')
+        if data['messages'] == 'Asset created successfully. :)':
+            logger.debug('Snipe API Reports Asset created')
+        else:
+            logger.debug(f'Snipe API Reports: {data["messages"]}')
+    else:
+        logger.warning(f'Snipe API reports status: {data["status"]}')
+
+
+def log_checkout_response(data):
+    if data['status'] == 'success':
+        logger.debug('Snipe API Reports status success')
+        if data['messages'] == 'Asset checked out successfully.':
+            logger.debug('Snipe API Reports Asset Checked Out')
+        else:
+            logger.debug(f'Snipe API Reports: {data["messages"]}')
+    else:
+        logger.warning(f'Snipe API reports status: {data["status"]}')
+
+
+def dedupe_rows(rows):
+    """Drops rows whose id was already seen.  Rows can shift between
+    pages if records are added while paging."""
+    seen = set()
+    ret = []
+    for r in rows:
+        if r['id'] in seen:
+            continue
+        seen.add(r['id'])
+        ret.append(r)
+    return ret
+
 
-    def __init__(self, snipe_url, api_key, endpoint='hardware', limit=500):
+class _JsonStream:
+    """Reads JSON values one at a time from an iterable of byte chunks,
+    keeping only the text not yet parsed"""
 
+    _decoder = json.JSONDecoder()
 
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decode = codecs.getincrementaldecoder('utf-8')().decode
+        self._text = ''
+        self._pos = 0
+        self._done = False
+
+    def _more(self):
+        """Appends the next chunk to the unparsed text.  False at the end."""
+        if self._done:
+            return False
+        chunk = next(self._chunks, None)
+        self._done = chunk is None
+        self._text = self._text[self._pos:] + self._decode(chunk or b'', final=self._done)
+        self._pos = 0
+        return True
+
+    def _error(self, message):
+        return json.JSONDecodeError(message, self._text, self._pos)
+
+    def peek(self):
+        """The next character that is not white space, '' at the end"""
+        while True:
+            while self._pos < len(self._text) and self._text[self._pos] in ' \t\n\r':
+                self._pos += 1
+            if self._pos < len(self._text) or not self._more():
+                return self._text[self._pos:self._pos + 1]
+
+    def expect(self, chars):
+        """Reads the next character, which must be one of chars"""
+        char = self.peek()
+        if not char or char not in chars:
+            raise self._error(f'Expecting one of {chars!r}')
+        self._pos += 1
+        return char
+
+    def value(self):
+        """Reads the next value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._text, self._pos)
+            except json.JSONDecodeError:
+                if self._more():
+                    continue
+                raise
+            # A number may go on in the next chunk ("-0" of "-0.5"), so a
+            # value only counts once the character after it is in
+            if (end < len(self._text) and self._text[end] in ' \t\n\r,:]}') or not self._more():
+                self._pos = end
+                return value
+
+
+def parse_page(chunks, fields=None):
+    """Parses a JSON response body from an iterable of byte chunks.  With
+    fields, the rows of a list page ({"total": .., "rows": [..]}) are
+    parsed one at a time as the body downloads and only those fields of
+    each row are kept, so neither the whole body nor the full rows are held
+    in memory at once.  Without, the body is parsed in one go: whole rows
+    parsed together share their key strings, so take less memory."""
+    if fields is None:
+        return json.loads(b''.join(chunks))
+    stream = _JsonStream(chunks)
+    if stream.peek() != '{':
+        return stream.value()
+    stream.expect('{')
+    page = {}
+    if stream.peek() == '}':
+        return page
+    while True:
+        key = stream.value()
+        stream.expect(':')
+        if key == 'rows' and stream.peek() == '[':
+            page[key] = list(_parse_rows(stream, fields))
+        else:
+            page[key] = stream.value()
+        if stream.expect(',}') == '}':
+            return page
+
+
+def _parse_rows(stream, fields):
+    stream.expect('[')
+    if stream.peek() == ']':
+        stream.expect(']')
+        return
+    while True:
+        row = stream.value()
+        if fields is not None and isinstance(row, dict):
+            row = {k: row[k] for k in fields if k in row}
+        yield row
+        if stream.expect(',]') == ']':
+            return
+
+
+def project_rows(rows, fields):
+    """Keeps only fields of each row.  rows is returned as is if fields is None."""
+    if fields is None:
+        return rows
+    return [{k: r[k] for k in fields if k in r} for r in rows]
+
+
+class SnipeGet:
+    """fields is the projection: the row fields list pages keep, e.g.
+    ('id', 'name').  None keeps whole rows."""
+
+    def __init__(self, snipe_url, api_key, endpoint='hardware', limit=500, workers=None, fields=None):
         self._api_key = api_key
         self._snipe_url = snipe_url
-        if endpoint in all_snipe_endpoints:
-            logger.debug('New Snipe Instance for endpoint: %s', endpoint)
-            self._endpoint = endpoint
-        else:
-            logger.error('Endpoint %s not defined, defaulting to hardware', endpoint)
-            self._endpoint = 'hardware'
-        if limit > MAX_LIMIT:
-            logger.warning('Limit %s is higher than %s, setting to %s',
-                                limit, MAX_LIMIT, MAX_LIMIT)
-            limit = MAX_LIMIT
-        elif limit <= 0:
-            logger.warning('Limit %s is lower than 1, setting to %s',
-                                limit, MAX_LIMIT)
-            limit = MAX_LIMIT
+        self._endpoint = validate_endpoint(endpoint)
+        limit = clamp_limit(limit)
         self._limit = limit
+        # Number of pages get_all fetches at the same time.  1 fetches
+        # one page after another.
+        if workers is None:
+            workers = settings.PAGE_WORKERS
+        self._workers = max(1, workers)
+        self._fields = tuple(fields) if fields is not None else None
         self._url = self._snipe_url + self._endpoint + '?limit=' + str(limit)
         self._headers = {
             "accept": "application/json",
             "Authorization": "Bearer " + self._api_key
         }
+        # Headers for POST requests.  Kept separate so the shared
+        # self._headers dict is never modified after __init__.
+        self._json_headers = dict(self._headers)
+        self._json_headers['content-type'] = 'application/json'
 
-    def get_all(self):
-        ret = []
-        offset = 0
-        logger.debug('Getting all records for endpoint %s', self._endpoint)
+    def _request(self, method, url, route=None, parse=None, **kwargs):
+        """Sends a request through the shared pooled session and rate
+        limiter.  A 429 (Too Many Requests) is retried up to API_RETRIES
+        times after the Retry-After or backoff delay; after that an
+        HTTPError is raised.  The request is recorded in the metrics under
+        route, the endpoint by default.
+
+        Returns the response.  If parse is given the body is streamed to
+        parse(chunks) as it downloads, and its result is returned instead."""
+        kwargs.setdefault('timeout', (settings.HTTP_CONNECT_TIMEOUT, settings.HTTP_TIMEOUT))
+        route = route or self._endpoint
+        limiter = get_rate_limiter()
+        metrics = get_metrics()
+        for attempt in range(settings.API_RETRIES + 1):
+            limiter.acquire()
+            started = time.monotonic()
+            size = 0
+            try:
+                response = get_session().request(method, url, stream=parse is not None, **kwargs)
+                if parse is not None and response.status_code != 429:
+                    def chunks():
+                        nonlocal size
+                        for chunk in response.iter_content(CHUNK_SIZE):
+                            size += len(chunk)
+                            yield chunk
+                    try:
+                        result = parse(chunks())
+                    finally:
+                        response.close()
+                else:
+                    size = len(response.content)
+            except (requests.RequestException, ValueError):
+                metrics.record(route, method, time.monotonic() - started, size, error=True)
+                raise
+            metrics.record(route, method, time.monotonic() - started, size,
+                           error=response.status_code >= 400)
+            limiter.observe(response.headers)
+            if response.status_code != 429:
+                return response if parse is None else result
+            if attempt == settings.API_RETRIES:
+                break
+            delay = retry_delay(response.headers, attempt)
+            logger.warning('Snipe is throttling requests.  Retrying in %.1f seconds', delay)
+            limiter.pause(delay)
+            metrics.retry(route, method)
+        response.raise_for_status()
+
+    def get_page(self, offset=0, **params):
+        """Fetches the page starting at offset and returns the parsed JSON,
+        its rows cut down to the fields given to __init__.  Extra params are
+        added to the query string, e.g. search='smith', sort='name',
+        order='asc'."""
+        url = self._url
+        if offset:
+            params['offset'] = offset
+        if params:
+            url += '&' + urlencode(params)
+        return self._request('GET', url, headers=self._headers,
+                             parse=lambda chunks: parse_page(chunks, self._fields))
+
+    def iter_pages(self, workers=None):
+        """Yields each page of the endpoint as parsed JSON ({'total': .., 'rows': [..]})
+        in offset order.  Each response body is parsed once.  Once the first
+        page reports the total, up to workers pages are fetched ahead at the
+        same time (defaults to the value given to __init__).  Errors are raised
+        to the caller.  The number of pages is recorded in the metrics."""
+        depth = 0
         try:
-            response = requests.get(self._url, headers=self._headers)
-            for r in response.json()['rows']:
-                ret.append(r)
-            logger.debug('Received %s rows out of %s from endpoint: %s',
-                         len(ret),
-                         response.json()['total'],
-                         self._endpoint
-                         )
-            while response.json()['total'] > len(ret):
-                offset += self._limit
-                temp_url = self._url + '&offset=' + str(offset)
-                response = requests.get(temp_url,
-                                        headers=self._headers)
-                for r in response.json()['rows']:
-                    ret.append(r)
+            for page in self._iter_pages(workers):
+                depth += 1
+                yield page
+        finally:
+            if depth:
+                get_metrics().pages(self._endpoint, depth)
+
+    def _iter_pages(self, workers):
+        if workers is None:
+            workers = self._workers
+        logger.debug('Getting all records for endpoint %s with %s workers',
+                     self._endpoint, workers)
+        page = self.get_page(0)
+        total = page['total']
+        received = len(page['rows'])
+        logger.debug('Received %s rows out of %s from endpoint: %s',
+                     received, total, self._endpoint)
+        yield page
+        if not received or received >= total:
+            return
+        # The server may cap the page size below our limit, so step
+        # by the number of rows it actually returned.
+        step = min(received, self._limit)
+        offsets = iter(range(step, total, step))
+        if workers <= 1:
+            for offset in offsets:
+                page = self.get_page(offset)
+                received += len(page['rows'])
+                logger.debug('Received %s rows out of %s from endpoint: %s',
+                             received, total, self._endpoint)
+                yield page
+                if not page['rows']:
+                    return
+            return
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Keep at most workers pages in flight so a slow consumer does
+            # not pile up downloaded pages in memory.
+            in_flight = deque()
+            for offset in itertools.islice(offsets, workers):
+                in_flight.append(executor.submit(self.get_page, offset))
+            while in_flight:
+                page = in_flight.popleft().result()
+                offset = next(offsets, None)
+                if offset is not None:
+                    in_flight.append(executor.submit(self.get_page, offset))
+                received += len(page['rows'])
                 logger.debug('Received %s rows out of %s from endpoint: %s',
-                             len(ret),
-                             response.json()['total'],
-                             self._endpoint
-                             )
-            return ret
-        except:
+                             received, total, self._endpoint)
+                yield page
+
+    def iter_rows(self, workers=None):
+        """Yields every row for the endpoint as its page arrives.  Rows that
+        shift between pages while paging are only yielded once."""
+        seen = set()
+        for page in self.iter_pages(workers):
+            for r in page['rows']:
+                if r['id'] in seen:
+                    continue
+                seen.add(r['id'])
+                yield r
+
+    def get_all(self, workers=None):
+        """Returns every row for the endpoint as a list, or None on error"""
+        try:
+            return list(self.iter_rows(workers))
+        except (requests.RequestException, ValueError, KeyError) as e:
+            # ValueError: not JSON.  KeyError: JSON without rows, e.g. an
+            # error message.
+            logger.warning('Unable to get %s: %s', self._endpoint, e)
             return None
 
     def get_by_id(self, snipe_id):
         try:
-            response = requests.get(self._snipe_url + self._endpoint + '/' + str(snipe_id), headers=self._headers)
+            response = self._request('GET', self._snipe_url + self._endpoint + '/' + str(snipe_id),
+                                     route=self._endpoint + '/{id}', headers=self._headers)
             if response.status_code == 200:
                 return response.json()
             else:
@@ -81,10 +598,29 @@ class SnipeGet:
             logger.warning(e)
             return None
 
+    def find_asset(self, asset):
+        """Returns the hardware row with the asset_tag of asset (or its serial
+        if it has no tag), or None if Snipe has no such asset.  Tells whether
+        a create whose answer was lost went through.  Raises ValueError if
+        asset has neither; request errors are raised to the caller."""
+        for field in ('asset_tag', 'serial'):
+            value = str(asset.get(field) or '').strip()
+            if not value:
+                continue
+            for row in self.get_page(search=value)['rows']:
+                if str(row.get(field) or '').strip().casefold() == value.casefold():
+                    return row
+            return None
+        raise ValueError('No asset tag or serial to look the asset up by')
+
     def count(self):
+        """Returns the number of rows in the endpoint, or None if Snipe can
+        not be reached.  Only one row is asked for, so this is also a cheap
+        check that the server is up."""
         try:
-            response = requests.get(
-                self._snipe_url + self._endpoint,
+            response = self._request(
+                'GET',
+                self._snipe_url + self._endpoint + '?limit=1',
                 headers=self._headers
             )
             if response.status_code == 200:
@@ -101,56 +637,178 @@ class SnipeGet:
     def create_asset(self, asset):
         logger.debug('Creating Asset:')
         logger.debug(asset)
-        headers = self._headers
-        headers['content-type'] = 'application/json'
-        response = requests.post(self._snipe_url + self._endpoint, json=asset, headers=headers)
+        response = self._request('POST', self._snipe_url + self._endpoint, json=asset, headers=self._json_headers)
         logger.debug(f'Request Response Status Code: {response.status_code}')
         data = json.loads(response.text)
-        if data['status'] == 'success':
-            logger.debug('Snipe API Reports status success')
-            if data['messages'] == 'Asset created successfully. :)':
-                logger.debug('Snipe API Reports Asset created')
-            else:
-                logger.debug(f'Snipe API Reports: {data["messages"]}')
-        else:
-            logger.warn(f'Snipe API reports status: {data["status"]}')
+        log_create_response(data)
         return data
     
+    def create_asset_checked_out(self, asset, checkout_type, assigned_to_id):
+        """Creates an asset and checks it out in one request by adding the
+        check out fields (checkout_to_type, assigned_<type>) to the create.
+        Returns (create response, checked out).  checked out is False if
+        Snipe created the asset without checking it out, so the caller must
+        call checkout_asset.  If Snipe rejects the check out fields (e.g. an
+        unknown user) this asset is created without them, and checkout_asset
+        reports why.  If Snipe ignores the fields, later calls leave them
+        out."""
+        checkout = checkout_payload(checkout_type, assigned_to_id)
+        if checkout is None or not combined_checkout_enabled(self._snipe_url):
+            return self.create_asset(asset), False
+        data = self.create_asset(dict(asset, **checkout))
+        if rejects_checkout_fields(data, checkout):
+            logger.info('Snipe rejected the check out fields (%s).  Creating and checking out separately',
+                        data.get('messages'))
+            return self.create_asset(asset), False
+        return data, checked_out_on_create(self._snipe_url, data, assigned_to_id)
+
     def checkout_asset(self, asset_id, checkout_type, assigned_to_id):
-        checkout_type = checkout_type.lower()
-        if checkout_type not in ['user', 'asset', 'location']:
-            logger.warning(f'Check out type not valid: {checkout_type}.  Expected user, asset, or location')
-            return {'status': 'error'}
-        if checkout_type == 'user':
-            assigned_type = 'assigned_user'
-        elif checkout_type == 'asset':
-            assigned_type = 'assigned_asset'
-        elif checkout_type == 'location':
-            assigned_type = 'assigned_location'
-        else:
-            logger.critical('Critical error occurred while assigning Check out type.')
+        payload = checkout_payload(checkout_type, assigned_to_id)
+        if payload is None:
             return {'status': 'error'}
         logger.debug('Checking out Asset:')
         logger.debug(asset_id)
-        headers = self._headers
-        headers['content-type'] = 'application/json'
         checkout_url = self._snipe_url + self._endpoint + '/' + str(asset_id) + '/checkout'
-        payload = {
-            'checkout_to_type': checkout_type,
-            assigned_type: assigned_to_id,
-        }
-        response = requests.post(checkout_url, json=payload, headers=headers)
+        response = self._request('POST', checkout_url, route=self._endpoint + '/{id}/checkout',
+                                 json=payload, headers=self._json_headers)
         logger.debug(f'Request Response Status Code: {response.status_code}')
         data = json.loads(response.text)
-        if data['status'] == 'success':
-            logger.debug('Snipe API Reports status success')
-            if data['messages'] == 'Asset checked out successfully.':
-                logger.debug('Snipe API Reports Asset Checked Out')
-            else:
-                logger.debug(f'Snipe API Reports: {data["messages"]}')
-        else:
-            logger.warn(f'Snipe API reports status: {data["status"]}')
+        log_checkout_response(data)
         return data
 
     def get_snipe_url(self):
         return self._snipe_url
+
+    def get_endpoint(self):
+        return self._endpoint
+
+    def get_fields(self):
+        return self._fields
+
+
+def updated_stamp(row):
+    """The updated_at time of a row as 'YYYY-MM-DD HH:MM:SS', which sorts
+    in time order, or '' if it has none"""
+    updated = row.get('updated_at')
+    if isinstance(updated, dict):
+        updated = updated.get('datetime')
+    return updated or ''
+
+
+class DeltaSync:
+    """A local copy of every row of an endpoint (hardware or users) that is
+    kept up to date by asking only for the rows changed since the last sync.
+
+    The first sync() downloads every row.  Later ones page the endpoint
+    newest updated_at first and stop at the first row older than the high
+    water mark (the newest updated_at seen), so a few changes cost one
+    request.  Deleted rows never show up that way, so the total of the
+    first page is compared with the local row count; if they differ, every
+    row is downloaded again to find the ones that are gone.  A delete and
+    an add between syncs leave the count as it was, so every row is also
+    downloaded again once full_interval seconds (SYNC_FULL_INTERVAL by
+    default, 0 for never) have passed since the last full download.
+
+    api is a SnipeGet of the endpoint.  If it has a projection it must
+    include id and updated_at."""
+
+    def __init__(self, api, rows=None, full_interval=None):
+        self._api = api
+        if full_interval is None:
+            full_interval = settings.SYNC_FULL_INTERVAL
+        self.full_interval = full_interval
+        # time.monotonic() of the last full download, or of the seed
+        self._full_at = None
+        # Names the endpoint and projection, so rows saved with other
+        # fields are not mistaken for these
+        self.key = api.get_endpoint() + ':' + ','.join(api.get_fields() or ('*',))
+        # id -> row
+        self._rows = {}
+        self.high_water = None
+        if rows:
+            self.seed(rows)
+
+    def seed(self, rows):
+        """Starts from rows saved by an earlier run, so the first sync only
+        asks for what changed since"""
+        self._rows = {r['id']: r for r in rows}
+        self.high_water = max((updated_stamp(r) for r in rows), default=None)
+        self._full_at = time.monotonic()
+
+    @property
+    def loaded(self):
+        return self.high_water is not None
+
+    @property
+    def rows(self):
+        return list(self._rows.values())
+
+    def __len__(self):
+        return len(self._rows)
+
+    def full_due(self):
+        """True if every row is to be downloaded again by the next sync"""
+        return not self.loaded or bool(
+            self.full_interval and time.monotonic() - self._full_at >= self.full_interval)
+
+    def sync(self):
+        """Brings the local copy up to date.  Returns (changed rows, removed
+        ids): the rows that are new or differ from the local copy and the
+        ids of rows that are no longer in Snipe.  Errors are raised to the
+        caller and leave the local copy as it was.  Not thread safe: run one
+        sync at a time."""
+        if self.full_due():
+            if self.loaded:
+                logger.info('%s not fully downloaded for %.0f seconds.  Downloading them all to find what was removed',
+                            self._api.get_endpoint(), time.monotonic() - self._full_at)
+            return self._full()
+        changed = {}
+        newest = None
+        total = None
+        offset = 0
+        pages = 0
+        while True:
+            page = self._api.get_page(offset, sort='updated_at', order='desc')
+            pages += 1
+            rows = page['rows']
+            if total is None:
+                total = page['total']
+                newest = updated_stamp(rows[0]) if rows else self.high_water
+            # Rows as old as the mark are asked for again, as others may
+            # have changed in the same second after the last sync.
+            newer = [r for r in rows if updated_stamp(r) >= self.high_water]
+            for r in newer:
+                changed[r['id']] = r
+            offset += len(rows)
+            if len(newer) < len(rows) or not rows or offset >= total:
+                break
+        get_metrics().pages(self._api.get_endpoint(), pages)
+        changed = [r for r in changed.values() if self._rows.get(r['id']) != r]
+        for r in changed:
+            self._rows[r['id']] = r
+        if total != len(self._rows):
+            logger.info('%s has %s rows in Snipe and %s here.  Downloading them all to find what was removed',
+                        self._api.get_endpoint(), total, len(self._rows))
+            more, removed = self._full(newest)
+            return changed + more, removed
+        if changed:
+            logger.info('%s changed in Snipe since %s: %s rows',
+                        self._api.get_endpoint(), self.high_water, len(changed))
+        self.high_water = max(self.high_water, newest)
+        return changed, []
+
+    def _full(self, newest=None):
+        """Downloads every row.  The high water mark is the newest updated_at
+        from before the download started, so rows changed while it runs are
+        asked for again by the next sync."""
+        if newest is None:
+            page = self._api.get_page(0, sort='updated_at', order='desc')
+            newest = updated_stamp(page['rows'][0]) if page['rows'] else ''
+        rows = {r['id']: r for r in self._api.iter_rows()}
+        changed = [r for r in rows.values() if self._rows.get(r['id']) != r]
+        removed = [i for i in self._rows if i not in rows]
+        self._rows = rows
+        self.high_water = newest
+        self._full_at = time.monotonic()
+        logger.info('Downloaded all %s %s', len(rows), self._api.get_endpoint())
+        return changed, removed
@@ -0,0 +1,228 @@
+"""An asyncio version of the Snipe API interface for headless jobs"""
+import asyncio
+import logging
+import time
+
+import aiohttp
+
+import settings
+from metrics import get_metrics
+from snipeapi import (validate_endpoint, clamp_limit, checkout_payload, dedupe_rows,
+                      log_create_response, log_checkout_response, get_rate_limiter,
+                      retry_delay, rejects_checkout_fields, combined_checkout_enabled,
+                      checked_out_on_create, project_rows)
+
+logger = logging.getLogger(__name__)
+
+# One aiohttp session (and its connection pool) per event loop, shared by
+# every AsyncSnipeGet running on that loop.  A session can only be used and
+# closed on the loop it was created on, so a new loop gets its own rather
+# than replacing (and leaking) the session of a loop that is still running.
+_sessions = {}
+
+
+def get_session():
+    """Returns the shared aiohttp session for the running event loop"""
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        # Forget the sessions of loops that have finished
+        for old in [l for l in _sessions if l.is_closed()]:
+            del _sessions[old]
+        logger.debug('Creating async HTTP session.  Pool size: %s, Keep-alive: %s',
+                     settings.HTTP_POOL_SIZE, settings.HTTP_KEEP_ALIVE)
+        connector = aiohttp.TCPConnector(
+            limit=settings.HTTP_POOL_SIZE,
+            force_close=not settings.HTTP_KEEP_ALIVE,
+        )
+        timeout = aiohttp.ClientTimeout(total=None,
+                                        connect=settings.HTTP_CONNECT_TIMEOUT,
+                                        sock_read=settings.HTTP_TIMEOUT)
+        session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        _sessions[loop] = session
+    return session
+
+
+async def close_session():
+    """Closes the running loop's shared session and its pooled connections"""
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        logger.debug('Closing async HTTP session')
+        await session.close()
+
+
+def run(coro):
+    """Runs coro on a new event loop and closes the shared session afterwards.
+    Convenience for scripts: run(main())"""
+    async def _main():
+        try:
+            return await coro
+        finally:
+            await close_session()
+    return asyncio.run(_main())
+
+
+class AsyncSnipeGet:
+    """Coroutine counterpart of snipeapi.SnipeGet.  Methods return the same
+    values as their SnipeGet equivalents.  Pages are read whole and then
+    cut down to fields, rather than parsed as they download."""
+
+    def __init__(self, snipe_url, api_key, endpoint='hardware', limit=500, workers=None, fields=None):
+        self._api_key = api_key
+        self._snipe_url = snipe_url
+        self._endpoint = validate_endpoint(endpoint)
+        limit = clamp_limit(limit)
+        self._limit = limit
+        if workers is None:
+            workers = settings.PAGE_WORKERS
+        self._workers = max(1, workers)
+        self._fields = tuple(fields) if fields is not None else None
+        self._url = self._snipe_url + self._endpoint + '?limit=' + str(limit)
+        self._headers = {
+            "accept": "application/json",
+            "Authorization": "Bearer " + self._api_key
+        }
+        self._json_headers = dict(self._headers)
+        self._json_headers['content-type'] = 'application/json'
+
+    async def _request(self, method, url, route=None, **kwargs):
+        """Sends a request through the shared session and the rate limiter
+        shared with SnipeGet.  A 429 is retried like SnipeGet does, and the
+        request is recorded in the same metrics.  Returns (status, json)"""
+        route = route or self._endpoint
+        limiter = get_rate_limiter()
+        metrics = get_metrics()
+        for attempt in range(settings.API_RETRIES + 1):
+            delay = limiter.reserve()
+            if delay:
+                await asyncio.sleep(delay)
+            started = time.monotonic()
+            try:
+                async with get_session().request(method, url, **kwargs) as response:
+                    body = await response.read()
+                    metrics.record(route, method, time.monotonic() - started, len(body),
+                                   error=response.status >= 400)
+                    limiter.observe(response.headers)
+                    if response.status != 429:
+                        return response.status, await response.json(content_type=None)
+                    if attempt == settings.API_RETRIES:
+                        response.raise_for_status()
+                    delay = retry_delay(response.headers, attempt)
+            except aiohttp.ClientConnectionError:
+                metrics.record(route, method, time.monotonic() - started, error=True)
+                raise
+            logger.warning('Snipe is throttling requests.  Retrying in %.1f seconds', delay)
+            limiter.pause(delay)
+            metrics.retry(route, method)
+
+    async def _get_page(self, offset):
+        url = self._url
+        if offset:
+            url += '&offset=' + str(offset)
+        _status, data = await self._request('GET', url, headers=self._headers)
+        if isinstance(data, dict) and 'rows' in data:
+            data['rows'] = project_rows(data['rows'], self._fields)
+        return data
+
+    async def get_all(self, workers=None):
+        """Returns every row for the endpoint, fetching up to workers pages
+        at the same time once the total is known."""
+        if workers is None:
+            workers = self._workers
+        logger.debug('Getting all records for endpoint %s with %s workers',
+                     self._endpoint, workers)
+        try:
+            page = await self._get_page(0)
+            total = page['total']
+            ret = list(page['rows'])
+            depth = 1
+            logger.debug('Received %s rows out of %s from endpoint: %s',
+                         len(ret), total, self._endpoint)
+            if total > len(ret) and ret:
+                step = min(len(ret), self._limit)
+                semaphore = asyncio.Semaphore(max(1, workers))
+
+                async def fetch(offset):
+                    async with semaphore:
+                        return await self._get_page(offset)
+
+                # gather() returns pages in offset order
+                pages = await asyncio.gather(*(fetch(o) for o in range(step, total, step)))
+                for page in pages:
+                    ret.extend(page['rows'])
+                depth += len(pages)
+                logger.debug('Received %s rows out of %s from endpoint: %s',
+                             len(ret), total, self._endpoint)
+            get_metrics().pages(self._endpoint, depth)
+            return dedupe_rows(ret)
+        except Exception as e:
+            logger.warning(e)
+            return None
+
+    async def get_by_id(self, snipe_id):
+        try:
+            status, data = await self._request(
+                'GET',
+                self._snipe_url + self._endpoint + '/' + str(snipe_id),
+                route=self._endpoint + '/{id}',
+                headers=self._headers
+            )
+            if status == 200:
+                return data
+            else:
+                return None
+        except Exception as e:
+            logger.warning(e)
+            return None
+
+    async def count(self):
+        try:
+            status, data = await self._request(
+                'GET',
+                self._snipe_url + self._endpoint + '?limit=1',
+                headers=self._headers
+            )
+            if status == 200:
+                return data['total']
+            else:
+                logger.critical('Error connecting to SnipeIT.  Error returned: %s', status)
+                return None
+        except Exception as e:
+            logger.warning(e)
+            return None
+
+    async def create_asset(self, asset):
+        logger.debug('Creating Asset:')
+        logger.debug(asset)
+        status, data = await self._request(
+            'POST', self._snipe_url + self._endpoint, json=asset, headers=self._json_headers)
+        logger.debug(f'Request Response Status Code: {status}')
+        log_create_response(data)
+        return data
+
+    async def create_asset_checked_out(self, asset, checkout_type, assigned_to_id):
+        checkout = checkout_payload(checkout_type, assigned_to_id)
+        if checkout is None or not combined_checkout_enabled(self._snipe_url):
+            return await self.create_asset(asset), False
+        data = await self.create_asset(dict(asset, **checkout))
+        if rejects_checkout_fields(data, checkout):
+            logger.info('Snipe rejected the check out fields (%s).  Creating and checking out separately',
+                        data.get('messages'))
+            return await self.create_asset(asset), False
+        return data, checked_out_on_create(self._snipe_url, data, assigned_to_id)
+
+    async def checkout_asset(self, asset_id, checkout_type, assigned_to_id):
+        payload = checkout_payload(checkout_type, assigned_to_id)
+        if payload is None:
+            return {'status': 'error'}
+        logger.debug('Checking out Asset:')
+        logger.debug(asset_id)
+        checkout_url = self._snipe_url + self._endpoint + '/' + str(asset_id) + '/checkout'
+        status, data = await self._request('POST', checkout_url, route=self._endpoint + '/{id}/checkout',
+                                           json=payload, headers=self._json_headers)
+        logger.debug(f'Request Response Status Code: {status}')
+        log_checkout_response(data)
+        return data
+
+    def get_snipe_url(self):
+        return self._snipe_url
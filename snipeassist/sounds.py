@@ -0,0 +1,206 @@
+"""Plays the scan cues (ding, success, warning) with as little delay as
+possible, because operators pace their scanning by them.
+
+playsound decodes the MP3 and starts a new player for every cue, which on
+a busy station can lag behind the scan it answers.  CuePlayer decodes each
+cue once at startup (QAudioDecoder), keeps it as a WAV file and plays it
+with a QSoundEffect, which holds the sound in memory and starts straight
+away.  Different cues play over each other; the same cue asked for again
+within SOUND_COALESCE_MS is played once.  Until a cue has been decoded, or
+if Qt Multimedia can not be loaded, it is played with playsound.
+
+The time from asking for a cue to it starting is recorded for each cue and
+returned by CuePlayer.stats()."""
+import array
+import logging
+import os
+import shutil
+import tempfile
+import time
+import wave
+from functools import partial
+
+from PySide6 import QtCore
+
+import settings
+from metrics import Histogram, LATENCY_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+def playsound(sound_file, block=False):
+    """ playsound3 takes a while to import, so it is imported the first time
+    a sound is played instead of at startup """
+    from playsound3 import playsound as _playsound
+    return _playsound(sound_file, block=block)
+
+
+def _multimedia():
+    """Returns the QtMultimedia module, or None if it can not be loaded (it
+    needs the system's audio libraries)"""
+    try:
+        from PySide6 import QtMultimedia
+    except ImportError as e:
+        logger.info('Qt Multimedia not available, playing sounds with playsound: %s', e)
+        return None
+    return QtMultimedia
+
+
+def _pcm(buffer, multimedia):
+    """Returns (sample width, data) of a decoded QAudioBuffer as integer
+    PCM, the form the wave module writes"""
+    size = buffer.byteCount()
+    data = buffer.constData()
+    if not isinstance(data, (bytes, bytearray, memoryview)):
+        # A shiboken VoidPtr without a size
+        from shiboken6 import VoidPtr
+        data = VoidPtr(data, size, False).toBytes()
+    data = bytes(data)[:size]
+    audio_format = buffer.format()
+    if audio_format.sampleFormat() == multimedia.QAudioFormat.SampleFormat.Float:
+        samples = array.array('f', data)
+        data = array.array('h', (int(max(-1.0, min(1.0, s)) * 32767) for s in samples)).tobytes()
+        return 2, data
+    return audio_format.bytesPerSample(), data
+
+
+class CuePlayer(QtCore.QObject):
+    """Plays the cues in sounds, a dict of cue name to sound file.  Used
+    from the GUI thread only."""
+
+    def __init__(self, sounds, parent=None):
+        super().__init__(parent)
+        self._files = dict(sounds)
+        self._multimedia = _multimedia() if settings.SOUND_PRELOAD else None
+        self._dir = None
+        self._decoders = {}
+        self._buffers = {}
+        self._effects = {}
+        # cue -> time.monotonic() play was asked for, until it starts
+        self._requested = {}
+        self._last = {}
+        self._failed = set()
+        self._counts = {cue: {'played': 0, 'coalesced': 0} for cue in self._files}
+        self._latency = {cue: Histogram(LATENCY_BUCKETS) for cue in self._files}
+        if self._multimedia is not None:
+            for cue, path in self._files.items():
+                if path.lower().endswith('.wav'):
+                    self._load(cue, path)
+                else:
+                    self._decode(cue, path)
+
+    def _decode(self, cue, path):
+        if self._dir is None:
+            self._dir = tempfile.mkdtemp(prefix='snipeassist_sounds_')
+        decoder = self._multimedia.QAudioDecoder(self)
+        decoder.setSource(QtCore.QUrl.fromLocalFile(path))
+        decoder.bufferReady.connect(partial(self._buffer_ready, cue))
+        decoder.isDecodingChanged.connect(partial(self._decoding_changed, cue))
+        self._decoders[cue] = decoder
+        self._buffers[cue] = []
+        decoder.start()
+
+    def _buffer_ready(self, cue):
+        decoder = self._decoders.get(cue)
+        if decoder is not None:
+            self._buffers[cue].append(decoder.read())
+
+    def _decoding_changed(self, cue, decoding):
+        """Writes the decoded cue to a WAV file once the decoder is done"""
+        if decoding or cue not in self._decoders:
+            return
+        decoder = self._decoders.pop(cue)
+        buffers = self._buffers.pop(cue)
+        if decoder.error() != self._multimedia.QAudioDecoder.Error.NoError or not buffers:
+            logger.warning('Unable to decode %s (%s).  Playing it with playsound',
+                           self._files[cue], decoder.errorString() or 'no audio')
+            decoder.deleteLater()
+            return
+        audio_format = buffers[0].format()
+        path = os.path.join(self._dir, cue + '.wav')
+        try:
+            with wave.open(path, 'wb') as f:
+                width = None
+                for buffer in buffers:
+                    sample_width, data = _pcm(buffer, self._multimedia)
+                    if width is None:
+                        width = sample_width
+                        f.setnchannels(audio_format.channelCount())
+                        f.setsampwidth(width)
+                        f.setframerate(audio_format.sampleRate())
+                    f.writeframes(data)
+        except (OSError, wave.Error) as e:
+            logger.warning('Unable to write decoded %s: %s', self._files[cue], e)
+            return
+        finally:
+            decoder.deleteLater()
+        logger.debug('Decoded %s to %s', self._files[cue], path)
+        self._load(cue, path)
+
+    def _load(self, cue, path):
+        effect = self._multimedia.QSoundEffect(self)
+        effect.setSource(QtCore.QUrl.fromLocalFile(path))
+        effect.playingChanged.connect(partial(self._playing_changed, cue))
+        self._effects[cue] = effect
+
+    def _playing_changed(self, cue):
+        if self._effects[cue].isPlaying() and cue in self._requested:
+            self._latency[cue].observe(time.monotonic() - self._requested.pop(cue))
+
+    def play(self, cue):
+        """Plays cue ('success', 'warning' or 'ding').  Anything else plays
+        the warning."""
+        if cue not in self._files:
+            cue = 'warning'
+        now = time.monotonic()
+        last = self._last.get(cue)
+        if last is not None and now - last < settings.SOUND_COALESCE_MS / 1000:
+            self._counts[cue]['coalesced'] += 1
+            return
+        self._last[cue] = now
+        self._counts[cue]['played'] += 1
+        effect = self._effects.get(cue)
+        if effect is not None and effect.status() == self._multimedia.QSoundEffect.Status.Ready:
+            self._requested[cue] = now
+            if effect.isPlaying():
+                # Start again from the beginning
+                effect.stop()
+            effect.play()
+            return
+        # playsound starts its player in the background, so this is the
+        # time to start it rather than to the sound being heard
+        try:
+            playsound(self._files[cue], block=False)
+        except Exception as e:
+            # Not being able to play a cue must not stop the scan
+            if cue not in self._failed:
+                logger.warning('Unable to play %s: %s', self._files[cue], e)
+                self._failed.add(cue)
+            return
+        self._latency[cue].observe(time.monotonic() - now)
+
+    def stats(self):
+        """Returns, for each cue, how it is played ('preloaded' or
+        'playsound'), the times it was played and coalesced, and the p50/p95
+        seconds from asking for it to it starting"""
+        stats = {}
+        for cue in self._files:
+            effect = self._effects.get(cue)
+            preloaded = effect is not None and effect.status() == self._multimedia.QSoundEffect.Status.Ready
+            stats[cue] = dict(self._counts[cue],
+                              player='preloaded' if preloaded else 'playsound',
+                              p50=self._latency[cue].quantile(0.5),
+                              p95=self._latency[cue].quantile(0.95))
+        return stats
+
+    def close(self):
+        """Logs the cue latencies and removes the decoded files"""
+        for cue, s in self.stats().items():
+            if s['played']:
+                logger.info('Sound %s (%s): played %s, coalesced %s, latency p50 %.3fs p95 %.3fs',
+                            cue, s['player'], s['played'], s['coalesced'], s['p50'] or 0.0, s['p95'] or 0.0)
+        for effect in self._effects.values():
+            effect.stop()
+        self._effects = {}
+        if self._dir is not None:
+            shutil.rmtree(self._dir, ignore_errors=True)
+            self._dir = None
@@ -1,44 +1,73 @@
-import sys
 import logging
-import logging.config
 import copy
+from functools import partial
 
 
-from PySide6.QtWidgets import QMainWindow, QApplication, QDialog, QVBoxLayout, QPushButton
+from PySide6.QtWidgets import QMainWindow, QApplication
 from PySide6 import QtGui, QtCore, QtWidgets
 
 from pyqtconfig import ConfigManager
 
-from playsound3 import playsound
-
 from ui_snipeassist import Ui_MainWindow
 from ui_loading import Ui_Dialog
-from snipeapi import SnipeGet
+from snipeapi import DeltaSync, SnipeGet, close_session, dedupe_rows, throttle_stats
+from refcache import RefCache
+from workers import run_task, TaskSignals
+from pipeline import SubmissionPipeline
+from lazymodel import IdListModel, LazyListModel, PageCache
+from fieldsetindex import FieldsetIndex
+from dupindex import DuplicateIndex
+from logsetup import log_rows
+from metrics import get_metrics
+from scantiming import ScanTimer
+from sounds import CuePlayer
+from settingsfile import SettingsWriter
 import settings
 # from pprint import pprint
 
 
-logging.config.dictConfig(settings.LOGGING_CONFIG)
 logger = logging.getLogger(__name__)
 
+
 class LoadingWindow(QMainWindow, Ui_Dialog):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setupUi(self)
+        # Make room under the Loading.... label for a line per endpoint
+        self.label.setGeometry(QtCore.QRect(8, 10, 381, 100))
+        self.labelProgress = QtWidgets.QLabel(self)
+        self.labelProgress.setObjectName('labelProgress')
+        self.labelProgress.setGeometry(QtCore.QRect(40, 110, 341, 181))
+        self.labelProgress.setAlignment(QtCore.Qt.AlignLeft | QtCore.Qt.AlignTop)
+        self._progress = {}
+
+    def set_progress(self, endpoint, text):
+        """ Shows text on the progress line for endpoint """
+        self._progress[endpoint] = text
+        self.labelProgress.setText('\n'.join(f'{e}: {t}' for e, t in self._progress.items()))
 
 
 class Window(QMainWindow, Ui_MainWindow):
+    # endpoint, model attribute prefix, combobox for each required item
+    REQUIRED_ITEMS = (
+        ('companies', 'company', 'comboBoxCompany'),
+        ('models', 'model', 'comboBoxModel'),
+        ('locations', 'location', 'comboBoxLocation'),
+        ('statuslabels', 'status', 'comboBoxStatus'),
+        ('suppliers', 'supplier', 'comboBoxSupplier'),
+    )
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setupUi(self)
+        self.action_CacheStats = QtGui.QAction('Cache S&tatistics', self)
+        self.menu_File.insertAction(self.action_Exit, self.action_CacheStats)
+        self._setup_checkout_to()
         self.connect_signals_slots()
-        loading = LoadingWindow()
-        loading.show()
+        self.loading = LoadingWindow()
+        self.loading.show()
         QApplication.processEvents()
 
-        # logging.config.dictConfig(settings.LOGGING_CONFIG)
-        # self.logger = logging.getLogger(__name__)
-
         # Set up a hack text box so I can save the Purchase Date
         self.lineEditPurchaseDate = QtWidgets.QLineEdit()
         self.lineEditPurchaseDate.setText(QtCore.QDate(self.dateEditPurchaseDate.date()).toString('yyyyMd'))
@@ -49,6 +78,68 @@ class Window(QMainWindow, Ui_MainWindow):
         # create a dictionary to hold custom widgets
         self.custom_fields = {}
 
+        # Local cache of the required item lists so startup does not wait
+        # on the Snipe server.  self._ref_keys holds the (id, name) pairs
+        # shown in each combobox to tell if a background refresh changed them.
+        self.cache = RefCache()
+        self._ref_keys = {}
+
+        # Custom fields of every model, loaded in bulk with the model list
+        # so changing the model does not wait on the Snipe server.
+        # self._custom_fields_model is the model id the tabs were built for.
+        self.fieldset_index = FieldsetIndex()
+        self._custom_fields_model = None
+        self._custom_fields_fieldset = None
+
+        # The required item lists download on their own pool so every
+        # endpoint gets a thread and a slow one does not hold up the rest.
+        self.refresh_pool = QtCore.QThreadPool(self)
+        self.refresh_pool.setMaxThreadCount(len(self.REQUIRED_ITEMS) + 1)
+        self._pending_refresh = set()
+        # Lists a refresh could not download and kept as they were
+        self._refresh_failures = []
+
+        # Completed scans are created on background threads.  Results come
+        # back to the GUI thread through submission_signals.finished.
+        self.submission_signals = TaskSignals()
+        self.submission_signals.finished.connect(self._submission_finished)
+        self.pipeline = SubmissionPipeline(settings.SNIPE_URL, settings.API_KEY,
+                                           self.submission_signals.finished.emit)
+
+        # Asset tags and serials already in Snipe or scanned this session,
+        # so a duplicate is turned away as soon as it is scanned.
+        self.duplicates = DuplicateIndex()
+
+        # Local copies of hardware and users, kept in the cache between runs
+        # and brought up to date every SYNC_INTERVAL seconds with only the
+        # rows changed in Snipe.  Hardware feeds the duplicate index, and
+        # both fill the Check Out To list once they are loaded.
+        self.syncs = {
+            'hardware': DeltaSync(SnipeGet(settings.SNIPE_URL, settings.API_KEY, 'hardware',
+                                           fields=('id', 'name', 'updated_at') + self.duplicates.fields)),
+            'users': DeltaSync(SnipeGet(settings.SNIPE_URL, settings.API_KEY, 'users',
+                                        fields=('id', 'username', 'updated_at'))),
+        }
+        self._syncing = set()
+        self._checkout_type = None
+        self.sync_timer = QtCore.QTimer(self)
+        self.sync_timer.setInterval(int(settings.SYNC_INTERVAL * 1000))
+        self.sync_timer.timeout.connect(self._sync_lists)
+
+        # Stage times of each scanned asset, written next to the log
+        self.scan_timer = ScanTimer()
+
+        # The scan cues, decoded once so they play as soon as they are asked for
+        self.sounds = CuePlayer({'success': settings.SOUND_SUCCESS,
+                                 'warning': settings.SOUND_WARNING,
+                                 'ding': settings.SOUND_DING}, self)
+
+        # Live summary of the requests to Snipe in the status bar
+        self.metrics_timer = QtCore.QTimer(self)
+        self.metrics_timer.setInterval(1000)
+        self.metrics_timer.timeout.connect(self._show_metrics)
+        self.metrics_timer.start()
+
         # Setup object to load and save form settings
         logger.debug('Set up mappings for savings settings.  Settings will be saved to snipeassist.json')
         self.config = ConfigManager(filename="snipeassist.json")
@@ -76,7 +167,14 @@ class Window(QMainWindow, Ui_MainWindow):
         self.config.add_handler('checkBoxScanSerial', self.checkBoxScanSerial)
         self.config.add_handler('checkBoxCheckOutEnabled', self.checkBoxCheckOutEnabled)
         self.config.add_handler('comboBoxEditCheckOutType', self.comboBoxCheckOutType)
-        self.config.add_handler('comboBoxCheckoutTo', self.comboBoxCheckoutTo)
+        # Check Out To only loads the rows it needs, so the chosen name and
+        # id are saved in hack text boxes like the Purchase Date
+        self.lineEditCheckoutTo = QtWidgets.QLineEdit()
+        self.lineEditCheckoutToId = QtWidgets.QLineEdit()
+        self.config.add_handler('comboBoxCheckoutTo', self.lineEditCheckoutTo)
+        self.config.add_handler('checkoutToId', self.lineEditCheckoutToId)
+        # Saves the settings file on a background thread
+        self.settings_writer = SettingsWriter(self.config, parent=self)
 
         # set up form defaults
         logger.debug('Set up defaults if settings do not exist.')
@@ -100,11 +198,32 @@ class Window(QMainWindow, Ui_MainWindow):
 
 
         self._verify_static_items()
-        loading.close()
     
+    def _setup_checkout_to(self):
+        """ Check Out To loads pages as the list scrolls.  Typing in it runs
+        a search on the Snipe server once typing pauses, and the matches are
+        offered in a completer popup. """
+        self.checkout_model = None
+        self.checkout_search_model = None
+        self.checkout_pages = PageCache()
+        self.comboBoxCheckoutTo.setEditable(True)
+        self.comboBoxCheckoutTo.setInsertPolicy(QtWidgets.QComboBox.NoInsert)
+        # With placeholder text the combobox does not select the first row
+        # when a page arrives, so it can not overwrite the saved choice.
+        self.comboBoxCheckoutTo.setPlaceholderText('Type to search')
+        self.comboBoxCheckoutTo.lineEdit().setPlaceholderText('Type to search')
+        self.checkout_completer = QtWidgets.QCompleter(self)
+        self.checkout_completer.setCompletionMode(QtWidgets.QCompleter.UnfilteredPopupCompletion)
+        self.checkout_completer.setCaseSensitivity(QtCore.Qt.CaseInsensitive)
+        self.comboBoxCheckoutTo.lineEdit().setCompleter(self.checkout_completer)
+        self.checkout_search_timer = QtCore.QTimer(self)
+        self.checkout_search_timer.setSingleShot(True)
+        self.checkout_search_timer.setInterval(settings.CHECKOUT_SEARCH_DELAY)
+
     def connect_signals_slots(self):
         self.action_Exit.triggered.connect(self.close)
         self.action_Save.triggered.connect(self.save_settings)
+        self.action_CacheStats.triggered.connect(self.show_cache_stats)
         self.dateEditPurchaseDate.dateChanged.connect(self._save_purchase_date)
         self.comboBoxCompany.currentIndexChanged[int].connect(self.company_index_changed)
         self.comboBoxModel.currentIndexChanged[int].connect(self.model_index_changed)
@@ -120,7 +239,12 @@ class Window(QMainWindow, Ui_MainWindow):
         self.checkBoxNotes.stateChanged.connect(self._verify_notes)
         self.checkBoxCheckOutEnabled.stateChanged.connect(self._verify_check_out)
         self.comboBoxCheckOutType.currentIndexChanged[int].connect(self._verify_check_out)
-        self.pushButtonRefresh.pressed.connect(self.refresh_comboboxes)
+        self.comboBoxCheckOutType.activated[int].connect(self._clear_checkout_to)
+        self.comboBoxCheckoutTo.activated[int].connect(self._checkout_to_activated)
+        self.comboBoxCheckoutTo.lineEdit().textEdited.connect(lambda _text: self.checkout_search_timer.start())
+        self.checkout_search_timer.timeout.connect(self._search_checkout_to)
+        self.checkout_completer.activated[QtCore.QModelIndex].connect(self._checkout_to_completed)
+        self.pushButtonRefresh.pressed.connect(partial(self.refresh_comboboxes, force=True))
         self.pushButtonScan.pressed.connect(self.start_scanning)
         self.pushButtonNext.pressed.connect(self._scan_next_button)
         self.lineEditScanning.returnPressed.connect(self._scan_next_button)
@@ -128,100 +252,318 @@ class Window(QMainWindow, Ui_MainWindow):
         
 
     
-    def refresh_comboboxes(self):
-        """ Downloads information from SnipeIT API to populate the combo boxes """
+    def refresh_comboboxes(self, force=False):
+        """ Populates the required item combo boxes.  Cached lists are shown
+        straight away and downloaded again in the background once they are
+        older than their TTL.  Lists that are not cached (or all of them when
+        force=True) download at the same time on background threads and each
+        combobox is filled as its list arrives. """
 
         logger.info('Starting Combobox Refresh')
-        companies = SnipeGet(settings.SNIPE_URL, settings.API_KEY, 'companies').get_all()
-        if not companies:
-            logger.critical('API Error, unable to get companies')
-            sys.exit()
-        logger.debug('received %s companies.  Creating company combobox model', len(companies))
-        self.company_model = QtGui.QStandardItemModel()
-        for company in companies:
-            logger.debug('Adding id: %s for company: %s', company['id'], company['name'])
-            c = QtGui.QStandardItem(company['name'])
-            c.setData(company['id'])
-            self.company_model.appendRow(c)
-        self.company_model.sort(0, QtCore.Qt.AscendingOrder)
-        logger.debug('Setting company combobox model')
-        self.comboBoxCompany.setModel(self.company_model)
-        logger.info('Finished refreshing the company combobox model')
-        
-        models = SnipeGet(settings.SNIPE_URL, settings.API_KEY, 'models').get_all()
-        if not models:
-            logger.critical('API Error, unable to get models')
-            sys.exit()
-        logger.debug('received %s models.  Creating model combobox model', len(models))
-        self.model_model = QtGui.QStandardItemModel()
-        for model in models:
-            logger.debug('Adding id: %s for model: %s', model['id'], model['name'])
-            m = QtGui.QStandardItem(model['name'])
-            m.setData(model['id'])
-            self.model_model.appendRow(m)
-        self.model_model.sort(0, QtCore.Qt.AscendingOrder)
-        logger.debug('Setting model combobox model')
-        self.comboBoxModel.setModel(self.model_model)
-        logger.info('Finished refreshing the model combobox model')
-        
-        locations = SnipeGet(settings.SNIPE_URL, settings.API_KEY, 'locations').get_all()
-        if not locations:
-            logger.critical('API Error, unable to get locations')
-            sys.exit()
-        logger.debug('received %s locations.  Creating location combobox model', len(locations))
-        self.location_model = QtGui.QStandardItemModel()
-        for location in locations:
-            l = QtGui.QStandardItem(location['name'])
-            l.setData(location['id'])
-            self.location_model.appendRow(l)
-        self.location_model.sort(0, QtCore.Qt.AscendingOrder)
-        self.comboBoxLocation.setModel(self.location_model)
-        logger.info('Finished refreshing the location combobox model')
-        
-        statuses = SnipeGet(settings.SNIPE_URL, settings.API_KEY, 'statuslabels').get_all()
-        if not statuses:
-            logger.critical('API Error, unable to get status labels')
-            sys.exit()
-        logger.debug('received %s status labels.  Creating status combobox model', len(statuses))
-        self.status_model = QtGui.QStandardItemModel()
-        for status in statuses:
-            s = QtGui.QStandardItem(status['name'])
-            s.setData(status['id'])
-            self.status_model.appendRow(s)
-        self.status_model.sort(0, QtCore.Qt.AscendingOrder)
-        self.comboBoxStatus.setModel(self.status_model)
-        logger.info('Finished refreshing the status combobox model')
-        
-        suppliers = SnipeGet(settings.SNIPE_URL, settings.API_KEY, 'suppliers').get_all()
-        if not suppliers:
-            logger.critical('API Error, unable to get suppliers')
-            sys.exit()
-        logger.debug('received %s suppliers.  Creating supplier combobox model', len(suppliers))
-        self.supplier_model = QtGui.QStandardItemModel()
-        for supplier in suppliers:
-            s = QtGui.QStandardItem(supplier['name'])
-            s.setData(supplier['id'])
-            self.supplier_model.appendRow(s)
-        self.supplier_model.sort(0, QtCore.Qt.AscendingOrder)
-        self.comboBoxSupplier.setModel(self.supplier_model)
-        logger.info('Finished refreshing the supplier combobox model')
+        self.pushButtonRefresh.setEnabled(False)
+        self.pushButtonScan.setEnabled(False)
+        self._pending_refresh = set()
+        self._refresh_failures = []
+        for endpoint, label, combobox in self.REQUIRED_ITEMS:
+            rows, age = (None, None) if force else self.cache.get(settings.SNIPE_URL, endpoint)
+            if rows is None:
+                self._pending_refresh.add(endpoint)
+                self.loading.set_progress(endpoint, 'waiting')
+                run_task(self._download_rows, endpoint, pool=self.refresh_pool,
+                         on_progress=partial(self._download_progress, endpoint),
+                         on_finished=partial(self._downloaded, endpoint, label, combobox))
+                continue
+            if not self.cache.is_fresh(endpoint, age):
+                logger.info('Cached %s are %.0f seconds old.  Refreshing in the background', endpoint, age)
+                run_task(self._download_rows, endpoint, pool=self.refresh_pool,
+                         on_finished=partial(self._revalidated, endpoint, label, combobox))
+            self._load_combobox(endpoint, label, combobox, rows)
+            self.loading.set_progress(endpoint, f'{len(rows)} cached')
+        self._refresh_fieldsets(force)
+        if self._pending_refresh:
+            self.loading.show()
+        else:
+            self._refresh_finished()
+
+    def _download_rows(self, endpoint, progress=None):
+        """ Downloads every row of an endpoint and stores it in the cache.
+        Calls progress((received, total)) after each page.  Returns None on
+        error.  Safe to call from a background thread. """
+        rows = []
+        try:
+            for page in SnipeGet(settings.SNIPE_URL, settings.API_KEY, endpoint).iter_pages():
+                rows.extend(page['rows'])
+                if progress:
+                    progress((len(rows), page['total']))
+        except Exception as e:
+            logger.warning('Unable to download %s: %s', endpoint, e)
+            return None
+        rows = dedupe_rows(rows)
+        if rows:
+            self.cache.put(settings.SNIPE_URL, endpoint, rows)
+        return rows
+
+    def _download_progress(self, endpoint, progress):
+        received, total = progress
+        self.loading.set_progress(endpoint, f'{received} of {total}')
+
+    def _downloaded(self, endpoint, label, combobox, rows):
+        """ Called on the GUI thread when a required item list has downloaded.
+        A failed download only stops the program when there is no list to
+        fall back on (the first start, with nothing cached). """
+        if not rows:
+            model = getattr(self, label + '_model', None)
+            if model is None or not model.rowCount():
+                logger.critical('API Error, unable to get %s', endpoint)
+                self.loading.close()
+                QtWidgets.QMessageBox.critical(self, 'Snipe Assist',
+                                               f'Unable to download {endpoint} from SnipeIT.')
+                QApplication.exit(1)
+                return
+            logger.warning('Unable to download %s.  Keeping the list already loaded', endpoint)
+            self._refresh_failures.append(endpoint)
+            self.loading.set_progress(endpoint, 'failed')
+        else:
+            self._load_combobox(endpoint, label, combobox, rows)
+            self.loading.set_progress(endpoint, f'{len(rows)} done')
+        self._pending_refresh.discard(endpoint)
+        if not self._pending_refresh:
+            self._refresh_finished()
+
+    def _refresh_fieldsets(self, force=False):
+        """ Loads every custom fieldset into self.fieldset_index, from the
+        cache when possible, the same way as the required item lists. """
+        rows, age = (None, None) if force else self.cache.get(settings.SNIPE_URL, 'fieldsets')
+        if rows is None:
+            self._pending_refresh.add('fieldsets')
+            self.loading.set_progress('fieldsets', 'waiting')
+            run_task(self._download_rows, 'fieldsets', pool=self.refresh_pool,
+                     on_progress=partial(self._download_progress, 'fieldsets'),
+                     on_finished=self._fieldsets_downloaded)
+            return
+        if not self.cache.is_fresh('fieldsets', age):
+            logger.info('Cached fieldsets are %.0f seconds old.  Refreshing in the background', age)
+            run_task(self._download_rows, 'fieldsets', pool=self.refresh_pool,
+                     on_finished=self._fieldsets_revalidated)
+        self.fieldset_index.set_fieldsets(rows)
+        self.loading.set_progress('fieldsets', f'{len(rows)} cached')
+
+    def _fieldsets_downloaded(self, rows):
+        """ Called on the GUI thread when the fieldsets have downloaded.
+        Custom fields are not required, so a failed download only means each
+        model's fieldset is looked up when it is chosen. """
+        if rows is None:
+            logger.warning('Unable to download fieldsets.  Custom fields will be looked up per model')
+            self.loading.set_progress('fieldsets', 'failed')
+        else:
+            self.fieldset_index.set_fieldsets(rows)
+            self.loading.set_progress('fieldsets', f'{len(rows)} done')
+        self._pending_refresh.discard('fieldsets')
+        if not self._pending_refresh:
+            self._refresh_finished()
+
+    def _fieldsets_revalidated(self, rows):
+        """ Called when a background download of the fieldsets completes.
+        Rebuilds the custom field tabs if the current model's fields changed. """
+        if rows is None:
+            logger.warning('Unable to refresh fieldsets.  Keeping cached fieldsets')
+            return
+        self.fieldset_index.set_fieldsets(rows)
+        if self._custom_fields_model is None:
+            return
+        try:
+            fieldset = self._model_fieldset(self._custom_fields_model)
+        except LookupError as e:
+            logger.warning('%s.  Keeping the custom field tabs', e)
+            return
+        if fieldset != self._custom_fields_fieldset:
+            logger.info('Custom fields of the current model changed.  Rebuilding tabs')
+            self.model_index_changed(self.comboBoxModel.currentIndex())
+
+    def _refresh_finished(self):
+        """ Called once every required item combobox has been filled """
         self.set_defaults()
+        # Tabs are not built while the fieldsets are downloading, and
+        # loading the settings only rebuilds them if the model changed.
+        if self.comboBoxModel.currentIndex() >= 0:
+            if self.model_model.id_at(self.comboBoxModel.currentIndex()) != self._custom_fields_model:
+                self.model_index_changed(self.comboBoxModel.currentIndex())
+        self._verify_static_items()
+        self._log_cache_stats()
+        self.loading.close()
+        self.pushButtonRefresh.setEnabled(True)
+        self.pushButtonScan.setEnabled(True)
+        # Hardware and users are first synced only now, so at startup they
+        # do not compete with the required lists for the rate limit
+        if not self.sync_timer.isActive():
+            self._sync_lists()
+            self.sync_timer.start()
+        if self._refresh_failures:
+            QtWidgets.QMessageBox.warning(self, 'Snipe Assist',
+                                          f'Unable to download {", ".join(self._refresh_failures)} from SnipeIT.  '
+                                          'The lists already loaded are kept.')
+
+    def _load_combobox(self, endpoint, label, combobox, rows):
+        """ Builds a model from rows and sets it on the combobox """
+        log_rows(logger, endpoint, rows)
+        model = self._build_model(rows)
+        self._ref_keys[endpoint] = [(r['id'], r['name']) for r in rows]
+        if endpoint == 'models':
+            self.fieldset_index.set_models(rows)
+        setattr(self, label + '_model', model)
+        logger.debug('Setting %s combobox model', label)
+        getattr(self, combobox).setModel(model)
+        logger.info('Finished refreshing the %s combobox model', label)
+        return model
+
+    def _revalidated(self, endpoint, label, combobox, rows):
+        """ Called when a background download of a cached list completes """
+        if not rows:
+            logger.warning('Unable to refresh %s.  Keeping cached list', endpoint)
+            return
+        if [(r['id'], r['name']) for r in rows] == self._ref_keys.get(endpoint):
+            logger.debug('%s unchanged since cached', endpoint)
+            return
+        logger.info('%s changed since cached.  Updating combobox', endpoint)
+        if endpoint == 'models':
+            # New or edited models may use fieldsets that are not indexed yet
+            run_task(self._download_rows, 'fieldsets', pool=self.refresh_pool,
+                     on_finished=self._fieldsets_revalidated)
+        combobox = getattr(self, combobox)
+        old_model = getattr(self, label + '_model')
+        old_text = combobox.currentText()
+        old_id = old_model.id_at(combobox.currentIndex())
+        # Keep the current selection without firing the index changed
+        # slot unless the selected item is actually different.
+        combobox.blockSignals(True)
+        model = self._load_combobox(endpoint, label, combobox, rows)
+        combobox.setCurrentIndex(max(combobox.findText(old_text), 0))
+        combobox.blockSignals(False)
+        if model.id_at(combobox.currentIndex()) != old_id:
+            combobox.currentIndexChanged.emit(combobox.currentIndex())
+
+    def _build_model(self, rows, name_key='name'):
+        """ Builds a model of rows sorted by name """
+        return IdListModel.from_rows(rows, name_key)
+
+    def _log_cache_stats(self):
+        stats = self.cache.stats(settings.SNIPE_URL)
+        logger.info('Cache hit rate: %.0f%% (%s fresh, %s stale, %s missed)',
+                    stats['hit_rate'] * 100, stats['hits'], stats['stale'], stats['misses'])
+        for entry in stats['entries']:
+            logger.debug('Cache %s: %s rows, %.0f seconds old', entry['endpoint'], entry['rows'], entry['age'])
+
+    def show_cache_stats(self):
+        stats = self.cache.stats(settings.SNIPE_URL)
+        lines = [
+            f'Hit rate: {stats["hit_rate"]:.0%}',
+            f'Fresh hits: {stats["hits"]}   Stale hits: {stats["stale"]}   Misses: {stats["misses"]}',
+            '',
+        ]
+        for entry in stats['entries']:
+            lines.append(f'{entry["endpoint"]}: {entry["rows"]} rows, '
+                         f'{entry["age"] / 60:.0f} minutes old'
+                         f'{"" if entry["fresh"] else " (stale)"}')
+        for endpoint, sync in self.syncs.items():
+            if sync.loaded:
+                lines.append(f'{endpoint} synced: {len(sync)} rows, changes up to {sync.high_water or "unknown"}')
+        throttle = throttle_stats()
+        lines += [
+            '',
+            f'Requests: {throttle["requests"]}   Delayed by the rate limit: {throttle["delayed"]} '
+            f'({throttle["wait_seconds"]:.1f} seconds)',
+            f'Throttled by Snipe: {throttle["throttled"]} ({throttle["retry_wait_seconds"]:.1f} seconds)',
+            '',
+        ]
+        for series in get_metrics().snapshot()['requests']:
+            latency = series['latency']
+            lines.append(f'{series["method"]} {series["endpoint"]}: {series["requests"]} requests, '
+                         f'{series["errors"]} errors, p50 {latency["p50"]:.2f}s, p95 {latency["p95"]:.2f}s')
+        lines.append('')
+        for cue, sound in self.sounds.stats().items():
+            if sound['played']:
+                lines.append(f'Sound {cue} ({sound["player"]}): {sound["played"]} played, '
+                             f'{sound["coalesced"]} coalesced, p50 {(sound["p50"] or 0.0) * 1000:.0f}ms, '
+                             f'p95 {(sound["p95"] or 0.0) * 1000:.0f}ms')
+        QtWidgets.QMessageBox.information(self, 'Cache Statistics', '\n'.join(lines))
+
+    def _show_metrics(self):
+        self.statusbar.showMessage(get_metrics().summary())
     
+    def _sync_lists(self):
+        """ Syncs hardware when the duplicate check or Check Out To uses it,
+        and users when Check Out To does """
+        endpoints = set()
+        if self.duplicates.fields:
+            endpoints.add('hardware')
+        if self._checkout_type in self.syncs:
+            endpoints.add(self._checkout_type)
+        for endpoint in sorted(endpoints):
+            self._sync(endpoint)
+
+    def _sync(self, endpoint):
+        """ Brings the local copy of endpoint up to date on a background thread """
+        if endpoint in self._syncing:
+            return
+        self._syncing.add(endpoint)
+        run_task(self._sync_rows, endpoint,
+                 on_finished=partial(self._synced, endpoint),
+                 on_failed=partial(self._sync_failed, endpoint))
+
+    def _sync_rows(self, endpoint):
+        """ Runs on a worker thread.  Starts from the rows saved in the cache
+        by the last run, then syncs them with Snipe and saves only the rows
+        that changed.  Returns (changed rows, removed ids). """
+        sync = self.syncs[endpoint]
+        if not sync.loaded:
+            rows = self.cache.load_synced(settings.SNIPE_URL, sync.key)
+            if rows:
+                logger.info('Loaded %s %s from the cache', len(rows), endpoint)
+                sync.seed(rows)
+                if endpoint == 'hardware' and self.duplicates.fields:
+                    self.duplicates.update(rows, [])
+        changed, removed = sync.sync()
+        if endpoint == 'hardware' and self.duplicates.fields:
+            self.duplicates.update(changed, removed)
+        if changed or removed:
+            self.cache.save_synced(settings.SNIPE_URL, sync.key, changed, removed)
+        return changed, removed
+
+    def _synced(self, endpoint, result):
+        """ Called on the GUI thread when a sync has finished """
+        self._syncing.discard(endpoint)
+        changed, removed = result
+        if changed or removed:
+            # Searches may have cached pages without the changes
+            self.checkout_pages.clear()
+        if endpoint == self._checkout_type and (
+            changed or removed or isinstance(self.checkout_model, LazyListModel)
+        ):
+            self._set_checkout_model(endpoint)
+
+    def _sync_failed(self, endpoint, message):
+        logger.warning('Unable to sync %s: %s', endpoint, message)
+        self._syncing.discard(endpoint)
+
+    def _duplicate_message(self, field, value, owner):
+        if isinstance(owner, int):
+            return f'Duplicate {field}: {value} is already Snipe ID {owner}'
+        return f'Duplicate {field}: {value} was already scanned'
+
     def set_defaults(self):
         logger.info('Load settings from config file')
         self.config.load()
+        self._load_checkout_to()
         logger.info('Loading settings completed')
     
     def save_settings(self):
         logger.info('Save settings to config file')
-        self.config.save()
-        logger.info('Save settings completed')
+        self.settings_writer.flush()
     
     @QtCore.Slot(int)
     def company_index_changed(self, row):
-        indx = self.company_model.item(row)
-        _id = indx.data()
-        name = indx.text()
+        _id = self.company_model.id_at(row)
+        name = self.company_model.name_at(row)
         logger.debug('ComboboxCompany Updated: ID: %s, Name: %s', _id, name)
     
     @QtCore.Slot(int)
@@ -233,17 +575,26 @@ class Window(QMainWindow, Ui_MainWindow):
         self.custom_fields.clear()
         self.tabWidgetCustomFields.clear()
         logger.debug(self.tabWidgetCustomFields.count())
-        indx = self.model_model.item(row)
-        _id = indx.data()
-        name = indx.text()
+        _id = self.model_model.id_at(row)
+        name = self.model_model.name_at(row)
         logger.debug('ComboboxModel Updated: ID: %s, Name: %s', _id, name)
-        model = SnipeGet(settings.SNIPE_URL, settings.API_KEY, 'models').get_by_id(_id)
-        if model['fieldset']:
+        self._custom_fields_model = None
+        self._custom_fields_fieldset = None
+        if 'fieldsets' in self._pending_refresh:
+            logger.debug('Fieldsets still downloading.  Custom field tabs will be set up once they arrive')
+            return
+        try:
+            fieldset = self._model_fieldset(_id)
+        except LookupError as e:
+            # Left unset, so the tabs are built when the lists are refreshed
+            logger.warning('%s.  No custom field tabs for model %s', e, name)
+            return
+        self._custom_fields_model = _id
+        self._custom_fields_fieldset = fieldset
+        if fieldset:
             logger.debug('Custom fields found for model (%s) %s.  Setting up custom field tabs', _id, name)
-            logger.debug('Fieldset id: %s', model['fieldset']['id'])
-            fieldset = SnipeGet(settings.SNIPE_URL, settings.API_KEY, 'fieldsets').get_by_id(model['fieldset']['id'])
             logger.debug('Fieldset ID: %s - %s', fieldset['id'], fieldset['name'])
-            for f in fieldset['fields']['rows']:
+            for f in fieldset['fields']:
                 logger.debug('Setting up Custom field %s', f['db_column_name'])
                 tab = QtWidgets.QWidget()
                 fieldset_tab_id = self.tabWidgetCustomFields.addTab(tab, f['name'])
@@ -273,25 +624,47 @@ class Window(QMainWindow, Ui_MainWindow):
                 logger.debug('id: %s - name: %s - db_column: %s', f['id'], f['name'], f['db_column_name'])
                 logger.debug('Choices: %s', f['field_values_array'])
 
+    def _model_fieldset(self, model_id):
+        """ Returns the fieldset of a model from self.fieldset_index, or None
+        if the model has no custom fields.  A model or fieldset missing from
+        the index (added since the lists were downloaded) is looked up on the
+        Snipe server.  Raises LookupError if that lookup fails. """
+        try:
+            fieldset_id = self.fieldset_index.fieldset_id(model_id)
+        except KeyError:
+            logger.debug('Model %s not in the fieldset index.  Looking it up', model_id)
+            model = SnipeGet(settings.SNIPE_URL, settings.API_KEY, 'models').get_by_id(model_id)
+            if model is None:
+                raise LookupError(f'Unable to look up model {model_id} in Snipe')
+            fieldset_id = model['fieldset']['id'] if model.get('fieldset') else None
+        if fieldset_id is None:
+            return None
+        fieldset = self.fieldset_index.fieldset(fieldset_id)
+        if fieldset is None:
+            logger.debug('Fieldset %s not in the fieldset index.  Looking it up', fieldset_id)
+            fieldset = SnipeGet(settings.SNIPE_URL, settings.API_KEY, 'fieldsets').get_by_id(fieldset_id)
+            if fieldset is None:
+                raise LookupError(f'Unable to look up fieldset {fieldset_id} in Snipe')
+            self.fieldset_index.add_fieldset(fieldset)
+            fieldset = self.fieldset_index.fieldset(fieldset_id)
+        return fieldset
+
     @QtCore.Slot(int)
     def location_index_changed(self, row):
-        indx = self.location_model.item(row)
-        _id = indx.data()
-        name = indx.text()
+        _id = self.location_model.id_at(row)
+        name = self.location_model.name_at(row)
         logger.debug('ComboboxLocation Updated: ID: %s, Name: %s', _id, name)
     
     @QtCore.Slot(int)
     def status_index_changed(self, row):
-        indx = self.status_model.item(row)
-        _id = indx.data()
-        name = indx.text()
+        _id = self.status_model.id_at(row)
+        name = self.status_model.name_at(row)
         logger.debug('ComboboxStatus Updated: ID: %s, Name: %s', _id, name)
     
     @QtCore.Slot(int)
     def supplier_index_changed(self, row):
-        indx = self.supplier_model.item(row)
-        _id = indx.data()
-        name = indx.text()
+        _id = self.supplier_model.id_at(row)
+        name = self.supplier_model.name_at(row)
         logger.debug('ComboboxSupplier Updated: ID: %s, Name: %s', _id, name)
     
     def closeEvent(self,event):
@@ -321,6 +694,12 @@ class Window(QMainWindow, Ui_MainWindow):
             if hasattr(settings, 'SAVE_ON_EXIT'):
                 if settings.SAVE_ON_EXIT:
                     self.save_settings()
+        if event.isAccepted():
+            self.pipeline.close()
+            self.sounds.close()
+            self.settings_writer.close()
+            self.scan_timer.close()
+            close_session()
     
     def _save_purchase_date(self):
         logger.debug('Updating Config.PurchaseDate from Form.PurchaseDate')
@@ -349,6 +728,7 @@ class Window(QMainWindow, Ui_MainWindow):
         if not self.checkBoxCheckOutEnabled.isChecked():
             # Check out is not enabled
             logger.debug('Enable Check Out not checked.  Disabled entries')
+            self._checkout_type = None
             self.comboBoxCheckOutType.setEnabled(False)
             self.comboBoxCheckoutTo.setEnabled(False)
         elif self.checkBoxCheckOutEnabled.isChecked():
@@ -363,7 +743,10 @@ class Window(QMainWindow, Ui_MainWindow):
             elif self.comboBoxCheckOutType.currentText() == 'Location':
                 self.checkout_to_refresh('locations')
             else:
-                self.comboBoxCheckoutTo.clear()
+                self._checkout_type = None
+                self.checkout_model = None
+                self.checkout_search_model = None
+                self.comboBoxCheckoutTo.setModel(IdListModel(self.comboBoxCheckoutTo))
 
     def _verify_order_number(self):
         logger.debug('Verifying order_number')
@@ -450,25 +833,82 @@ class Window(QMainWindow, Ui_MainWindow):
     def checkout_to_refresh(self, checkout_type):
         if checkout_type not in ['hardware', 'users', 'locations']:
             logger.error('Invalid checkout_type.  Received: %s, expected: hardware, users, or location', checkout_type)
-        chkout_list = SnipeGet(settings.SNIPE_URL, settings.API_KEY, checkout_type).get_all()
-        if not chkout_list:
-            logger.critical('API Error, unable to get check out list')
-            sys.exit()
-        logger.debug('received %s %s.  Populating checkout model', len(chkout_list), checkout_type)
-        self.checkout_model = QtGui.QStandardItemModel()
-        for chkout_to in chkout_list:
-            id = chkout_to['id']
-            name = chkout_to['name']
-            if checkout_type == 'users':
-                name = chkout_to['username']
-            logger.debug('Adding id: %s for checkout to: %s', id, name)
-            c = QtGui.QStandardItem(name)
-            c.setData(id)
-            self.checkout_model.appendRow(c)
-        self.checkout_model.sort(0, QtCore.Qt.AscendingOrder)
+        name_key = 'username' if checkout_type == 'users' else 'name'
+        self._checkout_type = checkout_type
+        # One model for the whole list and one for searches.  Searches run
+        # on the Snipe server a page at a time and share the page cache.
+        self.checkout_search_model = LazyListModel(settings.SNIPE_URL, settings.API_KEY, checkout_type,
+                                                   name_key, self.checkout_pages, self)
+        self.checkout_search_model.page_loaded.connect(self._checkout_search_loaded)
+        self._set_checkout_model(checkout_type)
+        self._load_checkout_to()
+        if checkout_type in self.syncs and self.sync_timer.isActive():
+            self._sync(checkout_type)
+        logger.info('Finished refreshing the checkout combobox model')
+
+    def _set_checkout_model(self, checkout_type):
+        """ Sets the Check Out To list to the local copy of checkout_type
+        once it is synced.  Until then, or for locations, the list pages in
+        from Snipe as it scrolls. """
+        name_key = 'username' if checkout_type == 'users' else 'name'
+        sync = self.syncs.get(checkout_type)
+        if sync is not None and sync.loaded and checkout_type not in self._syncing:
+            self.checkout_model = IdListModel.from_rows(sync.rows, name_key, self)
+        else:
+            self.checkout_model = LazyListModel(settings.SNIPE_URL, settings.API_KEY, checkout_type,
+                                                name_key, self.checkout_pages, self)
+        # Keep whatever is in the box, chosen or being typed
+        text = self.comboBoxCheckoutTo.currentText()
         logger.debug('Setting checkout combobox model')
         self.comboBoxCheckoutTo.setModel(self.checkout_model)
-        logger.info('Finished refreshing the checkout combobox model')
+        # setModel also hands the model to the line edit's completer
+        self.checkout_completer.setModel(self.checkout_search_model)
+        self.comboBoxCheckoutTo.setEditText(text)
+
+    def _search_checkout_to(self):
+        if self.checkout_search_model is not None:
+            self.checkout_search_model.set_search(self.comboBoxCheckoutTo.currentText())
+
+    def _checkout_search_loaded(self):
+        if self.comboBoxCheckoutTo.lineEdit().hasFocus():
+            self.checkout_completer.complete()
+
+    def _checkout_to_activated(self, row):
+        """ An item was picked from the Check Out To drop down """
+        if self.checkout_model is not None and row >= 0:
+            self._select_checkout_to(self.checkout_model.id_at(row), self.checkout_model.name_at(row))
+
+    def _checkout_to_completed(self, index):
+        """ An item was picked from the search results """
+        row = self.checkout_completer.completionModel().mapToSource(index).row()
+        if self.checkout_search_model is not None and row >= 0:
+            self._select_checkout_to(self.checkout_search_model.id_at(row),
+                                     self.checkout_search_model.name_at(row))
+
+    def _select_checkout_to(self, _id, name):
+        logger.debug('Check out to: %s (%s)', name, _id)
+        self.lineEditCheckoutTo.setText(name)
+        self.lineEditCheckoutToId.setText(str(_id))
+        self.comboBoxCheckoutTo.setEditText(name)
+
+    def _clear_checkout_to(self):
+        self.lineEditCheckoutTo.setText('')
+        self.lineEditCheckoutToId.setText('')
+        self.comboBoxCheckoutTo.setEditText('')
+
+    def _load_checkout_to(self):
+        logger.debug('Updating Form.CheckoutTo from Config.CheckoutTo')
+        self.comboBoxCheckoutTo.setEditText(self.lineEditCheckoutTo.text())
+
+    def _checkout_to_id(self):
+        """ Returns the id of the chosen Check Out To, or None if the text in
+        the box is not something picked from the list """
+        if (self.comboBoxCheckoutTo.currentText()
+            and self.comboBoxCheckoutTo.currentText() == self.lineEditCheckoutTo.text()
+            and self.lineEditCheckoutToId.text().isnumeric()
+        ):
+            return int(self.lineEditCheckoutToId.text())
+        return None
     
     def _set_items_read_only(self):
         logger.debug('Setting items to read only')
@@ -554,6 +994,10 @@ class Window(QMainWindow, Ui_MainWindow):
                 checks = False
             else:
                 self.labelNotesError.setVisible(False)
+        if self.checkBoxCheckOutEnabled.isChecked() and self.checkout_model is not None:
+            if self._checkout_to_id() is None:
+                self.labelScanStatus.setText('Choose who to check out to')
+                checks = False
 
         return checks
         
@@ -575,12 +1019,12 @@ class Window(QMainWindow, Ui_MainWindow):
             
             # create the master asset with the default-values
             self._master_asset = {}
-            self._master_asset['company_id'] = self.company_model.item(self.comboBoxCompany.currentIndex()).data()
-            self._master_asset['model_id'] = self.model_model.item(self.comboBoxModel.currentIndex()).data()
-            self._master_asset['location_id'] = self.location_model.item(self.comboBoxLocation.currentIndex()).data()
-            self._master_asset['rtd_location_id'] = self.location_model.item(self.comboBoxLocation.currentIndex()).data()
-            self._master_asset['status_id'] = self.status_model.item(self.comboBoxStatus.currentIndex()).data()
-            self._master_asset['supplier_id'] = self.supplier_model.item(self.comboBoxSupplier.currentIndex()).data()
+            self._master_asset['company_id'] = self.company_model.id_at(self.comboBoxCompany.currentIndex())
+            self._master_asset['model_id'] = self.model_model.id_at(self.comboBoxModel.currentIndex())
+            self._master_asset['location_id'] = self.location_model.id_at(self.comboBoxLocation.currentIndex())
+            self._master_asset['rtd_location_id'] = self.location_model.id_at(self.comboBoxLocation.currentIndex())
+            self._master_asset['status_id'] = self.status_model.id_at(self.comboBoxStatus.currentIndex())
+            self._master_asset['supplier_id'] = self.supplier_model.id_at(self.comboBoxSupplier.currentIndex())
             if self.checkBoxAssetName.isChecked():
                 self._master_asset['name'] = self.lineEditAssetName.text()
                 # if self.checkBoxAppend.isChecked():
@@ -627,21 +1071,25 @@ class Window(QMainWindow, Ui_MainWindow):
                         else:
                             logger.warning('Unable to determine data for custom field %s', self.tabWidgetCustomFields.tabText(i))
             logger.debug(self._master_asset)
+            self._checkout = None
+            if self.checkBoxCheckOutEnabled.isChecked() and self.checkout_model is not None:
+                self._checkout = (self.comboBoxCheckOutType.currentText(), self._checkout_to_id())
             if '{{SCAN}}' not in self._master_asset.values():
                 self.labelScanning.setText('Nothing to Scan.  Nothing to do.')
                 self.lineEditScanning.setReadOnly(True)
                 self.pushButtonNext.setEnabled(False)
                 return
-            self.create_asset = SnipeGet(settings.SNIPE_URL, settings.API_KEY, 'hardware')
             self._scanning_asset = copy.deepcopy(self._master_asset)
 
             # Enable scanning items
             self.lineEditScanning.setReadOnly(False)
             self.pushButtonNext.setEnabled(True)
             # self.pushButtonNext.setDefault(True)
+            self.scan_timer.start_session()
             self._scan_next_button()
         else:
             logger.debug('Action: end scanning')
+            self.scan_timer.end_session()
             self.pushButtonScan.setText('Start\nScanning')
             self._set_items_read_write()
             
@@ -654,54 +1102,54 @@ class Window(QMainWindow, Ui_MainWindow):
 
     def _scan_next_button(self):
         if self.lineEditScanning.text():
+            owner = self.duplicates.find(self.labelScanning.text(), self.lineEditScanning.text())
+            if owner is not None:
+                # Reject it and ask for the same field again
+                message = self._duplicate_message(self.labelScanning.text(), self.lineEditScanning.text(), owner)
+                logger.warning(message)
+                self.labelScanStatus.setText(message)
+                self.lineEditScanning.setText('')
+                self.sounds.play('warning')
+                self.scan_timer.rejected()
+                return
             self._scanning_asset[self.labelScanning.text()] = self.lineEditScanning.text()
+            self.scan_timer.scanned(self.labelScanning.text())
             self.lineEditScanning.setText('')
             self.labelScanStatus.setText('Data Accepted')
-            playsound(settings.SOUND_DING, block=False)
+            self.sounds.play('ding')
         if '{{SCAN}}' in self._scanning_asset.values():
             for key, val in self._scanning_asset.items():
                 if val == '{{SCAN}}':
                     self.labelScanning.setText(key)
                     self.lineEditScanning.setFocus()
+                    self.scan_timer.prompt(key)
                     break
         else:
-            # create asset
+            # queue the asset and go straight on to the next one
             if self.checkBoxAppend.isChecked() and self.checkBoxAssetName.isChecked():
                 logger.debug(self._scanning_asset['name'] + self.lineEditAssetNameAppend.text())
                 self._scanning_asset['name'] += self.lineEditAssetNameAppend.text()
+            if self.checkBoxAppend.isChecked():
+                # The number is used as soon as the asset is queued so the
+                # next scan gets the next number without waiting on Snipe.
+                self.lineEditAssetNameAppend.setText(str(int('9' + self.lineEditAssetNameAppend.text()) + 1)[1:])
             logger.debug(self._scanning_asset)
-            _created_asset = self.create_asset.create_asset(self._scanning_asset)
-            if _created_asset['messages'] == 'Asset created successfully. :)':
-                logger.info(f'Asset Create.  Snipe ID: {_created_asset["payload"]["id"]}')
-                self.labelScanStatus.setText(f'Asset Created: {_created_asset["payload"]["id"]}')
-                if self.checkBoxAppend.isChecked():
-                    # self.lineEditAssetNameAppend.setEnabled(True)
-                    self.lineEditAssetNameAppend.setText(str(int('9' + self.lineEditAssetNameAppend.text()) + 1)[1:])
-                    # self.lineEditAssetNameAppend.setEnabled(False)
-                if settings.SAVE_ON_EXIT:
-                    self.save_settings()
-                if self.checkBoxCheckOutEnabled.isChecked():
-                    logger.debug(f'Check out is checked, Checking out SNIPE ID: {_created_asset["payload"]["id"]}')
-                    _checkedout_asset = self.create_asset.checkout_asset(
-                        _created_asset["payload"]["id"],
-                        self.comboBoxCheckOutType.currentText(),
-                        self.checkout_model.item(self.comboBoxCheckoutTo.currentIndex()).data(),
-                    )
-                    if _checkedout_asset['messages'] == 'Asset checked out successfully.':
-                        logger.info(f'Asset Checked out.  Asset Snipe ID: {_created_asset["payload"]["id"]}, Checkout ID: {_checkedout_asset["payload"]["asset"]}')
-                        self.labelScanStatus.setText(f'Asset Checked Out: {_created_asset["payload"]["id"]} - {_checkedout_asset["payload"]["asset"]}')
-                        playsound(settings.SOUND_SUCCESS, block=False)
-                    else:
-                        logger.warning(f'Asset created, but not checked out: {_checkedout_asset["messages"]}')
-                        self.labelScanStatus.setText(f'Asset Created, check out fail: {_created_asset["payload"]["id"]}')
-                        playsound(settings.SOUND_WARNING, block=False)
-                else:
-                    self.labelScanStatus.setText(f'Asset Created: {_created_asset["payload"]["id"]}')
-                    playsound(settings.SOUND_SUCCESS, block=False)
-            else:
-                logger.warning(f'Asset not created: {_created_asset["messages"]}')
-                self.labelScanStatus.setText(f'Asset Not Created')
-                playsound(settings.SOUND_WARNING, block=False)
+            job = self.pipeline.submit(self._scanning_asset, self._checkout)
+            self.duplicates.add_pending(job, self._scanning_asset)
+            self.scan_timer.queued(job)
+            self.labelScanStatus.setText(f'Asset Queued ({self.pipeline.in_flight()} in flight)')
             self._scanning_asset = copy.deepcopy(self._master_asset)
             self._scan_next_button()
 
+    def _submission_finished(self, result):
+        """ Called on the GUI thread when a queued asset has been submitted """
+        self.labelScanStatus.setText(result['message'])
+        if result['status'] in ('created', 'checked_out', 'checkout_failed'):
+            self.duplicates.created(result['job'], result['snipe_id'], result['asset'])
+        elif result['status'] == 'failed':
+            self.duplicates.discard(result['job'])
+        if result['status'] in ('created', 'checked_out', 'checkout_failed'):
+            if settings.SAVE_ON_EXIT:
+                self.settings_writer.mark_dirty()
+        self.sounds.play(result['sound'])
+        self.scan_timer.finished(result)
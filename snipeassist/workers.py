@@ -0,0 +1,61 @@
+"""Helpers to run blocking work (mostly Snipe API calls) off the GUI thread"""
+import logging
+
+from PySide6 import QtCore
+
+logger = logging.getLogger(__name__)
+
+# Tasks are kept here until they finish so their signal objects are not
+# garbage collected before the queued signals reach the GUI thread.
+_running = set()
+
+
+class TaskSignals(QtCore.QObject):
+    finished = QtCore.Signal(object)
+    failed = QtCore.Signal(str)
+    progress = QtCore.Signal(object)
+
+
+class Task(QtCore.QRunnable):
+    """Runs fn(*args, **kwargs) on a QThreadPool thread.  The return value is
+    emitted with signals.finished, an exception message with signals.failed.
+    If report_progress is True, fn is also passed progress=callable which
+    emits signals.progress with whatever it is called with."""
+
+    def __init__(self, fn, *args, report_progress=False, **kwargs):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = TaskSignals()
+        if report_progress:
+            self.kwargs['progress'] = self.signals.progress.emit
+
+    def run(self):
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except Exception as e:
+            logger.warning('Background task %s failed: %s', getattr(self.fn, '__name__', self.fn), e)
+            self.signals.failed.emit(str(e))
+        else:
+            self.signals.finished.emit(result)
+
+
+def run_task(fn, *args, on_finished=None, on_failed=None, on_progress=None, pool=None, **kwargs):
+    """Starts fn(*args, **kwargs) on pool (default: the global QThreadPool).
+    on_finished(result), on_failed(message) and on_progress(value) are called
+    on the GUI thread.  If on_progress is given fn must accept progress=."""
+    task = Task(fn, *args, report_progress=on_progress is not None, **kwargs)
+    _running.add(task)
+    if on_progress:
+        task.signals.progress.connect(on_progress)
+    if on_finished:
+        task.signals.finished.connect(on_finished)
+    if on_failed:
+        task.signals.failed.connect(on_failed)
+    task.signals.finished.connect(lambda _result: _running.discard(task))
+    task.signals.failed.connect(lambda _message: _running.discard(task))
+    if pool is None:
+        pool = QtCore.QThreadPool.globalInstance()
+    pool.start(task)
+    return task